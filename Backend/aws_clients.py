@@ -0,0 +1,56 @@
+import os
+import threading
+
+# boto3 clients are created on first use in each process instead of at
+# import time. A client created before a fork would share its connection
+# pool with the children, so every worker builds its own.
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service, region_name, endpoint_url=None):
+    key = (service, region_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+
+                client = boto3.client(service, region_name=region_name, endpoint_url=endpoint_url)
+                _clients[key] = client
+    return client
+
+
+def _reset_after_fork():
+    global _lock
+    _clients.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Module-level stand-in for a boto3 client: attribute access goes to this
+# process's client, which is created on first use
+class LazyClient:
+    def __init__(self, service, region_name, endpoint_url=None):
+        self.service = service
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+
+    @property
+    def client(self):
+        return get_client(self.service, self.region_name, self.endpoint_url)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    # Function to reference an API call without creating the client yet;
+    # `fixed` keyword arguments are passed on every call
+    def method(self, name, **fixed):
+        def call(*args, **kwargs):
+            return getattr(self.client, name)(*args, **fixed, **kwargs)
+
+        call.__name__ = name
+        return call
@@ -0,0 +1,66 @@
+# Command-line counterpart of POST /upload-batch.
+#
+# Runs the same batch pipeline in-process (hash + cache check, concurrent S3
+# uploads, Textract jobs under the batch concurrency and TPS limits) and
+# prints one NDJSON line per document as it completes, then a summary line.
+#
+#   python batch_ingest.py scans/ referrals.zip --feature FORMS --concurrency 8 > results.ndjson
+import argparse
+import asyncio
+import mimetypes
+import os
+import sys
+
+import regex_ner
+
+
+# Function to expand the command-line paths (files, directories, zips) into files
+def collect_paths(paths):
+    collected = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                collected.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            collected.append(path)
+    return collected
+
+
+async def run(args):
+    regex_ner.job_manager.start()
+    sources = []
+    archives = []
+    try:
+        for path in collect_paths(args.paths):
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            sources.append((open(path, "rb"), os.path.basename(path), content_type))
+        documents, archives = regex_ner.expand_archives(sources)
+
+        batch = regex_ner.new_batch(len(documents), args.feature, args.concurrency)
+        print(f"batch {batch['batch_id']}: {len(documents)} documents", file=sys.stderr)
+        prepared = await regex_ner.prepare_batch(documents, args.feature, batch, args.upload_concurrency)
+        async for line in regex_ner.iter_batch_ndjson(prepared, args.feature, batch, args.concurrency):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+    finally:
+        for archive in archives:
+            archive.close()
+        for file_obj, _, _ in sources:
+            file_obj.close()
+        await regex_ner.job_manager.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run OCR over many documents or zip archives")
+    parser.add_argument("paths", nargs="+", help="files, directories or zip archives")
+    parser.add_argument("--feature", default="TEXT", choices=sorted(regex_ner.TEXTRACT_FEATURES))
+    parser.add_argument("--concurrency", type=int, default=regex_ner.BATCH_CONCURRENCY,
+                        help="Textract jobs in flight at once")
+    parser.add_argument("--upload-concurrency", type=int, default=regex_ner.BATCH_UPLOAD_CONCURRENCY,
+                        help="S3 uploads in flight at once")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Benchmark: form key/value extraction over synthetic Textract responses.
+#
+# Compares the original per-lookup linear scan (quadratic overall) with the
+# BlockGraph index (linear overall) for 1k to 100k blocks.
+#
+#   python benchmarks/bench_block_graph.py --sizes 1000 10000 100000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from block_graph import BlockGraph  # noqa: E402
+
+
+# Build a response with one PAGE and a stream of key/value pairs, each made of
+# KEY + VALUE KEY_VALUE_SET blocks and two WORD children apiece (6 blocks)
+def synthetic_blocks(block_count):
+    blocks = [{"Id": "page", "BlockType": "PAGE", "Page": 1}]
+    pair = 0
+    while len(blocks) < block_count:
+        key_id, value_id = f"k{pair}", f"v{pair}"
+        key_words = [f"kw{pair}a", f"kw{pair}b"]
+        value_words = [f"vw{pair}a", f"vw{pair}b"]
+        blocks.append({
+            "Id": key_id, "BlockType": "KEY_VALUE_SET", "EntityTypes": ["KEY"], "Page": 1,
+            "Relationships": [{"Type": "VALUE", "Ids": [value_id]}, {"Type": "CHILD", "Ids": key_words}],
+        })
+        blocks.append({
+            "Id": value_id, "BlockType": "KEY_VALUE_SET", "EntityTypes": ["VALUE"], "Page": 1,
+            "Relationships": [{"Type": "CHILD", "Ids": value_words}],
+        })
+        for word_id in key_words:
+            blocks.append({"Id": word_id, "BlockType": "WORD", "Text": f"Field{pair}", "Page": 1})
+        for word_id in value_words:
+            blocks.append({"Id": word_id, "BlockType": "WORD", "Text": f"value{pair}", "Page": 1})
+        pair += 1
+    return blocks
+
+
+# The extraction loop as it was in upload_form, kept here as the baseline
+def legacy_key_values(blocks):
+    extracted_key_values = {}
+    for block in blocks:
+        if block['BlockType'] == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', []):
+            key_text = ''
+            for relationship in block.get('Relationships', []):
+                if relationship['Type'] == 'CHILD':
+                    for child_id in relationship['Ids']:
+                        child_block = next((b for b in blocks if b['Id'] == child_id), None)
+                        if child_block and 'Text' in child_block:
+                            key_text += child_block['Text']
+
+            value_text = ''
+            value_block = next((b for b in blocks if b['Id'] in block.get('Relationships', [])[0].get('Ids', [])), None)
+            if value_block:
+                for relationship in value_block.get('Relationships', []):
+                    if relationship['Type'] == 'CHILD':
+                        for child_id in relationship['Ids']:
+                            child_block = next((b for b in blocks if b['Id'] == child_id), None)
+                            if child_block and 'Text' in child_block:
+                                value_text += child_block['Text']
+
+            if key_text and value_text:
+                extracted_key_values[key_text] = value_text
+    return extracted_key_values
+
+
+def timed(fn, blocks):
+    start = time.perf_counter()
+    result = fn(blocks)
+    return time.perf_counter() - start, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark form key/value extraction")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="skip the quadratic baseline above this many blocks")
+    args = parser.parse_args()
+
+    print(f"{'blocks':>8} {'pairs':>7} {'graph':>10} {'legacy':>10} {'speedup':>8}")
+    for size in args.sizes:
+        blocks = synthetic_blocks(size)
+        graph_seconds, pairs = timed(lambda b: BlockGraph(b).key_values(), blocks)
+        if size <= args.legacy_max:
+            legacy_seconds, _ = timed(legacy_key_values, blocks)
+            legacy, speedup = f"{legacy_seconds:.4f}s", f"{legacy_seconds / graph_seconds:.0f}x"
+        else:
+            legacy, speedup = "skipped", "-"
+        print(f"{len(blocks):>8} {pairs:>7} {graph_seconds:>9.4f}s {legacy:>10} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
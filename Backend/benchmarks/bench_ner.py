@@ -0,0 +1,90 @@
+# Benchmark: per-request full-pipeline NER vs the batched, trimmed service.
+#
+# "baseline" mirrors the old process_with_ner: the full en_core_web_sm
+# pipeline, one nlp() call per request. "service" submits the same texts
+# from concurrent coroutines through ner_service.NerBatcher.
+#
+#   python benchmarks/bench_ner.py --requests 2000 --concurrency 32
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ner_service  # noqa: E402
+
+FIRST_NAMES = ["Asha", "Rahul", "Priya", "Vikram", "Meera", "John", "Sara", "Arjun"]
+LAST_NAMES = ["Sharma", "Patel", "Iyer", "Reddy", "Singh", "Smith", "Khan", "Das"]
+CITIES = ["Mumbai", "Delhi", "Bengaluru", "Chennai", "Pune", "Hyderabad", "Kolkata"]
+
+
+# Text shaped like the joined key/value values of an intake form
+def synthetic_form_text(rng):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    return (f"{name} {rng.randint(18, 90)} Male {rng.choice(CITIES)} "
+            f"+91 98{rng.randint(10000000, 99999999)} {name.split()[0].lower()}@example.com "
+            f"Referred by Dr. {rng.choice(LAST_NAMES)} for follow up")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_baseline(texts):
+    import spacy
+
+    nlp = spacy.load(ner_service.NER_MODEL)
+    latencies = []
+    start = time.perf_counter()
+    for text in texts:
+        request_start = time.perf_counter()
+        doc = nlp(text)
+        [(ent.text, ent.label_) for ent in doc.ents]
+        latencies.append(time.perf_counter() - request_start)
+    return time.perf_counter() - start, latencies
+
+
+async def run_service(texts, concurrency):
+    ner_service.get_nlp()
+    ner_service.batcher.start()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(text):
+        async with semaphore:
+            request_start = time.perf_counter()
+            await ner_service.batcher.submit(text)
+            latencies.append(time.perf_counter() - request_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(text) for text in texts))
+    elapsed = time.perf_counter() - start
+    await ner_service.batcher.stop()
+    return elapsed, latencies
+
+
+def report(name, elapsed, latencies):
+    print(f"{name:>9}: {len(latencies) / elapsed:8.1f} docs/s  "
+          f"p50 {percentile(latencies, 0.50) * 1000:7.2f} ms  p95 {percentile(latencies, 0.95) * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NER throughput and latency")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    texts = [synthetic_form_text(rng) for _ in range(args.requests)]
+
+    report("baseline", *run_baseline(texts))
+    elapsed, latencies = asyncio.run(run_service(texts, args.concurrency))
+    report("service", elapsed, latencies)
+    print(f"batches: {ner_service.batcher.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Benchmark: PII extraction throughput in MB/s.
+#
+# "legacy" is the old process_with_ner regex step (compile per call, lower()
+# copy, one pass per pattern, phones and emails only). "per-pattern" scans
+# every pattern of PII_PATTERNS separately, "single-pass" is
+# pii_extractor.find_pii over all patterns, "streaming" feeds the same text
+# through iter_pii in 1 MiB chunks and "extract_pii" is the end-to-end call
+# the OCR endpoint makes.
+#
+#   python benchmarks/bench_pii.py --megabytes 32
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pii_extractor import PII_CHUNK_SIZE, PII_PATTERNS, extract_pii, find_pii, iter_pii  # noqa: E402
+
+FRAGMENTS = [
+    "Patient reports mild fever and cough since three days. ",
+    "Contact +91 98765 43210 for follow up. ",
+    "Email asha.sharma@example.com ",
+    "ABHA 91-1234-5678-9012 ",
+    "Aadhaar XXXX XXXX 4821 ",
+    "Address 12 MG Road Bengaluru 560001 ",
+    "PHR asha.sharma@abdm ",
+    "BP 120/80 pulse 72 SpO2 98 percent. ",
+]
+
+
+def synthetic_text(megabytes, seed=7):
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < megabytes * 1e6:
+        fragment = rng.choice(FRAGMENTS)
+        parts.append(fragment)
+        size += len(fragment)
+    return ''.join(parts)
+
+
+def legacy(text):
+    phone_regex = re.compile(r'\+?\d[\d -]{8,}\d')
+    email_regex = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+    lowered = text.lower()
+    return phone_regex.findall(lowered) + email_regex.findall(lowered)
+
+
+SEPARATE_PATTERNS = [re.compile(r"(?<![A-Za-z0-9])(?:" + pattern + ")") for _, pattern in PII_PATTERNS]
+
+
+def per_pattern(text):
+    return [m for regex in SEPARATE_PATTERNS for m in regex.finditer(text)]
+
+
+def streaming(text):
+    chunks = (text[i:i + PII_CHUNK_SIZE] for i in range(0, len(text), PII_CHUNK_SIZE))
+    return list(iter_pii(chunks))
+
+
+def measure(name, fn, text, repeat):
+    best = min(timed(fn, text) for _ in range(repeat))
+    megabytes = len(text.encode("utf-8")) / 1e6
+    print(f"{name:>12}: {megabytes / best:8.1f} MB/s  ({len(fn(text))} matches)")
+
+
+def timed(fn, text):
+    start = time.perf_counter()
+    fn(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PII extraction throughput")
+    parser.add_argument("--megabytes", type=float, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = synthetic_text(args.megabytes)
+    measure("legacy", legacy, text, args.repeat)
+    measure("per-pattern", per_pattern, text, args.repeat)
+    measure("single-pass", lambda t: find_pii(t, chunk_size=len(t)), text, args.repeat)
+    measure("streaming", streaming, text, args.repeat)
+    measure("extract_pii", lambda t: [value for values in extract_pii(t).values() for value in values], text, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Benchmark: import time and memory of the apps, and per-worker RSS/PSS
+# under gunicorn.
+#
+# Import time and peak RSS are measured in a fresh interpreter per module.
+# With --workers, gunicorn is started with gunicorn.conf.py and the RSS and
+# PSS (proportional set size: shared pages are split between the processes
+# sharing them) of the master and every worker are read from /proc, so the
+# copy-on-write sharing of the preloaded spaCy model shows up as PSS well
+# below RSS. Linux only.
+#
+#   python benchmarks/bench_startup.py --workers 4
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import json, resource, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def measure_import(module, env):
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_PROBE.format(module=module)], cwd=BACKEND_DIR, env=env, text=True,
+    )
+    result = json.loads(output.strip().splitlines()[-1])
+    return {"module": module, "seconds": round(result["seconds"], 3), "peak_rss_mb": round(result["peak_rss_mb"], 1)}
+
+
+# Function to read RSS and PSS (in MB) of a process from /proc
+def memory_of(pid):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name.lower() + "_mb"] = round(int(rest.split()[0]) / 1024, 1)
+    return values
+
+
+def children_of(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as file:
+        return [int(child) for child in file.read().split()]
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return True
+        time.sleep(0.2)
+    return False
+
+
+def measure_workers(workers, port, env, timeout):
+    env = {**env, "WEB_CONCURRENCY": str(workers), "BIND": f"127.0.0.1:{port}"}
+    start = time.perf_counter()
+    master = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], cwd=BACKEND_DIR, env=env)
+    try:
+        if not wait_for_port(port, timeout):
+            raise RuntimeError("gunicorn did not start listening in time")
+        ready_seconds = time.perf_counter() - start
+        # Give every worker time to finish its lifespan startup
+        deadline = time.monotonic() + timeout
+        while len(children_of(master.pid)) < workers and time.monotonic() < deadline:
+            time.sleep(0.2)
+        time.sleep(1)
+        processes = [{"role": "master", "pid": master.pid, **memory_of(master.pid)}]
+        processes += [{"role": "worker", "pid": pid, **memory_of(pid)} for pid in children_of(master.pid)]
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=30)
+    worker_rows = [process for process in processes if process["role"] == "worker"]
+    return {
+        "workers": workers,
+        "ready_seconds": round(ready_seconds, 2),
+        "processes": processes,
+        "total_rss_mb": round(sum(process["rss_mb"] for process in processes), 1),
+        "total_pss_mb": round(sum(process["pss_mb"] for process in processes), 1),
+        "avg_worker_pss_mb": round(sum(row["pss_mb"] for row in worker_rows) / max(len(worker_rows), 1), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import time and per-worker memory")
+    parser.add_argument("--modules", nargs="+", default=["main", "regex_ner", "server"])
+    parser.add_argument("--workers", type=int, default=0, help="also start gunicorn with this many workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {"imports": [], "gunicorn": []}
+    for preload in ("0", "1"):
+        env = {**os.environ, "PRELOAD_NER_MODEL": preload}
+        for module in args.modules:
+            if module != "server" and preload == "1":
+                continue
+            result = {**measure_import(module, env), "preload_ner_model": preload == "1"}
+            results["imports"].append(result)
+            print(f"import {module:<10} preload={preload}  {result['seconds']:>6.2f}s  {result['peak_rss_mb']:>7.1f} MB peak RSS")
+
+    # Workers are measured with the model preloaded, as deployed; without it
+    # each worker would load its own copy on the first NER request
+    if args.workers:
+        result = measure_workers(args.workers, args.port, dict(os.environ), args.timeout)
+        results["gunicorn"].append(result)
+        print(f"gunicorn {args.workers} workers: ready in {result['ready_seconds']}s, "
+              f"RSS {result['total_rss_mb']} MB, PSS {result['total_pss_mb']} MB, "
+              f"{result['avg_worker_pss_mb']} MB PSS per worker")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
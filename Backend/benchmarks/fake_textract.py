@@ -0,0 +1,129 @@
+# Offline stand-in for the Textract client used by regex_ner.py.
+#
+# Start* calls return a job id right away and Get* calls replay recorded
+# responses page by page through NextToken, the same way Textract does. A
+# recording is a JSON list of Get* responses; without one, synthetic LINE
+# and KEY_VALUE_SET blocks are generated. Record a real job with:
+#
+#   python benchmarks/fake_textract.py record <textract-job-id> recording.json --feature FORMS
+import argparse
+import json
+import uuid
+
+BLOCKS_PER_RESPONSE = 1000
+
+
+# Function to build one synthetic document: per page, LINE blocks with
+# WORD children and KEY/VALUE pairs, in Textract's block order
+def synthetic_blocks(pages=10, lines_per_page=50, pairs_per_page=20):
+    blocks = []
+    for page in range(1, pages + 1):
+        blocks.append({"Id": f"p{page}", "BlockType": "PAGE", "Page": page})
+        for line in range(lines_per_page):
+            top = line / lines_per_page
+            blocks.append({
+                "Id": f"p{page}l{line}", "BlockType": "LINE", "Page": page,
+                "Text": f"Patient visit note {page}.{line} blood pressure 120/80 pulse 72",
+                "Confidence": 60.0 + (page * 31 + line * 17) % 40,
+                "Geometry": {"BoundingBox": {"Left": 0.05, "Top": top, "Width": 0.9, "Height": 0.8 / lines_per_page}},
+            })
+        for pair in range(pairs_per_page):
+            key_id, value_id = f"p{page}k{pair}", f"p{page}v{pair}"
+            blocks.append({
+                "Id": key_id, "BlockType": "KEY_VALUE_SET", "EntityTypes": ["KEY"], "Page": page,
+                "Relationships": [{"Type": "VALUE", "Ids": [value_id]}, {"Type": "CHILD", "Ids": [f"{key_id}w"]}],
+            })
+            blocks.append({
+                "Id": value_id, "BlockType": "KEY_VALUE_SET", "EntityTypes": ["VALUE"], "Page": page,
+                "Relationships": [{"Type": "CHILD", "Ids": [f"{value_id}w"]}],
+            })
+            blocks.append({"Id": f"{key_id}w", "BlockType": "WORD", "Text": f"Field{pair}", "Page": page})
+            blocks.append({"Id": f"{value_id}w", "BlockType": "WORD", "Text": f"value {page}-{pair}", "Page": page})
+    return blocks
+
+
+# Function to split a block list into paginated Get* responses
+def paginate(blocks, per_response=BLOCKS_PER_RESPONSE, status="SUCCEEDED"):
+    responses = []
+    for start in range(0, max(len(blocks), 1), per_response):
+        responses.append({"JobStatus": status, "Blocks": blocks[start:start + per_response]})
+    for index, response in enumerate(responses[:-1]):
+        response["NextToken"] = str(index + 1)
+    return responses
+
+
+class FakeTextract:
+    def __init__(self, responses=None, in_progress_polls=0):
+        self.responses = responses if responses is not None else paginate(synthetic_blocks())
+        # Number of Get* polls answered with IN_PROGRESS before the results
+        self.in_progress_polls = in_progress_polls
+        self.jobs = {}
+        self.calls = 0
+
+    @classmethod
+    def from_recording(cls, path, **kwargs):
+        with open(path) as file:
+            recording = json.load(file)
+        if isinstance(recording, dict):
+            recording = paginate(recording["Blocks"])
+        return cls(recording, **kwargs)
+
+    @property
+    def block_count(self):
+        return sum(len(response["Blocks"]) for response in self.responses)
+
+    def _start(self, **kwargs):
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = self.in_progress_polls
+        return {"JobId": job_id}
+
+    def _get(self, JobId, NextToken=None, **kwargs):
+        self.calls += 1
+        if NextToken is None and self.jobs.get(JobId, 0) > 0:
+            self.jobs[JobId] -= 1
+            return {"JobStatus": "IN_PROGRESS"}
+        return self.responses[int(NextToken or 0)]
+
+    start_document_text_detection = _start
+    start_document_analysis = _start
+    get_document_text_detection = _get
+    get_document_analysis = _get
+
+
+# Function to save every result page of a finished Textract job as a recording
+def record_job(client, job_id, path, feature="TEXT"):
+    from textract_results import iter_result_pages
+
+    get_fn = client.get_document_analysis if feature == "FORMS" else client.get_document_text_detection
+    responses = [
+        {key: value for key, value in response.items() if key in ("JobStatus", "Blocks", "NextToken", "Warnings")}
+        for response in iter_result_pages(get_fn, job_id)
+    ]
+    with open(path, "w") as file:
+        json.dump(responses, file)
+    return len(responses)
+
+
+def main():
+    import os
+    import sys
+
+    import boto3
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description="Record Textract job results for offline benchmarks")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    record = subcommands.add_parser("record")
+    record.add_argument("job_id")
+    record.add_argument("path")
+    record.add_argument("--feature", default="TEXT", choices=("TEXT", "FORMS"))
+    record.add_argument("--region", default="ap-southeast-2")
+    args = parser.parse_args()
+
+    client = boto3.client("textract", region_name=args.region)
+    pages = record_job(client, args.job_id, args.path, args.feature)
+    print(f"recorded {pages} result pages of {args.job_id} to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
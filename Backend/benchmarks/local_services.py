@@ -0,0 +1,62 @@
+# Local stand-ins shared by the benchmarks and tests/conftest.py: an
+# in-process moto S3 server and the export query registries with main.py's
+# on-disk state kept out of the working tree. Synthetic data comes from
+# synthetic_schema.py.
+import os
+import socket
+import tempfile
+
+S3_REGION = "ap-southeast-2"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Function to start an in-process moto S3 server; returns (server, endpoint)
+def start_moto():
+    from moto.server import ThreadedMotoServer
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "testing")
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+# Function to create a bucket if it does not exist yet; returns the client
+def make_bucket(endpoint, bucket):
+    import boto3
+
+    s3_client = boto3.client("s3", region_name=S3_REGION, endpoint_url=endpoint)
+    try:
+        s3_client.create_bucket(Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": S3_REGION})
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    return s3_client
+
+
+# Function to import TABLE_QUERIES and NESTED_QUERIES from main.py with its
+# incremental state and export files in a throwaway directory
+def export_registries():
+    if "INCREMENTAL_STATE_PATH" not in os.environ or "EXPORT_DIR" not in os.environ:
+        state_dir = tempfile.mkdtemp(prefix="bench-")
+        os.environ.setdefault("INCREMENTAL_STATE_PATH", os.path.join(state_dir, "export_state.db"))
+        os.environ.setdefault("EXPORT_DIR", os.path.join(state_dir, "downloads"))
+    from main import NESTED_QUERIES, TABLE_QUERIES
+
+    return TABLE_QUERIES, NESTED_QUERIES
+
+
+# Function to list the SQL of the given registered queries (all of them by
+# default), the input synthetic_schema derives its tables from
+def export_statements(names=None):
+    statements = []
+    for registry in export_registries():
+        for name, query in registry.queries.items():
+            if names is None or name in names:
+                statements.append(query.sql)
+    return statements
@@ -0,0 +1,88 @@
+# Synthetic Postgres schema for benchmarks, derived from the export queries.
+#
+# Every table referenced by a registered query gets a table with a few
+# common report columns plus every alias.column the queries use. Columns
+# ending in _id (except branch/facility/patient ids) are foreign keys: their
+# tables get `fanout` rows per parent row, spread over all parents, so the
+# joins in the combined_* queries multiply rows the way production data does.
+import re
+
+# Schema the benchmarks seed; create_schema drops and recreates it
+BENCH_SCHEMA = "bench_synthetic"
+
+SQL_KEYWORDS = {"on", "where", "left", "right", "inner", "outer", "join", "group", "order", "limit", "as", "cross"}
+TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+COLUMN_REFERENCE = re.compile(r"\b(\w+)\.(\w+)\b")
+
+# Columns every synthetic table has, with the expression that fills them
+COMMON_COLUMNS = {
+    "id": ("bigint PRIMARY KEY", "g"),
+    "branch_id": ("text", "mod(g, {branches})::text"),
+    "facility_id": ("text", "mod(g, {facilities})::text"),
+    "patient_id": ("text", "md5(g::text)"),
+    "status": ("text", "(ARRAY['ACTIVE', 'COMPLETED', 'CANCELLED'])[1 + mod(g, 3)]"),
+    "code": ("text", "'SCT' || mod(g * 31, 997)"),
+    "notes": ("text", "repeat('observation note ', 1 + mod(g, 20))"),
+    "amount": ("numeric(12,2)", "mod(g, 5000)::numeric / 7"),
+    "link_withabha": ("boolean", "mod(g, 2) = 0"),
+    "created_at": ("timestamp", "timestamp '2024-01-01' + (g || ' minutes')::interval"),
+    "updated_at": ("timestamp", "timestamp '2024-01-01' + (g || ' minutes')::interval"),
+}
+TEXT_ID_COLUMNS = ("branch_id", "facility_id", "patient_id")
+
+
+# Function to collect {table: set(columns)} from SQL statements
+def referenced_columns(statements):
+    tables = {}
+    for statement in statements:
+        aliases = {}
+        for table, alias in TABLE_REFERENCE.findall(statement):
+            tables.setdefault(table, set())
+            aliases[table] = table
+            if alias and alias.lower() not in SQL_KEYWORDS:
+                aliases[alias] = table
+        for alias, column in COLUMN_REFERENCE.findall(statement):
+            if alias in aliases:
+                tables[aliases[alias]].add(column)
+    return tables
+
+
+def is_foreign_key(column):
+    return column.endswith("_id") and column not in TEXT_ID_COLUMNS
+
+
+# Function to build the DDL and INSERT statements of the synthetic schema
+def schema_statements(statements, schema, rows, fanout=2, branches=10, facilities=3):
+    tables = referenced_columns(statements)
+    yield f"DROP SCHEMA IF EXISTS {schema} CASCADE"
+    yield f"CREATE SCHEMA {schema}"
+    for table, columns in sorted(tables.items()):
+        foreign_keys = sorted(column for column in columns if is_foreign_key(column))
+        table_rows = rows * fanout if foreign_keys else rows
+        definitions = dict(COMMON_COLUMNS)
+        for column in foreign_keys:
+            definitions[column] = ("bigint", f"1 + mod(g * 7919, {rows})")
+        for column in sorted(columns - set(definitions)):
+            definitions[column] = ("text", f"'{column}-' || g")
+        column_list = ", ".join(f"{name} {spec[0]}" for name, spec in definitions.items())
+        select_list = ", ".join(
+            spec[1].format(branches=branches, facilities=facilities) for spec in definitions.values()
+        )
+        yield f"CREATE TABLE {schema}.{table} ({column_list})"
+        yield f"INSERT INTO {schema}.{table} SELECT {select_list} FROM generate_series(1, {table_rows}) AS g"
+        for column in foreign_keys + ["branch_id", "facility_id"]:
+            yield f"CREATE INDEX ON {schema}.{table} ({column})"
+    yield "ANALYZE"
+
+
+# Function to create the synthetic schema; returns {table: row count}
+def create_schema(conn, statements, schema, rows, fanout=2, branches=10, facilities=3):
+    with conn, conn.cursor() as cursor:
+        for statement in schema_statements(statements, schema, rows, fanout, branches, facilities):
+            cursor.execute(statement)
+        cursor.execute(
+            "SELECT relname, reltuples::bigint FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = %s AND c.relkind = 'r' ORDER BY relname",
+            (schema,),
+        )
+        return dict(cursor.fetchall())
@@ -0,0 +1,64 @@
+# Index over Textract blocks for resolving relationships in linear time.
+#
+# A form key/value pair in Textract is a chain of blocks:
+#   KEY_VALUE_SET (KEY) --CHILD--> WORD / SELECTION_ELEMENT
+#                       --VALUE--> KEY_VALUE_SET (VALUE) --CHILD--> WORD / SELECTION_ELEMENT
+# A block may carry several relationship entries of the same type and each
+# entry may list several Ids, so every entry is followed, not just the first.
+
+
+class BlockGraph:
+    def __init__(self, blocks):
+        self.blocks = {}
+        self.key_blocks = []
+        for block in blocks:
+            self.blocks[block['Id']] = block
+            if block['BlockType'] == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', []):
+                self.key_blocks.append(block)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def get(self, block_id):
+        return self.blocks.get(block_id)
+
+    # Ids from every relationship entry of the given type
+    def related_ids(self, block, relationship_type):
+        for relationship in block.get('Relationships', []):
+            if relationship['Type'] == relationship_type:
+                yield from relationship.get('Ids', [])
+
+    # Blocks from every relationship entry of the given type, skipping Ids
+    # that are not part of this graph
+    def related(self, block, relationship_type):
+        for block_id in self.related_ids(block, relationship_type):
+            related_block = self.blocks.get(block_id)
+            if related_block is not None:
+                yield related_block
+
+    # Text of a KEY or VALUE block: its WORD children, plus the selection
+    # state of any SELECTION_ELEMENT children (check boxes, radio buttons)
+    def text(self, block):
+        parts = []
+        for child in self.related(block, 'CHILD'):
+            if child['BlockType'] == 'WORD' and 'Text' in child:
+                parts.append(child['Text'])
+            elif child['BlockType'] == 'SELECTION_ELEMENT':
+                parts.append(child.get('SelectionStatus', ''))
+        return ' '.join(part for part in parts if part)
+
+    def value_blocks(self, key_block):
+        return self.related(key_block, 'VALUE')
+
+    # Generator of (key_text, value_text, key_block) for every KEY in the graph
+    def iter_key_values(self):
+        for key_block in self.key_blocks:
+            key_text = self.text(key_block)
+            value_text = ' '.join(
+                text for text in (self.text(value_block) for value_block in self.value_blocks(key_block)) if text
+            )
+            yield key_text, value_text, key_block
+
+    # Function to map key text to value text, dropping empty keys or values
+    def key_values(self):
+        return {key_text: value_text for key_text, value_text, _ in self.iter_key_values() if key_text and value_text}
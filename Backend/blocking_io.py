@@ -0,0 +1,57 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the shared executor that runs blocking psycopg2/boto3 calls.
+# Keep it at least as large as DB_POOL_MAX_SIZE so pooled connections
+# never wait on a free thread.
+IO_WORKERS = int(os.environ.get("IO_WORKERS", "32"))
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="blocking-io")
+    return _executor
+
+
+# Run a blocking function on the shared executor without blocking the event loop
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+# Drive a blocking iterator (e.g. a server-side cursor feeding iter_csv) from
+# async code, one item per executor hop. The iterator is closed on exit so
+# that cursors and pooled connections are released on client disconnect.
+async def iterate_in_executor(iterator):
+    sentinel = object()
+    try:
+        while True:
+            item = await run_blocking(next, iterator, sentinel)
+            if item is sentinel:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await run_blocking(close)
+
+
+# Executor threads do not survive fork; children create their own
+def _reset_executor_after_fork():
+    global _executor
+    _executor = None
+
+
+os.register_at_fork(after_in_child=_reset_executor_after_fork)
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -1,12 +1,280 @@
 # database.py
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import extensions, sql
+
+# Connection settings, overridable from the environment
+DB_CONFIG = {
+    "dbname": os.environ.get("DB_NAME", "swingbell"),
+    "user": os.environ.get("DB_USER", "asimith"),
+    "password": os.environ.get("DB_PASSWORD", "asimith"),
+    "host": os.environ.get("DB_HOST", "13.126.33.160"),
+    "port": os.environ.get("DB_PORT", "5432"),
+}
+
+# Pool sizing
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+# Idle connections older than this are pinged before being handed out
+DB_POOL_HEALTHCHECK_AFTER = float(os.environ.get("DB_POOL_HEALTHCHECK_AFTER", "30"))
+
+# Errors that mean the connection itself is unusable
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
 
 def get_connection():
-    return psycopg2.connect(
-        dbname="swingbell",
-        user="asimith",
-        password="asimith",
-        host="13.126.33.160",
-        port="5432"
-    )
+    return psycopg2.connect(**DB_CONFIG)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Bounded, thread-safe connection pool. Callers block (up to timeout) when
+# all max_size connections are checked out. Idle connections are health
+# checked before reuse and transparently replaced when they have dropped.
+class ConnectionPool:
+    def __init__(self, connect=get_connection, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, returned_at), most recently used last
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        # Stats used to size the pool
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+            self._size += 1
+
+    def _new_connection(self):
+        conn = self._connect()
+        logging.info("Opened new database connection")
+        return conn
+
+    def _is_alive(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # Check a connection out of the pool, waiting for one to be returned
+    # when the pool is at max_size
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    conn, returned_at = None, None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {timeout}s")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self.checkouts += 1
+            self._in_use += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+        try:
+            if conn is None:
+                conn = self._new_connection()
+            elif time.monotonic() - returned_at > self.healthcheck_after and not self._is_alive(conn):
+                logging.warning("Dropped database connection detected, reconnecting")
+                self._close_quietly(conn)
+                with self._cond:
+                    self.reconnects += 1
+                conn = self._new_connection()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    # Return a connection to the pool; broken or discarded connections are closed
+    def putconn(self, conn, discard=False):
+        if not conn.closed and not discard:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except CONNECTION_ERRORS:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if conn.closed or discard or self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    # Per-request cursor: commits on success, rolls back on error
+    @contextmanager
+    def cursor(self, timeout=None, name=None):
+        with self.connection(timeout) as conn:
+            cursor = conn.cursor(name=name)
+            try:
+                yield cursor
+                # Named cursors must be closed before their transaction ends
+                cursor.close()
+                conn.commit()
+            except BaseException:
+                # Close before the rollback: a named cursor is gone once its
+                # transaction ends, and closing it then would raise an error
+                # that hides the one being handled
+                self._close_quietly(cursor)
+                if not conn.closed:
+                    conn.rollback()
+                raise
+
+    # Open a read-only REPEATABLE READ transaction and export its snapshot,
+    # so that other connections can read exactly the same data through
+    # snapshot_cursor(). The snapshot stays importable until the block exits.
+    @contextmanager
+    def exported_snapshot(self, timeout=None):
+        with self.connection(timeout) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot_id = cursor.fetchone()[0]
+            yield snapshot_id
+
+    # Cursor on a pooled connection whose transaction imports an exported
+    # snapshot; the transaction is rolled back when the connection returns
+    @contextmanager
+    def snapshot_cursor(self, snapshot_id, timeout=None, name=None):
+        with self.connection(timeout) as conn:
+            with conn.cursor() as setup:
+                setup.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                setup.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+            cursor = conn.cursor(name=name)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    # Run fn(cursor) on a pooled cursor, retrying on a fresh connection when
+    # the first one turns out to have been dropped
+    def run(self, fn, retries=1):
+        for attempt in range(retries + 1):
+            try:
+                with self.cursor() as cursor:
+                    return fn(cursor)
+            except CONNECTION_ERRORS:
+                if attempt == retries:
+                    raise
+                logging.warning("Database connection lost, retrying on a new connection")
+                with self._cond:
+                    self.reconnects += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Shared pool for the process, created on first use
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+# A pool inherited through fork holds the parent's sockets; children start
+# with no pool and open their own connections
+def _reset_pool_after_fork():
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -0,0 +1,366 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from psycopg2 import extensions, sql
+
+from metrics import EXPORT_SECONDS, EXPORT_QUERY_SECONDS, EXPORT_SERIALIZE_SECONDS, EXPORT_ROWS, EXPORT_BYTES
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Export engines: "python" serializes psycopg2 tuples with csv.writer,
+# "copy" lets Postgres produce the CSV itself through COPY ... TO STDOUT
+EXPORT_ENGINES = ("python", "copy")
+
+# Output formats with their file extension and content type. The CSV
+# variants can come from either engine; Parquet is always built from the
+# cursor with pyarrow.
+EXPORT_FORMATS = {
+    "csv": {"extension": ".csv", "content_type": "text/csv"},
+    "csv.gz": {"extension": ".csv.gz", "content_type": "application/gzip"},
+    "csv.zst": {"extension": ".csv.zst", "content_type": "application/zstd"},
+    "parquet": {"extension": ".parquet", "content_type": "application/vnd.apache.parquet"},
+    # One JSON document per parent row; only for queries that select a
+    # single json "document" column (the nested combined_* exports)
+    "ndjson": {"extension": ".ndjson", "content_type": "application/x-ndjson"},
+}
+CSV_FORMATS = ("csv", "csv.gz", "csv.zst")
+
+TRUNCATE_LENGTH = 100
+CSV_CHUNK_SIZE = 64 * 1024
+# Rows fetched per round trip, and per Parquet record batch
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "5000"))
+GZIP_LEVEL = int(os.environ.get("EXPORT_GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.environ.get("EXPORT_ZSTD_LEVEL", "3"))
+PARQUET_COMPRESSION = os.environ.get("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+# Postgres type OIDs that psycopg2 returns as Python str: name, text, bpchar, varchar
+TEXT_TYPE_OIDS = {19, 25, 1042, 1043}
+JSON_TYPE_OIDS = {114, 3802}
+BYTEA_TYPE_OID = 17
+BOOL_TYPE_OID = 16
+NUMERIC_TYPE_OID = 1700
+
+
+# Values Postgres formatted itself and that are written as they are, the
+# way COPY writes them (booleans as t/f, json as its stored text)
+class CopyText(str):
+    pass
+
+
+def _copy_text(value, cursor):
+    return None if value is None else CopyText(value)
+
+
+COPY_TEXT_TYPE = extensions.new_type((BOOL_TYPE_OID,) + tuple(JSON_TYPE_OIDS), "COPY_TEXT", _copy_text)
+
+
+# Function to make a cursor return booleans and json columns as Postgres'
+# own text, so the python engine writes the same CSV for them as COPY
+def register_copy_text_types(cursor):
+    extensions.register_type(COPY_TEXT_TYPE, cursor)
+    return cursor
+
+# Function to truncate long text fields. COPY only truncates text columns,
+# so values already formatted by Postgres are left alone.
+def truncate_field(field, max_length=TRUNCATE_LENGTH):
+    if isinstance(field, str) and not isinstance(field, CopyText) and len(field) > max_length:
+        return field[:max_length] + '...'  # Truncate and add ellipsis
+    return field
+
+# Generator that serializes rows to CSV (with truncated long fields) and
+# yields encoded chunks of roughly chunk_size bytes
+def iter_csv(data, headers, chunk_size=CSV_CHUNK_SIZE):
+    buffer = io.StringIO()
+    # \n line ends, as COPY writes them
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(headers)
+    try:
+        for row in data:
+            writer.writerow([truncate_field(field) for field in row])
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        # Release the underlying cursor even when the consumer stops early
+        close = getattr(data, "close", None)
+        if close is not None:
+            close()
+
+# Function to build a COPY statement that makes Postgres emit the CSV.
+# The query is wrapped with positional column aliases so that the combined_*
+# queries, which repeat column names, can still be referenced; every text
+# column goes through left(col, 100) || '...' to keep the truncation rule.
+def build_copy_query(cursor, query, max_length=TRUNCATE_LENGTH):
+    base_query = query.strip().rstrip(";")
+    cursor.execute(f"SELECT * FROM ({base_query}) AS q LIMIT 0")
+    columns = cursor.description
+
+    aliases = [f"c{i}" for i in range(len(columns))]
+    select_list = []
+    for alias, column in zip(aliases, columns):
+        if column.type_code in TEXT_TYPE_OIDS:
+            expr = f"CASE WHEN length({alias}) > {max_length} THEN left({alias}, {max_length}) || '...' ELSE {alias} END"
+        else:
+            expr = alias
+        select_list.append(f"{expr} AS {sql.Identifier(column.name).as_string(cursor)}")
+
+    return (
+        f"COPY (SELECT {', '.join(select_list)} "
+        f"FROM ({base_query}) AS q({', '.join(aliases)})) "
+        f"TO STDOUT WITH CSV HEADER"
+    )
+
+# Function to export a query through COPY into any writable file object
+# (a local file, an S3MultipartWriter, ...); returns the number of rows
+def copy_export(cursor, query, file_obj):
+    cursor.copy_expert(build_copy_query(cursor, query), file_obj)
+    return cursor.rowcount
+
+# Function to run cursor.execute, adding the time spent to timing["query"]
+def timed_execute(cursor, query, timing=None):
+    start = time.perf_counter()
+    cursor.execute(query)
+    if timing is not None:
+        timing["query"] += time.perf_counter() - start
+
+# Generator of row batches. Works for named (server-side) cursors too,
+# which only populate description after the first fetch. Time spent
+# waiting on fetchmany is added to timing["query"].
+def iter_batches(cursor, batch_size=EXPORT_BATCH_SIZE, timing=None):
+    while True:
+        start = time.perf_counter()
+        batch = cursor.fetchmany(batch_size)
+        if timing is not None:
+            timing["query"] += time.perf_counter() - start
+        if not batch:
+            return
+        yield batch
+
+# Function to export a query row by row with csv.writer into a binary file object
+def python_export(cursor, query, file_obj, batch_size=EXPORT_BATCH_SIZE, timing=None):
+    register_copy_text_types(cursor)
+    timed_execute(cursor, query, timing)
+    batches = iter_batches(cursor, batch_size, timing)
+    first_batch = next(batches, [])
+    headers = [desc[0] for desc in cursor.description]
+    row_count = 0
+
+    def rows():
+        nonlocal row_count
+        for batch in itertools.chain([first_batch], batches):
+            row_count += len(batch)
+            yield from batch
+
+    for chunk in iter_csv(rows(), headers):
+        file_obj.write(chunk)
+    return row_count
+
+# Function to apply the truncation rule to every string inside a document
+def truncate_document(value):
+    if isinstance(value, dict):
+        return {key: truncate_document(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [truncate_document(item) for item in value]
+    return truncate_field(value)
+
+# Generator that serializes rows holding one JSON document each (as text)
+# to newline-delimited JSON, yielding encoded chunks of about chunk_size
+def iter_ndjson(data, chunk_size=CSV_CHUNK_SIZE):
+    buffer = io.StringIO()
+    try:
+        for (document,) in data:
+            buffer.write(json.dumps(truncate_document(json.loads(document)), separators=(",", ":")))
+            buffer.write("\n")
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        close = getattr(data, "close", None)
+        if close is not None:
+            close()
+
+# Function to export a nested query as NDJSON into a binary file object
+def ndjson_export(cursor, query, file_obj, batch_size=EXPORT_BATCH_SIZE, timing=None):
+    timed_execute(cursor, query, timing)
+    row_count = 0
+    for batch in iter_batches(cursor, batch_size, timing):
+        row_count += len(batch)
+        for chunk in iter_ndjson(batch):
+            file_obj.write(chunk)
+    return row_count
+
+# Function to name the missing optional package a format needs, or None
+# when the format can be produced. Checked before a response starts, so a
+# missing package is an error status rather than a truncated body.
+def missing_dependency(fmt):
+    if fmt == "csv.zst" and zstandard is None:
+        return "zstandard"
+    if fmt == "parquet" and pa is None:
+        return "pyarrow"
+    return None
+
+# Function to wrap a binary file object in the compressor for a CSV format
+@contextmanager
+def compressed_writer(file_obj, fmt):
+    if fmt == "csv.gz":
+        with gzip.GzipFile(fileobj=file_obj, mode="wb", compresslevel=GZIP_LEVEL) as writer:
+            yield writer
+    elif fmt == "csv.zst":
+        if zstandard is None:
+            raise RuntimeError("csv.zst exports need the zstandard package")
+        with zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file_obj, closefd=False) as writer:
+            yield writer
+    else:
+        yield file_obj
+
+# Generator that compresses a stream of CSV chunks for a streaming response.
+# Closing it closes the source, which releases the cursor behind it.
+def iter_compressed(chunks, fmt):
+    try:
+        if fmt == "csv":
+            yield from chunks
+            return
+        if fmt == "csv.gz":
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+        elif zstandard is not None:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            raise RuntimeError("csv.zst exports need the zstandard package")
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+# Function to map a cursor.description column to an Arrow type and a value
+# converter (None when psycopg2 already returns what Arrow expects)
+def arrow_column(column):
+    oid = column.type_code
+    if oid in TEXT_TYPE_OIDS:
+        return pa.string(), truncate_field
+    if oid in JSON_TYPE_OIDS:
+        # psycopg2 parses json into dicts and lists
+        return pa.string(), lambda value: None if value is None else json.dumps(value)
+    if oid == BYTEA_TYPE_OID:
+        return pa.binary(), lambda value: None if value is None else bytes(value)
+    if oid == NUMERIC_TYPE_OID:
+        if column.precision and column.scale is not None and column.precision <= 38:
+            return pa.decimal128(column.precision, column.scale), None
+        # Unconstrained numeric has no fixed scale, keep the exact digits
+        return pa.string(), lambda value: None if value is None else str(value)
+    known = {
+        16: pa.bool_(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1082: pa.date32(),
+        1083: pa.time64("us"),
+        1114: pa.timestamp("us"),
+        1184: pa.timestamp("us", tz="UTC"),
+    }
+    if oid in known:
+        return known[oid], None
+    # uuid, enums, intervals, arrays, ...: exported as their text form
+    return pa.string(), lambda value: None if value is None else str(value)
+
+# Function to build the Parquet schema from cursor.description. Column names
+# are made unique because the combined_* queries repeat them.
+def arrow_schema(columns):
+    fields = []
+    converters = []
+    seen = {}
+    for column in columns:
+        name = column.name
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[column.name]}"
+        else:
+            seen[name] = 0
+        arrow_type, converter = arrow_column(column)
+        fields.append(pa.field(name, arrow_type))
+        converters.append(converter)
+    return pa.schema(fields), converters
+
+# Function to turn a batch of row tuples into an Arrow record batch
+def record_batch(rows, schema, converters):
+    arrays = []
+    for field, converter, values in zip(schema, converters, zip(*rows)):
+        if converter is not None:
+            values = [converter(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+# Function to export a query to Parquet, one record batch per fetched batch,
+# so memory stays bounded by batch_size rows. Use a named cursor to keep
+# the full result on the server.
+def parquet_export(cursor, query, file_obj, batch_size=EXPORT_BATCH_SIZE, timing=None):
+    if pa is None:
+        raise RuntimeError("parquet exports need the pyarrow package")
+    timed_execute(cursor, query, timing)
+    batches = iter_batches(cursor, batch_size, timing)
+    first_batch = next(batches, [])
+    schema, converters = arrow_schema(cursor.description)
+    row_count = 0
+    with pq.ParquetWriter(file_obj, schema, compression=PARQUET_COMPRESSION) as writer:
+        for batch in itertools.chain([first_batch] if first_batch else [], batches):
+            writer.write_batch(record_batch(batch, schema, converters))
+            row_count += len(batch)
+    return row_count
+
+def _write_export(cursor, query, engine, fmt, file_obj, timing):
+    if fmt == "parquet":
+        return parquet_export(cursor, query, file_obj, timing=timing)
+    if fmt == "ndjson":
+        return ndjson_export(cursor, query, file_obj, timing=timing)
+    with compressed_writer(file_obj, fmt) as writer:
+        if engine == "copy":
+            return copy_export(cursor, query, writer)
+        return python_export(cursor, query, writer, timing=timing)
+
+# Function to export a query in any format into a binary file object;
+# returns the number of rows written. Records the export time split into
+# time blocked on Postgres and time spent serializing and writing (with
+# COPY, Postgres does both), plus rows and bytes under the table label.
+def write_export(cursor, query, engine, fmt, file_obj, table="other"):
+    timing = {"query": 0.0}
+    start_bytes = file_obj.tell()
+    start = time.perf_counter()
+    with EXPORT_SECONDS.time(table=table, format=fmt, engine=engine):
+        rows = _write_export(cursor, query, engine, fmt, file_obj, timing)
+    elapsed = time.perf_counter() - start
+    if engine == "copy" and fmt in CSV_FORMATS:
+        timing["query"] = elapsed
+    else:
+        EXPORT_SERIALIZE_SECONDS.observe(max(elapsed - timing["query"], 0.0), table=table, format=fmt)
+    EXPORT_QUERY_SECONDS.observe(timing["query"], table=table, engine=engine)
+    EXPORT_ROWS.inc(max(rows, 0), table=table)
+    EXPORT_BYTES.inc(file_obj.tell() - start_bytes, table=table, format=fmt)
+    return rows
@@ -0,0 +1,73 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+
+# Local export files: every request gets its own directory under EXPORT_DIR
+# so concurrent exports of the same table never write to the same path.
+# Directories older than EXPORT_RETENTION seconds are removed by the janitor.
+# Exports get their own root below downloads/, which also holds checked-in
+# reports, and the janitor only ever removes directories named like an
+# export id, whatever EXPORT_DIR points at.
+EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join("downloads", "exports"))
+EXPORT_RETENTION = int(os.environ.get("EXPORT_RETENTION", "3600"))
+EXPORT_CLEANUP_INTERVAL = int(os.environ.get("EXPORT_CLEANUP_INTERVAL", "300"))
+
+
+# Function to reserve a fresh per-request directory; returns (export_id, dir)
+def new_export_dir():
+    export_id = uuid.uuid4().hex
+    export_dir = os.path.join(EXPORT_DIR, export_id)
+    os.makedirs(export_dir)
+    return export_id, export_dir
+
+
+# Function to reserve a fresh per-request path; returns (export_id, path)
+def new_export_path(filename):
+    export_id, export_dir = new_export_dir()
+    return export_id, os.path.join(export_dir, os.path.basename(filename))
+
+
+# Function to normalise an export id, or None if it is not one
+def parse_export_id(export_id):
+    try:
+        return uuid.UUID(hex=export_id).hex
+    except ValueError:
+        return None
+
+
+# Function to resolve a previously created export, or None if it has expired.
+# Only ids created by new_export_path are accepted, so the result always
+# stays inside EXPORT_DIR.
+def export_path(export_id, filename):
+    export_id = parse_export_id(export_id)
+    if export_id is None:
+        return None
+    path = os.path.join(EXPORT_DIR, export_id, os.path.basename(filename))
+    return path if os.path.isfile(path) else None
+
+
+# Function to remove an export directory once it is no longer needed
+def remove_export(path):
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+# Function to delete export directories older than the retention period
+def cleanup_exports(retention=EXPORT_RETENTION):
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+    cutoff = time.time() - retention
+    removed = 0
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            if entry.name != parse_export_id(entry.name):
+                continue
+            if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logging.info(f"Removed {removed} expired exports from {EXPORT_DIR}")
+    return removed
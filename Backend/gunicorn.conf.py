@@ -0,0 +1,51 @@
+# gunicorn -c gunicorn.conf.py
+#
+# Runs server:app (export and OCR APIs together) in uvicorn workers.
+#
+# State that every worker has to see lives in the SHARED_STATE_BACKEND
+# store (shared_state.py): "sqlite" (default) for the workers of one host,
+# "redis" for several hosts.
+# - Textract jobs, upload batches and branch export jobs are published
+#   there, so GET /ocr/jobs/{id}, /ocr/batches/{id} and /export-branch/{id}
+#   answer on any worker.
+# - SNS completions that reach a worker other than the job's owner are
+#   handed over through it.
+# - The Textract TPS token buckets are shared, so TEXTRACT_*_TPS is the
+#   budget of all workers together.
+# Incremental export locks are file locks under INCREMENTAL_LOCK_DIR, and
+# /exports/ downloads are served from EXPORT_DIR, so workers on several
+# hosts need those on shared storage. SHARED_STATE_BACKEND=memory keeps
+# everything per worker and only suits WEB_CONCURRENCY=1.
+#
+# Each worker opens its own database pool, so the database sees up to
+# WEB_CONCURRENCY * DB_POOL_MAX_SIZE connections.
+import multiprocessing
+import os
+
+from shared_state import SHARED_STATE_BACKEND
+
+wsgi_app = "server:app"
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the apps and the spaCy model once in the master, then fork; clients,
+# pools and SQLite connections are created lazily in each worker
+preload_app = True
+
+# Exports and synchronous OCR requests can take minutes
+timeout = int(os.environ.get("WORKER_TIMEOUT", "300"))
+graceful_timeout = int(os.environ.get("WORKER_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+
+def on_starting(server):
+    if workers > 1 and SHARED_STATE_BACKEND == "memory":
+        server.log.warning(
+            f"Starting {workers} workers with SHARED_STATE_BACKEND=memory: jobs, batches and Textract rate "
+            "limits are per worker, see gunicorn.conf.py"
+        )
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked")
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from psycopg2 import sql
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Incremental export configuration
+INCREMENTAL_STATE_PATH = os.environ.get("INCREMENTAL_STATE_PATH", "export_state.db")
+# A full snapshot is taken when the last one is older than this, so that
+# deletes and late-committed rows are eventually picked up
+INCREMENTAL_FULL_INTERVAL = float(os.environ.get("INCREMENTAL_FULL_INTERVAL", str(7 * 24 * 3600)))
+
+# Timestamp columns a row's high-water mark is taken from. updated_at is
+# NULL for rows that were never edited, so the mark is the greatest of all
+# of them: that is created_at for new rows, updated_at after an edit, and
+# for the combined_* joins the latest change of the parent or any child.
+TIMESTAMP_COLUMNS = ("updated_at", "created_at")
+# Used when a single-table query has no timestamps; only catches new rows
+ID_COLUMN = "id"
+# Lock files that keep two workers from exporting the same delta at once
+INCREMENTAL_LOCK_DIR = os.environ.get("INCREMENTAL_LOCK_DIR", INCREMENTAL_STATE_PATH + ".locks")
+
+_thread_locks = defaultdict(threading.Lock)
+
+
+# Function to hold the incremental export lock of a (branch, table) pair.
+# The thread lock serialises the threads of one worker, the flock() on a
+# per-pair lock file the worker processes of the host.
+@contextmanager
+def export_lock(branch_id, table_name, lock_dir=INCREMENTAL_LOCK_DIR):
+    key = f"{branch_id}:{table_name}"
+    with _thread_locks[(lock_dir, key)]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(lock_dir, exist_ok=True)
+        path = os.path.join(lock_dir, hashlib.sha1(key.encode()).hexdigest() + ".lock")
+        with open(path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Per-(branch, table) watermarks in a small SQLite file next to the app
+class WatermarkStore:
+    def __init__(self, path=INCREMENTAL_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    # Connection of the current process, opened on first use so that a
+    # store created before a fork is never shared with the workers
+    @property
+    def _conn(self):
+        if self._connection is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS export_watermarks ("
+                "branch_id TEXT NOT NULL, table_name TEXT NOT NULL, watermark_column TEXT, watermark TEXT, "
+                "last_full_at REAL, last_export_at REAL NOT NULL, last_url TEXT, "
+                "PRIMARY KEY (branch_id, table_name))"
+            )
+            conn.commit()
+            self._connection, self._pid = conn, os.getpid()
+        return self._connection
+
+    def get(self, branch_id, table_name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT watermark_column, watermark, last_full_at, last_export_at, last_url "
+                "FROM export_watermarks WHERE branch_id = ? AND table_name = ?",
+                (str(branch_id), table_name),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("watermark_column", "watermark", "last_full_at", "last_export_at", "last_url"), row))
+
+    def set(self, branch_id, table_name, watermark_column, watermark, full, url):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO export_watermarks "
+                "(branch_id, table_name, watermark_column, watermark, last_full_at, last_export_at, last_url) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (branch_id, table_name) DO UPDATE SET "
+                "watermark_column = excluded.watermark_column, watermark = excluded.watermark, "
+                "last_full_at = COALESCE(excluded.last_full_at, last_full_at), "
+                "last_export_at = excluded.last_export_at, last_url = excluded.last_url",
+                (str(branch_id), table_name, watermark_column, watermark, now if full else None, now, url),
+            )
+            self._conn.commit()
+
+    def list(self, branch_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT table_name, watermark_column, watermark, last_full_at, last_export_at, last_url "
+                "FROM export_watermarks WHERE branch_id = ? ORDER BY table_name",
+                (str(branch_id),),
+            ).fetchall()
+        keys = ("table_name", "watermark_column", "watermark", "last_full_at", "last_export_at", "last_url")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+# Function to read the result column names of a query without running it
+def query_columns(cursor, query):
+    cursor.execute(f"SELECT * FROM ({query.strip().rstrip(';')}) AS q LIMIT 0")
+    return [column.name for column in cursor.description]
+
+
+# Function to pick the watermark columns from the result columns. Returns
+# (positions, name), or None when there is no usable watermark and every
+# run has to be a full snapshot. A query joining several tables repeats id
+# or the timestamps once per table; it only gets a watermark when every
+# joined table contributes a timestamp, otherwise changes to the tables
+# without one would be missed.
+def find_watermark_column(names):
+    tables = max(names.count(column) for column in (ID_COLUMN,) + TIMESTAMP_COLUMNS)
+    timestamped = max(names.count(column) for column in TIMESTAMP_COLUMNS)
+    if timestamped and timestamped >= tables:
+        positions = [i for i, name in enumerate(names) if name in TIMESTAMP_COLUMNS]
+        if len(positions) == 1:
+            return positions, names[positions[0]]
+        return positions, f"greatest({', '.join(names[i] for i in positions)})"
+    if tables == 1 and ID_COLUMN in names:
+        return [names.index(ID_COLUMN)], ID_COLUMN
+    return None
+
+
+# Function to build the SQL expression of the watermark over the aliases
+# of _aliased. GREATEST skips NULLs.
+def watermark_expression(positions):
+    if len(positions) == 1:
+        return f"c{positions[0]}"
+    return f"GREATEST({', '.join(f'c{position}' for position in positions)})"
+
+
+# Function to wrap a query with positional column aliases, so that one
+# column can be filtered on even when its name is repeated
+def _aliased(cursor, query, names):
+    aliases = [f"c{i}" for i in range(len(names))]
+    select_list = ", ".join(
+        f"{alias} AS {sql.Identifier(name).as_string(cursor)}" for alias, name in zip(aliases, names)
+    )
+    return f"FROM ({query.strip().rstrip(';')}) AS q({', '.join(aliases)})", select_list
+
+
+# Function to read the current high-water mark of the watermark columns,
+# returned as text so it can be stored and compared by Postgres later
+def current_watermark(cursor, query, names, positions):
+    from_clause, _ = _aliased(cursor, query, names)
+    cursor.execute(f"SELECT max({watermark_expression(positions)})::text {from_clause}")
+    return cursor.fetchone()[0]
+
+
+# Function to build the bounded export query: rows above the previous
+# watermark (all rows for a snapshot) and at or below the new one. The
+# values are bound with mogrify, so the result can go through either engine.
+def bounded_query(cursor, query, names, positions, low, high):
+    from_clause, select_list = _aliased(cursor, query, names)
+    expression = watermark_expression(positions)
+    conditions = []
+    params = []
+    if low is not None:
+        conditions.append(f"{expression} > %s")
+        params.append(low)
+    if high is not None:
+        conditions.append(f"{expression} <= %s")
+        params.append(high)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    statement = f"SELECT {select_list} {from_clause}{where}"
+    return cursor.mogrify(statement, params).decode("utf-8") if params else statement
+
+
+# Function to decide whether this run is a full snapshot or a delta
+def needs_full_snapshot(state, watermark_column, force_full=False, interval=INCREMENTAL_FULL_INTERVAL):
+    if force_full or state is None or watermark_column is None:
+        return True
+    if state["watermark_column"] != watermark_column or state["watermark"] is None:
+        return True
+    return state["last_full_at"] is None or time.time() - state["last_full_at"] > interval
@@ -1,19 +1,95 @@
 import logging
 from fastapi import FastAPI, Response
-import psycopg2
-import csv
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
+import asyncio
 import os
+import json
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from botocore.exceptions import NoCredentialsError
-import boto3
+from aws_clients import LazyClient
+from blocking_io import run_blocking, iterate_in_executor, shutdown_executor
+from database import get_pool, close_pool
+from s3_multipart import S3MultipartWriter
+from export_engines import (
+    EXPORT_ENGINES, EXPORT_FORMATS, CSV_FORMATS, EXPORT_BATCH_SIZE, iter_csv, iter_ndjson, iter_compressed,
+    write_export, missing_dependency, register_copy_text_types,
+)
+from query_registry import QueryRegistry, InvalidQueryParameter
+from incremental_export import (
+    WatermarkStore, export_lock, query_columns, find_watermark_column, current_watermark, bounded_query, needs_full_snapshot,
+)
+from shared_state import create_shared_state
+from result_cache import TTLCache, InvalidationListener, table_stats_version
+from metrics import instrument_app, S3_REQUEST_SECONDS, S3_BYTES, EXPORT_BYTES
+from export_storage import (
+    EXPORT_CLEANUP_INTERVAL, new_export_dir, new_export_path, export_path, remove_export, cleanup_exports,
+)
+
+# Per-worker startup and shutdown. Nothing here touches the database, so a
+# worker starts even when Postgres is unreachable; the pool, the S3 client
+# and the SQLite watermark store are created on first use in each worker.
+@asynccontextmanager
+async def lifespan(app):
+    janitor = asyncio.create_task(export_janitor())
+    if EXPORT_CACHE_INVALIDATION == "notify":
+        invalidation_listener.start()
+    try:
+        yield
+    finally:
+        janitor.cancel()
+        invalidation_listener.stop()
+        close_pool()
+        shutdown_executor()
+
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # S3 configuration
 S3_BUCKET = "ocr-swingbell"
 S3_REGION = "ap-southeast-2"
-s3_client = boto3.client("s3", region_name=S3_REGION)
+# Point at a local stand-in (moto server, MinIO) for development and load tests
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+s3_client = LazyClient("s3", S3_REGION, S3_ENDPOINT_URL)
+
+# Streaming export configuration
+EXPORT_MODES = ("file", "stream", "s3", "incremental")
+
+# How file-mode exports are handed back: "json" returns the S3 URL plus local
+# and presigned download links, "file" sends the local copy directly and
+# "presigned" redirects to a presigned S3 URL
+DELIVERY_MODES = ("json", "file", "presigned")
+PRESIGNED_URL_EXPIRY = int(os.environ.get("PRESIGNED_URL_EXPIRY", "3600"))
+
+# Whole-branch exports: tables exported at once per job and how the
+# outputs are packaged on S3. Each running table holds a pooled connection
+# and each job one more for the shared snapshot, so at most
+# BRANCH_EXPORT_MAX_JOBS jobs run at a time (later ones wait as "queued")
+# and the table concurrency is capped so that
+# BRANCH_EXPORT_RESERVED_CONNECTIONS stay free for other requests.
+BRANCH_EXPORT_CONCURRENCY = int(os.environ.get("BRANCH_EXPORT_CONCURRENCY", "8"))
+BRANCH_EXPORT_MAX_JOBS = int(os.environ.get("BRANCH_EXPORT_MAX_JOBS", "1"))
+BRANCH_EXPORT_RESERVED_CONNECTIONS = int(os.environ.get("BRANCH_EXPORT_RESERVED_CONNECTIONS", "2"))
+# Finished jobs are kept this long for GET /export-branch/{id}
+BRANCH_EXPORT_RETENTION = float(os.environ.get("BRANCH_EXPORT_RETENTION", "86400"))
+BRANCH_EXPORT_PACKAGES = ("zip", "manifest")
+# Formats that are already compressed are stored in the zip as-is
+PRECOMPRESSED_FORMATS = ("csv.gz", "csv.zst", "parquet")
+branch_exports = {}
+branch_export_tasks = set()
+# Jobs run on the worker that received them and are published here, so
+# GET /export-branch/{id} can land on any worker
+shared_state = create_shared_state()
+# Queued jobs wait on the event loop, not in an executor thread
+branch_export_slots = asyncio.Semaphore(BRANCH_EXPORT_MAX_JOBS)
+
+# Request timing and the Prometheus /metrics endpoint
+instrument_app(app, "export")
 
 # Enable CORS for frontend URL
 origins = ["http://localhost:5173"]
@@ -25,55 +101,134 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database connection (PostgreSQL)
-conn = psycopg2.connect(
-    dbname="swingbell",
-    user="asimith",
-    password="asimith",
-    host="13.126.33.160",
-    port="5432"
-)
-cur = conn.cursor()
+# Watermarks for incremental exports; export_lock() holds one lock per
+# (branch, table) across workers so two runs never export the same delta
+watermark_store = WatermarkStore()
+
+# Caches. Branch to facility mappings almost never change, so they are kept
+# for FACILITY_CACHE_TTL. Export results map (table, branch, format,
+# engine, data version) to the S3 URL of an export that is still current.
+# The data version covers every table the export query reads and comes
+# from Postgres' per-table change counters ("stats") or from LISTEN/NOTIFY
+# generation counters ("notify", needs triggers that call pg_notify on
+# the invalidation channel for each of those tables). With "stats" a hit
+# can be behind by as long as Postgres takes to publish the counters, up to
+# a minute on PostgreSQL 15+ (see table_stats_version); use "notify" when
+# exports must reflect every committed write.
+FACILITY_CACHE_TTL = float(os.environ.get("FACILITY_CACHE_TTL", "3600"))
+EXPORT_CACHE_TTL = float(os.environ.get("EXPORT_CACHE_TTL", "900"))
+EXPORT_CACHE_MAX_ENTRIES = int(os.environ.get("EXPORT_CACHE_MAX_ENTRIES", "512"))
+EXPORT_CACHE_INVALIDATION = os.environ.get("EXPORT_CACHE_INVALIDATION", "stats")  # stats, notify or none
+# "watermark" was the name of the earlier count/max probe that "stats" replaced
+if EXPORT_CACHE_INVALIDATION == "watermark":
+    EXPORT_CACHE_INVALIDATION = "stats"
+facility_cache = TTLCache(max_entries=1024, ttl=FACILITY_CACHE_TTL)
+export_cache = TTLCache(max_entries=EXPORT_CACHE_MAX_ENTRIES, ttl=EXPORT_CACHE_TTL)
+invalidation_listener = InvalidationListener()
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
-# Function to execute a query and return data
-def fetch_query_data(query):
-    cur.execute(query)
-    return cur.fetchall(), [desc[0] for desc in cur.description]
+# Function to stream query rows through a named server-side cursor.
+# Rows are pulled from Postgres in batches of batch_size, so only one batch
+# is resident at a time. Returns a row iterator and the column headers.
+def stream_query_data(query, batch_size=EXPORT_BATCH_SIZE):
+    # The connection stays checked out of the pool until the rows are consumed
+    pool = get_pool()
+    conn = pool.getconn()
+    stream_cur = register_copy_text_types(conn.cursor(name=f"export_{uuid.uuid4().hex}"))
+    stream_cur.itersize = batch_size
+    try:
+        stream_cur.execute(query)
+        # Named cursors only populate description after the first fetch
+        first_batch = stream_cur.fetchmany(batch_size)
+        headers = [desc[0] for desc in stream_cur.description]
+    except Exception:
+        stream_cur.close()
+        pool.putconn(conn)
+        raise
+
+    def rows():
+        try:
+            batch = first_batch
+            while batch:
+                yield from batch
+                batch = stream_cur.fetchmany(batch_size)
+        finally:
+            if not conn.closed:
+                stream_cur.close()
+            pool.putconn(conn)
+
+    return rows(), headers
+
+# Generator that counts the bytes of a streamed export as they are sent.
+# Closing it closes the source, which releases the cursor behind it.
+def metered(chunks, table_name, fmt):
+    try:
+        for chunk in chunks:
+            EXPORT_BYTES.inc(len(chunk), table=table_name, format=fmt)
+            yield chunk
+    finally:
+        chunks.close()
+
+# Small lookups that run on every request go through prepared statements
+LOOKUP_QUERIES = QueryRegistry({
+    'facility_id_by_branch': "SELECT facility_id FROM facility_branch WHERE branch_id = %(branch_id)s",
+}, prefix="lookup")
 
 # Function to get facility_id from branch_id
 def get_facility_id_from_branch_id(branch_id):
-    query = f"SELECT facility_id FROM facility_branch WHERE branch_id = '{branch_id}'"
-    cur.execute(query)
-    result = cur.fetchone()
-    return result[0] if result else None
-
-# Function to truncate long text fields
-def truncate_field(field, max_length=100):
-    if isinstance(field, str) and len(field) > max_length:
-        return field[:max_length] + '...'  # Truncate and add ellipsis
-    return field
-
-# Function to create a CSV from query data with truncated long fields
-def create_csv(data, headers, csv_filename="query_result.csv"):
-    with open(csv_filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(headers)  # Writing headers
-        for row in data:  # Writing data rows, truncating long fields
-            truncated_row = [truncate_field(field) for field in row]
-            writer.writerow(truncated_row)
-    return csv_filename
+    facility_id = facility_cache.get(str(branch_id))
+    if facility_id is not None:
+        return facility_id
+    def fetch(cursor):
+        LOOKUP_QUERIES.execute(cursor, 'facility_id_by_branch', branch_id=branch_id)
+        return cursor.fetchone()
+    result = get_pool().run(fetch)
+    if result is None:
+        return None
+    facility_cache.set(str(branch_id), result[0])
+    return result[0]
+
+# Function to get the data version an export of this query would reflect,
+# or None when it cannot be known (the export is then never cached)
+def export_data_version(tables, branch_id):
+    if EXPORT_CACHE_INVALIDATION == "notify":
+        return invalidation_listener.version(tables, branch_id) if invalidation_listener.running else None
+    if EXPORT_CACHE_INVALIDATION == "stats":
+        return get_pool().run(lambda cursor: table_stats_version(cursor, tables))
+    return None
+
+# Function to list the database tables an export reads
+def export_tables(table_name, fmt):
+    registry = NESTED_QUERIES if fmt == "ndjson" else TABLE_QUERIES
+    return registry.tables(table_name)
+
+# Notification callback: drop cached facility mappings and export URLs
+def invalidate_caches(table_name, branch_id):
+    if table_name in ("*", "facility_branch"):
+        facility_cache.invalidate(lambda key: branch_id == "*" or key == branch_id)
+    export_cache.invalidate(
+        lambda key: (table_name == "*" or table_name in export_tables(key[0], key[2]))
+        and (branch_id == "*" or key[1] == branch_id)
+    )
+
+invalidation_listener.add_callback(invalidate_caches)
+
+# Function to build the public URL of an S3 object
+def s3_object_url(s3_key):
+    return f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{s3_key}"
 
 # Function to upload CSV to S3
 def upload_to_s3(file_path, s3_folder):
     try:
         s3_key = f"{s3_folder}/{os.path.basename(file_path)}"
         logging.info(f"Uploading {file_path} to S3 bucket {S3_BUCKET} at {s3_key}")
-        s3_client.upload_file(file_path, S3_BUCKET, s3_key)
-        s3_url = f"https://{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/{s3_key}"
+        with S3_REQUEST_SECONDS.time(operation="upload_file"):
+            s3_client.upload_file(file_path, S3_BUCKET, s3_key)
+        S3_BYTES.inc(os.path.getsize(file_path), direction="upload")
+        s3_url = s3_object_url(s3_key)
         logging.info(f"File successfully uploaded to {s3_url}")
         return s3_url
     except FileNotFoundError:
@@ -86,63 +241,301 @@ def upload_to_s3(file_path, s3_folder):
         logging.error(f"An error occurred: {str(e)}")
         return f"An error occurred: {str(e)}"
 
-# Function to download CSV from S3
-def download_from_s3(s3_url, download_path):
+# Function to create a temporary download link for an S3 object
+def presigned_download_url(s3_key, filename):
+    return s3_client.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": S3_BUCKET,
+            "Key": s3_key,
+            "ResponseContentDisposition": f'attachment; filename="{filename}"',
+        },
+        ExpiresIn=PRESIGNED_URL_EXPIRY,
+    )
+
+# Function to open a pooled cursor for an export. COPY needs a plain
+# cursor; row-based exports use a named (server-side) cursor so only one
+# batch of rows is in memory at a time.
+def export_cursor(engine, fmt):
+    if engine == "copy" and fmt in CSV_FORMATS:
+        return get_pool().cursor()
+    return get_pool().cursor(name=f"export_{uuid.uuid4().hex}")
+
+# Function to export a query straight into S3 as a multipart upload
+def export_to_s3(query, engine, fmt, s3_folder, filename, table="other"):
+    s3_key = f"{s3_folder}/{filename}"
+    content_type = EXPORT_FORMATS[fmt]["content_type"]
     try:
-        s3_key = s3_url.split(f"{S3_BUCKET}.s3.{S3_REGION}.amazonaws.com/")[1]
-        logging.info(f"Downloading from S3 {s3_url} to local path {download_path}")
-        s3_client.download_file(S3_BUCKET, s3_key, download_path)
-        logging.info(f"File successfully downloaded to {download_path}")
-        return download_path
+        logging.info(f"Exporting {filename} ({engine}, {fmt}) to S3 bucket {S3_BUCKET} at {s3_key}")
+        with export_cursor(engine, fmt) as cursor, \
+                S3MultipartWriter(s3_client, S3_BUCKET, s3_key, content_type=content_type) as writer:
+            write_export(cursor, query, engine, fmt, writer, table=table)
+        s3_url = s3_object_url(s3_key)
+        logging.info(f"Export successfully uploaded to {s3_url}")
+        return s3_url
+    except NoCredentialsError:
+        logging.error("Credentials not available")
+        return "Credentials not available"
     except Exception as e:
-        logging.error(f"An error occurred during download: {str(e)}")
+        logging.error(f"An error occurred: {str(e)}")
         return f"An error occurred: {str(e)}"
 
+# Function to export a query to a local file, using either engine
+def export_to_file(query, engine, fmt, file_path, table="other"):
+    with export_cursor(engine, fmt) as cursor, open(file_path, mode='wb') as file:
+        write_export(cursor, query, engine, fmt, file, table=table)
+    return file_path
+
+# Function to export only the rows added or changed since the last run for
+# this (branch, table), or a full snapshot when one is due. Files go to
+# branch_id_{id}/{table}/full/ and branch_id_{id}/{table}/delta/, and the
+# watermark only moves forward once the upload has succeeded. The combined_*
+# exports always take a full snapshot: their rows also change when a child
+# or link table row is added, and those tables carry no timestamps.
+def export_incremental(table_name, query, engine, fmt, branch_id, force_full=False):
+    with export_lock(branch_id, table_name):
+        state = watermark_store.get(branch_id, table_name)
+        with get_pool().cursor() as cursor:
+            names = query_columns(cursor, query)
+            watermark = None if table_name.startswith("combined_") else find_watermark_column(names)
+            positions, column = watermark if watermark else (None, None)
+            high = current_watermark(cursor, query, names, positions) if watermark else None
+            full = needs_full_snapshot(state, column, force_full)
+            low = None if full else state["watermark"]
+            result = {"kind": "full" if full else "delta", "watermark_column": column, "from": low, "to": high}
+            if not full and (high is None or high == low):
+                logging.info(f"No changes in {table_name} for branch {branch_id} since {low}")
+                return {**result, "url": None}
+            export_query = bounded_query(cursor, query, names, positions, low, high) if watermark else query
+
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        filename = f"{table_name}_{result['kind']}_{stamp}{EXPORT_FORMATS[fmt]['extension']}"
+        s3_folder = f"branch_id_{branch_id}/{table_name}/{result['kind']}"
+        s3_url = export_to_s3(export_query, engine, fmt, s3_folder, filename, table=table_name)
+        if "http" in s3_url:
+            watermark_store.set(branch_id, table_name, column, high, full, s3_url)
+        return {**result, "url": s3_url}
+
+# Function to resolve the export query of a table for a branch; nested
+# selects the one-document-per-parent form of a combined_* table. The
+# values are validated and inlined, not prepared (see QueryRegistry).
+def table_query(table_name, branch_id, facility_id=None, nested=False):
+    queries = NESTED_QUERIES if nested else TABLE_QUERIES
+    return queries.render(table_name, branch_id=branch_id, facility_id=facility_id)
+
+# Function to cap the tables exported at once by one job at what the pool
+# can serve next to the snapshot connections and the reserved ones
+def branch_export_concurrency(max_size=None):
+    max_size = max_size if max_size is not None else get_pool().max_size
+    per_job = (max_size - BRANCH_EXPORT_RESERVED_CONNECTIONS) // max(1, BRANCH_EXPORT_MAX_JOBS) - 1
+    return max(1, min(BRANCH_EXPORT_CONCURRENCY, per_job))
+
+# Function to forget finished branch export jobs older than the retention
+def prune_branch_exports(retention=BRANCH_EXPORT_RETENTION):
+    cutoff = time.time() - retention
+    for job_id, job in list(branch_exports.items()):
+        if job.get("finished_at") is not None and job["finished_at"] < cutoff:
+            del branch_exports[job_id]
+
+def new_branch_export(branch_id, engine, fmt, package):
+    prune_branch_exports()
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "branch_id": branch_id,
+        "engine": engine,
+        "format": fmt,
+        "package": package,
+        "status": "queued",
+        "snapshot_id": None,
+        "total": len(TABLE_QUERIES),
+        "completed": 0,
+        "failed": 0,
+        "tables": {},
+        "started_at": time.time(),
+        "finished_at": None,
+        "elapsed_seconds": None,
+        "url": None,
+        "manifest_url": None,
+        "download_url": None,
+    }
+    branch_exports[job["job_id"]] = job
+    return job
+
+# Function to publish a branch export job's progress so any worker can
+# report it; republished on every update, so the retention also covers
+# queued and running jobs
+def publish_branch_export(job):
+    shared_state.put("branch_export", job["job_id"], job, BRANCH_EXPORT_RETENTION)
+
+# Function to export one table inside the shared snapshot to a local file,
+# and straight on to S3 when the outputs are not zipped
+def export_table_in_snapshot(snapshot_id, table_name, query, engine, fmt, export_dir, s3_folder, package):
+    start = time.perf_counter()
+    filename = f"{table_name}_report{EXPORT_FORMATS[fmt]['extension']}"
+    file_path = os.path.join(export_dir, filename)
+    cursor_name = None if engine == "copy" and fmt in CSV_FORMATS else f"export_{uuid.uuid4().hex}"
+    with TABLE_QUERIES.timed(table_name), \
+            get_pool().snapshot_cursor(snapshot_id, name=cursor_name) as cursor, open(file_path, mode='wb') as file:
+        rows = write_export(cursor, query, engine, fmt, file, table=table_name)
+    query_seconds = time.perf_counter() - start
+
+    result = {
+        "status": "succeeded",
+        "file": filename,
+        "rows": rows,
+        "bytes": os.path.getsize(file_path),
+        "query_seconds": round(query_seconds, 3),
+    }
+    if package == "manifest":
+        s3_key = f"{s3_folder}/{filename}"
+        with S3_REQUEST_SECONDS.time(operation="upload_file"):
+            s3_client.upload_file(
+                file_path, S3_BUCKET, s3_key, ExtraArgs={"ContentType": EXPORT_FORMATS[fmt]["content_type"]}
+            )
+        S3_BYTES.inc(result["bytes"], direction="upload")
+        result["s3_key"] = s3_key
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+# Function to zip every table file of a branch export
+def zip_branch_export(export_dir, files, fmt, zip_path):
+    compression = zipfile.ZIP_STORED if fmt in PRECOMPRESSED_FORMATS else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(zip_path, mode="w", compression=compression, allowZip64=True) as archive:
+        for filename in files:
+            archive.write(os.path.join(export_dir, filename), arcname=filename)
+        archive.write(os.path.join(export_dir, "manifest.json"), arcname="manifest.json")
+    return zip_path
+
+# Function to export every table of a branch in parallel from one
+# consistent REPEATABLE READ snapshot. The leader transaction exports its
+# snapshot and every worker connection imports it, so all files reflect
+# the same point in time while wall-clock time tracks the slowest table.
+def export_branch(job):
+    branch_id = job["branch_id"]
+    engine, fmt, package = job["engine"], job["format"], job["package"]
+    export_id, export_dir = new_export_dir()
+    s3_folder = f"branch_id_{branch_id}/exports/{export_id}"
+    job["status"] = "running"
+    publish_branch_export(job)
+
+    facility_id = get_facility_id_from_branch_id(branch_id)
+    queries = {}
+    for table_name in TABLE_QUERIES:
+        if table_name.startswith("combined_facility") and not facility_id:
+            job["tables"][table_name] = {"status": "failed", "error": "Facility ID not found for the provided branch ID"}
+            job["failed"] += 1
+            job["completed"] += 1
+            continue
+        queries[table_name] = table_query(table_name, branch_id, facility_id)
+
+    with get_pool().exported_snapshot() as snapshot_id:
+        job["snapshot_id"] = snapshot_id
+        concurrency = branch_export_concurrency()
+        job["concurrency"] = concurrency
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="branch-export") as executor:
+            futures = {
+                executor.submit(
+                    export_table_in_snapshot, snapshot_id, table_name, query, engine, fmt, export_dir, s3_folder, package
+                ): table_name
+                for table_name, query in queries.items()
+            }
+            for future in as_completed(futures):
+                table_name = futures[future]
+                try:
+                    job["tables"][table_name] = future.result()
+                except Exception as e:
+                    logging.error(f"Branch export of {table_name} for branch {branch_id} failed: {str(e)}")
+                    job["tables"][table_name] = {"status": "failed", "error": str(e)}
+                    job["failed"] += 1
+                job["completed"] += 1
+                publish_branch_export(job)
+
+    table_seconds = [table["seconds"] for table in job["tables"].values() if "seconds" in table]
+    job["elapsed_seconds"] = round(time.time() - job["started_at"], 3)
+    job["sum_table_seconds"] = round(sum(table_seconds), 3)
+    job["slowest_table_seconds"] = max(table_seconds, default=0.0)
+
+    manifest = {key: job[key] for key in (
+        "job_id", "branch_id", "engine", "format", "snapshot_id", "elapsed_seconds",
+        "sum_table_seconds", "slowest_table_seconds", "tables",
+    )}
+    manifest_path = os.path.join(export_dir, "manifest.json")
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    s3_client.upload_file(manifest_path, S3_BUCKET, f"{s3_folder}/manifest.json", ExtraArgs={"ContentType": "application/json"})
+    job["manifest_url"] = s3_object_url(f"{s3_folder}/manifest.json")
+
+    if package == "zip":
+        zip_name = f"branch_{branch_id}_export.zip"
+        files = [table["file"] for table in job["tables"].values() if table["status"] == "succeeded"]
+        zip_path = zip_branch_export(export_dir, files, fmt, os.path.join(export_dir, zip_name))
+        with S3_REQUEST_SECONDS.time(operation="upload_file"):
+            s3_client.upload_file(zip_path, S3_BUCKET, f"{s3_folder}/{zip_name}", ExtraArgs={"ContentType": "application/zip"})
+        S3_BYTES.inc(os.path.getsize(zip_path), direction="upload")
+        job["url"] = s3_object_url(f"{s3_folder}/{zip_name}")
+        job["download_url"] = f"/exports/{export_id}/{zip_name}"
+    else:
+        job["url"] = job["manifest_url"]
+
+    job["status"] = "succeeded" if not job["failed"] else "partial"
+    logging.info(f"Exported {job['completed'] - job['failed']}/{job['total']} tables for branch {branch_id} "
+                 f"in {job['elapsed_seconds']}s (sum of tables {job['sum_table_seconds']}s)")
+    return job
+
+# Function to run a branch export once one of the BRANCH_EXPORT_MAX_JOBS
+# slots is free; only running jobs take an IO_WORKERS thread
+async def run_branch_export(job):
+    try:
+        async with branch_export_slots:
+            job["started_at"] = time.time()
+            await run_blocking(export_branch, job)
+    except Exception as e:
+        logging.error(f"Branch export {job['job_id']} failed: {str(e)}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+    job["finished_at"] = time.time()
+    await run_blocking(publish_branch_export, job)
+    return job
 
 # Mapping for queries for each table
-TABLE_QUERIES = {
-    'diagnostic_report': "SELECT * FROM diagnostic_report WHERE branch_id = '{branch_id}'",
-    'diagnostic_report_detail': """
-        SELECT drd.*, dr.branch_id FROM diagnostic_report_detail drd 
-        JOIN diagnostic_report dr ON drd.diagnostic_report_id = dr.id 
-        WHERE dr.branch_id = '{branch_id}'
-    """,
+TABLE_QUERIES = QueryRegistry({
+    'diagnostic_report': "SELECT * FROM diagnostic_report WHERE branch_id = %(branch_id)s",
     'diagnostic_report_detail': """
     SELECT drd.*, dr.branch_id
     FROM diagnostic_report_detail drd
     JOIN diagnostic_report dr ON drd.diagnostic_report_id = dr.id
-    WHERE dr.branch_id = '{branch_id}'
+    WHERE dr.branch_id = %(branch_id)s
 """,
     'diagnostic_report_diagnostic_report_detail': """
         SELECT drdrd.*, dr.branch_id 
         FROM diagnostic_report_diagnostic_report_detail drdrd 
         JOIN diagnostic_report dr ON drdrd.diagnostic_report_entity_id = dr.id 
-        WHERE dr.branch_id = '{branch_id}'
+        WHERE dr.branch_id = %(branch_id)s
     """,
     'immunization_completion': """
         SELECT ic.*, ir.branch_id 
         FROM immunization_completion ic 
         JOIN immunization_report ir ON ic.immunization_report_id = ir.id 
-        WHERE ir.branch_id = '{branch_id}'
+        WHERE ir.branch_id = %(branch_id)s
     """,
     'immunization_recommendation': """
         SELECT ir2.*, ir.branch_id 
         FROM immunization_recommendation ir2 
         JOIN immunization_report ir ON ir2.immunization_report_id = ir.id 
-        WHERE ir.branch_id = '{branch_id}'
+        WHERE ir.branch_id = %(branch_id)s
     """,
-    'immunization_report': "SELECT * FROM immunization_report WHERE branch_id = '{branch_id}'",
+    'immunization_report': "SELECT * FROM immunization_report WHERE branch_id = %(branch_id)s",
     'immunization_report_immunization_completion': """
         SELECT iric.*, ir.branch_id 
         FROM immunization_report_immunization_completion iric 
         JOIN immunization_report ir ON iric.immunization_report_entity_id = ir.id 
-        WHERE ir.branch_id = '{branch_id}'
+        WHERE ir.branch_id = %(branch_id)s
     """,
     'immunization_report_immunization_recommendation': """
         SELECT irir.*, ir.branch_id 
         FROM immunization_report_immunization_recommendation irir 
         JOIN immunization_report ir ON irir.immunization_report_entity_id = ir.id 
-        WHERE ir.branch_id = '{branch_id}'
+        WHERE ir.branch_id = %(branch_id)s
     """,
     'combined_immunization': """
         SELECT  ic.*, ir2.*, iric.*, irir.*
@@ -151,45 +544,44 @@ TABLE_QUERIES = {
         LEFT JOIN immunization_recommendation ir2 ON ir2.immunization_report_id = ir.id
         LEFT JOIN immunization_report_immunization_completion iric ON iric.immunization_report_entity_id = ir.id
         LEFT JOIN immunization_report_immunization_recommendation irir ON irir.immunization_report_entity_id = ir.id
-        WHERE ir.branch_id = '{branch_id}'
+        WHERE ir.branch_id = %(branch_id)s
     """,
     'patient_care': """
         SELECT pc.*, mh.*
         FROM patient_care pc
         JOIN medical_history mh ON pc.medical_history_id = mh.id
-        WHERE mh.branch_id = '{branch_id}'
+        WHERE mh.branch_id = %(branch_id)s
     """,
     'patient_care_consultations': """
         SELECT pcc.*, pc.branch_id 
         FROM patient_care_consultations pcc
         JOIN patient_care pc ON pcc.patient_care_entity_id = pc.id 
-        WHERE pc.branch_id = '{branch_id}'
+        WHERE pc.branch_id = %(branch_id)s
     """,
     'patient_care_consumables': """
         SELECT pcc.*, pc.branch_id 
         FROM patient_care_consumables pcc 
         JOIN patient_care pc ON pcc.patient_care_entity_id = pc.id 
-        WHERE pc.branch_id = '{branch_id}'
+        WHERE pc.branch_id = %(branch_id)s
     """,
     'patient_care_lab_tests': """
         SELECT pclt.*, pc.branch_id 
         FROM patient_care_lab_tests pclt 
         JOIN patient_care pc ON pclt.patient_care_entity_id = pc.id 
-        WHERE pc.branch_id = '{branch_id}'
+        WHERE pc.branch_id = %(branch_id)s
     """,
    'patient_care_vaccinations': """
         SELECT pcv.*, pc.branch_id
         FROM patient_care_vaccinations pcv
         JOIN patient_care pc ON pcv.patient_care_entity_id = pc.id
-        WHERE pc.branch_id = '{branch_id}';
+        WHERE pc.branch_id = %(branch_id)s;
     """,
     'patient_care_vitals': """
         SELECT pcv.*, pc.branch_id 
         FROM patient_care_vitals pcv 
         JOIN patient_care pc ON pcv.patient_care_entity_id = pc.id 
-        WHERE pc.branch_id = '{branch_id}'
+        WHERE pc.branch_id = %(branch_id)s
     """,
-    'medical_history': "SELECT * FROM medical_history WHERE branch_id = '{branch_id}'",
     'combined_patient_care': """
         SELECT pc.*, mh.*, pcc.*, pccu.*, pclt.*, pcv.*
         FROM patient_care pc
@@ -198,43 +590,43 @@ TABLE_QUERIES = {
         LEFT JOIN patient_care_consumables pccu ON pccu.patient_care_entity_id = pc.id
         LEFT JOIN patient_care_lab_tests pclt ON pclt.patient_care_entity_id = pc.id
         LEFT JOIN patient_care_vaccinations pcv ON pcv.patient_care_entity_id = pc.id
-        WHERE mh.branch_id = '{branch_id}'
+        WHERE mh.branch_id = %(branch_id)s
     """,
     'combined_diagnostic_report': """
         SELECT dr.*, drd.*, drdrd.*
         FROM diagnostic_report dr
         LEFT JOIN diagnostic_report_detail drd ON dr.id = drd.diagnostic_report_id
         LEFT JOIN diagnostic_report_diagnostic_report_detail drdrd ON dr.id = drdrd.diagnostic_report_entity_id
-        WHERE dr.branch_id = '{branch_id}'
+        WHERE dr.branch_id = %(branch_id)s
     """,
     'prescription': """
     SELECT * 
     FROM prescription p
-    WHERE p.branch_id = '{branch_id}'
+    WHERE p.branch_id = %(branch_id)s
 """,
 'prescription_condition': """
         SELECT pc.*, p.branch_id
         FROM prescription_condition pc
         JOIN prescription p ON pc.prescription_id = p.id
-        WHERE p.branch_id = '{branch_id}'
+        WHERE p.branch_id = %(branch_id)s
     """,
      'prescription_medication': """
         SELECT pm.*, p.branch_id
         FROM prescription_medication pm
         JOIN prescription p ON pm.prescription_id = p.id
-        WHERE p.branch_id = '{branch_id}'
+        WHERE p.branch_id = %(branch_id)s
     """,
     'prescription_prescription_condition': """
         SELECT ppc.*, p.branch_id
         FROM prescription_prescription_condition ppc
         JOIN prescription p ON ppc.prescription_entity_id = p.id
-        WHERE p.branch_id = '{branch_id}';
+        WHERE p.branch_id = %(branch_id)s;
     """,
     'prescription_prescription_medication': """
         SELECT ppm.*, p.branch_id
         FROM prescription_prescription_medication ppm
         JOIN prescription p ON ppm.prescription_entity_id = p.id
-        WHERE p.branch_id = '{branch_id}';
+        WHERE p.branch_id = %(branch_id)s;
     """,
      'combined_prescription': """
         SELECT p.*, pc.*, pm.*, ppc.*
@@ -242,67 +634,67 @@ TABLE_QUERIES = {
         LEFT JOIN prescription_condition pc ON p.id = pc.prescription_id
         LEFT JOIN prescription_medication pm ON p.id = pm.prescription_id
         LEFT JOIN prescription_prescription_condition ppc ON p.id = ppc.prescription_entity_id
-        WHERE p.branch_id = '{branch_id}'
+        WHERE p.branch_id = %(branch_id)s
     """,
     'consultation': """
     SELECT c.*, pc.branch_id
     FROM consultation c
     JOIN patient_care pc ON c.patient_care_id = pc.id
-    WHERE pc.branch_id = '{branch_id}'
+    WHERE pc.branch_id = %(branch_id)s
 """,
 'consumables': """
     SELECT c.*, pc.branch_id
     FROM consumables c
     JOIN patient_care pc ON c.patient_care_id = pc.id
-    WHERE pc.branch_id = '{branch_id}'
+    WHERE pc.branch_id = %(branch_id)s
 """,
 'vital_info': """
     SELECT vi.*, pc.branch_id
     FROM vital_info vi
     JOIN patient_care pc ON vi.patient_care_id = pc.id
-    WHERE pc.branch_id = '{branch_id}'
+    WHERE pc.branch_id = %(branch_id)s
 """,
 'vaccination': """
     SELECT v.*, pc.branch_id
     FROM vaccination v
     JOIN patient_care pc ON v.patient_care_id = pc.id
-    WHERE pc.branch_id = '{branch_id}'
+    WHERE pc.branch_id = %(branch_id)s
 """,
 'vital_detail': """
-    SELECT * FROM vital_detail vd WHERE branch_id = '{branch_id}'
+    SELECT * FROM vital_detail vd WHERE branch_id = %(branch_id)s
 """,
 'patient_profile': """
-    SELECT * FROM patient_profile pp WHERE branch_id = '{branch_id}'
+    SELECT * FROM patient_profile pp WHERE branch_id = %(branch_id)s
 """,
 'patient_queue': """
-    SELECT * FROM patient_queue pq WHERE branch_id = '{branch_id}'
+    SELECT * FROM patient_queue pq WHERE branch_id = %(branch_id)s
 """,
 'patient_visit': """
-    SELECT * FROM patient_visit pv WHERE branch_id = '{branch_id}'
+    SELECT * FROM patient_visit pv WHERE branch_id = %(branch_id)s
 """,
 'op_consultation': """
-    SELECT * FROM op_consultation oc WHERE branch_id = '{branch_id}'
+    SELECT * FROM op_consultation oc WHERE branch_id = %(branch_id)s
 """,
 'medical_history': """
-    SELECT * FROM medical_history mh WHERE branch_id = '{branch_id}'
+    SELECT * FROM medical_history mh WHERE branch_id = %(branch_id)s
 """,
 'consent_request': """
-    SELECT * FROM consent_request cr WHERE branch_id = '{branch_id}'
+    SELECT * FROM consent_request cr WHERE branch_id = %(branch_id)s
 """,
 'consolidated_report': """
-    SELECT * FROM consolidated_report cr WHERE branch_id = '{branch_id}'
+    SELECT * FROM consolidated_report cr WHERE branch_id = %(branch_id)s
 """,
 'discover_and_link': """
-    SELECT * FROM discover_and_link dal WHERE branch_id = '{branch_id}'
+    SELECT * FROM discover_and_link dal WHERE branch_id = %(branch_id)s
 """,
 'health_professional': """
-    SELECT * FROM health_professional hp WHERE branch_id = '{branch_id}'
+    SELECT * FROM health_professional hp WHERE branch_id = %(branch_id)s
 """,
 'hip_data_push_notification': """
-    SELECT * FROM hip_data_push_notification hdpn WHERE branch_id = '{branch_id}'
+    SELECT * FROM hip_data_push_notification hdpn WHERE branch_id = %(branch_id)s
 """,
 'hip_data_push_request': """
-    SELECT * FROM hip_data_push_request hdpr WHERE branch_id = '{branch_id}'
+    SELECT * FROM hip_data_push_request hdpr WHERE branch_id = %(branch_id)s
 """,
 
 
@@ -312,50 +704,323 @@ TABLE_QUERIES = {
         FROM facility f
         LEFT JOIN facility_branch fb ON f.facility_id = fb.facility_id
         LEFT JOIN facility_staff fs2 ON f.facility_id = fs2.facility_id
-        WHERE f.facility_id = '{facility_id}'
+        WHERE f.facility_id = %(facility_id)s
     """
-}
+})
+
+# Nested form of the combined_* queries for format=ndjson. The flat versions
+# LEFT JOIN several one-to-many children at once, so a parent with 5
+# consultations, 4 consumables and 3 lab tests becomes 60 rows. Here every
+# child relation is aggregated with json_agg in its own correlated subquery
+# (served by the child's foreign key index), giving one document per parent.
+NESTED_QUERIES = QueryRegistry({
+    'combined_immunization': """
+        SELECT json_build_object(
+            'immunization_report', to_jsonb(ir),
+            'completions', COALESCE((SELECT json_agg(ic) FROM immunization_completion ic
+                                     WHERE ic.immunization_report_id = ir.id), '[]'::json),
+            'recommendations', COALESCE((SELECT json_agg(ir2) FROM immunization_recommendation ir2
+                                         WHERE ir2.immunization_report_id = ir.id), '[]'::json),
+            'report_completions', COALESCE((SELECT json_agg(iric) FROM immunization_report_immunization_completion iric
+                                            WHERE iric.immunization_report_entity_id = ir.id), '[]'::json),
+            'report_recommendations', COALESCE((SELECT json_agg(irir) FROM immunization_report_immunization_recommendation irir
+                                                WHERE irir.immunization_report_entity_id = ir.id), '[]'::json)
+        )::text AS document
+        FROM immunization_report ir
+        WHERE ir.branch_id = %(branch_id)s
+    """,
+    'combined_patient_care': """
+        SELECT json_build_object(
+            'patient_care', to_jsonb(pc),
+            'medical_history', to_jsonb(mh),
+            'consultations', COALESCE((SELECT json_agg(pcc) FROM patient_care_consultations pcc
+                                       WHERE pcc.patient_care_entity_id = pc.id), '[]'::json),
+            'consumables', COALESCE((SELECT json_agg(pccu) FROM patient_care_consumables pccu
+                                     WHERE pccu.patient_care_entity_id = pc.id), '[]'::json),
+            'lab_tests', COALESCE((SELECT json_agg(pclt) FROM patient_care_lab_tests pclt
+                                   WHERE pclt.patient_care_entity_id = pc.id), '[]'::json),
+            'vaccinations', COALESCE((SELECT json_agg(pcv) FROM patient_care_vaccinations pcv
+                                      WHERE pcv.patient_care_entity_id = pc.id), '[]'::json)
+        )::text AS document
+        FROM patient_care pc
+        JOIN medical_history mh ON pc.medical_history_id = mh.id
+        WHERE mh.branch_id = %(branch_id)s
+    """,
+    'combined_diagnostic_report': """
+        SELECT json_build_object(
+            'diagnostic_report', to_jsonb(dr),
+            'details', COALESCE((SELECT json_agg(drd) FROM diagnostic_report_detail drd
+                                 WHERE drd.diagnostic_report_id = dr.id), '[]'::json),
+            'report_details', COALESCE((SELECT json_agg(drdrd) FROM diagnostic_report_diagnostic_report_detail drdrd
+                                        WHERE drdrd.diagnostic_report_entity_id = dr.id), '[]'::json)
+        )::text AS document
+        FROM diagnostic_report dr
+        WHERE dr.branch_id = %(branch_id)s
+    """,
+    'combined_prescription': """
+        SELECT json_build_object(
+            'prescription', to_jsonb(p),
+            'conditions', COALESCE((SELECT json_agg(pc) FROM prescription_condition pc
+                                    WHERE pc.prescription_id = p.id), '[]'::json),
+            'medications', COALESCE((SELECT json_agg(pm) FROM prescription_medication pm
+                                     WHERE pm.prescription_id = p.id), '[]'::json),
+            'prescription_conditions', COALESCE((SELECT json_agg(ppc) FROM prescription_prescription_condition ppc
+                                                 WHERE ppc.prescription_entity_id = p.id), '[]'::json)
+        )::text AS document
+        FROM prescription p
+        WHERE p.branch_id = %(branch_id)s
+    """,
+    'combined_facility': """
+        SELECT json_build_object(
+            'facility', to_jsonb(f),
+            'branches', COALESCE((SELECT json_agg(fb) FROM facility_branch fb
+                                  WHERE fb.facility_id = f.facility_id), '[]'::json),
+            'staff', COALESCE((SELECT json_agg(fs2) FROM facility_staff fs2
+                               WHERE fs2.facility_id = f.facility_id), '[]'::json)
+        )::text AS document
+        FROM facility f
+        WHERE f.facility_id = %(facility_id)s
+    """,
+}, prefix="nested")
 
 
 
 
 @app.get("/download-csv")
-async def download_csv(table_name: str, branch_id: str = None):
+async def download_csv(table_name: str, branch_id: str = None, mode: str = "file", engine: str = "python", delivery: str = "json", format: str = "csv", full: bool = False):
     if table_name not in TABLE_QUERIES:
         return Response(content=f"Table '{table_name}' not found", status_code=404)
+    if mode not in EXPORT_MODES:
+        return Response(content=f"Unknown export mode '{mode}', expected one of {', '.join(EXPORT_MODES)}", status_code=400)
+    if engine not in EXPORT_ENGINES:
+        return Response(content=f"Unknown export engine '{engine}', expected one of {', '.join(EXPORT_ENGINES)}", status_code=400)
+    if format not in EXPORT_FORMATS:
+        return Response(content=f"Unknown format '{format}', expected one of {', '.join(EXPORT_FORMATS)}", status_code=400)
+    if missing_dependency(format):
+        return Response(content=f"Format '{format}' needs the {missing_dependency(format)} package, which is not installed", status_code=501)
+    if engine == "copy" and mode == "stream":
+        return Response(content="The copy engine does not support mode 'stream'", status_code=400)
+    if engine == "copy" and format not in CSV_FORMATS:
+        return Response(content="The copy engine only produces CSV formats", status_code=400)
+    if format == "ndjson" and table_name not in NESTED_QUERIES:
+        return Response(content=f"Format 'ndjson' is only available for {', '.join(NESTED_QUERIES)}", status_code=400)
+    if format == "parquet" and mode == "stream":
+        return Response(content="Parquet exports do not support mode 'stream'", status_code=400)
+    if delivery not in DELIVERY_MODES:
+        return Response(content=f"Unknown delivery '{delivery}', expected one of {', '.join(DELIVERY_MODES)}", status_code=400)
 
-    # Fetch the facility_id if the table is facility-related and branch_id is provided
-    if table_name.startswith("combined_facility"):
-        facility_id = get_facility_id_from_branch_id(branch_id)
-        if not facility_id:
-            return Response(content="Facility ID not found for the provided branch ID", status_code=404)
-        query = TABLE_QUERIES[table_name].format(facility_id=facility_id)
-    else:
-        query = TABLE_QUERIES[table_name].format(branch_id=branch_id)
+    try:
+        LOOKUP_QUERIES.validate('facility_id_by_branch', {"branch_id": branch_id})
+        # Fetch the facility_id if the table is facility-related
+        facility_id = None
+        if table_name.startswith("combined_facility"):
+            facility_id = await run_blocking(get_facility_id_from_branch_id, branch_id)
+            if not facility_id:
+                return Response(content="Facility ID not found for the provided branch ID", status_code=404)
+        query = table_query(table_name, branch_id, facility_id, nested=format == "ndjson")
+    except InvalidQueryParameter as e:
+        return Response(content=str(e), status_code=400)
+
+    csv_filename = f"{table_name}_report{EXPORT_FORMATS[format]['extension']}"
+    content_type = EXPORT_FORMATS[format]["content_type"]
+    # The engines do not write byte-identical files (Python and Postgres
+    # format some values differently, gzip headers carry a timestamp), so
+    # each gets its own key and a cached URL points at its own engine's file
+    s3_folder = f"branch_id_{branch_id}/{engine}"
+    # Per-query latency is recorded in the registry the query came from
+    registry = NESTED_QUERIES if format == "ndjson" else TABLE_QUERIES
 
-    # Fetch data and headers from the database
-    data, headers = fetch_query_data(query)
+    # All database and S3 calls below are blocking, so they run on the shared
+    # I/O executor and the event loop stays free for other requests.
 
-    # Create a temporary CSV file
-    csv_filename = f"{table_name}_report.csv"
-    create_csv(data, headers, csv_filename)
+    # Hot exports: hand back the S3 object of an earlier export when the
+    # data behind it has not changed since
+    cache_key = None
+    if mode == "s3" or (mode == "file" and delivery != "file"):
+        try:
+            version = await run_blocking(export_data_version, export_tables(table_name, format), branch_id)
+        except Exception as e:
+            logging.error(f"Data version probe for {table_name} failed: {str(e)}")
+            version = None
+        if version is not None:
+            cache_key = (table_name, str(branch_id), format, engine, version)
+            s3_url = export_cache.get(cache_key)
+            if s3_url is not None:
+                logging.info(f"Export cache hit for {table_name}, branch {branch_id} at version {version}")
+                if mode == "s3":
+                    return {"message": "Export unchanged, returning the existing S3 object", "url": s3_url, "cached": True}
+                presigned_url = await run_blocking(presigned_download_url, f"{s3_folder}/{csv_filename}", csv_filename)
+                if delivery == "presigned":
+                    return RedirectResponse(presigned_url)
+                return {
+                    "message": "Export unchanged, returning the existing S3 object",
+                    "url": s3_url,
+                    "presigned_url": presigned_url,
+                    "cached": True,
+                }
 
-    # Create an S3 folder name based on branch_id
-    s3_folder = f"branch_id_{branch_id}"
+    # Streaming modes: rows go from a server-side cursor straight to the
+    # client or to S3 without ever being fully materialized
+    if mode == "stream":
+        with registry.timed(table_name):
+            rows, headers = await run_blocking(stream_query_data, query)
+        chunks = iter_ndjson(rows) if format == "ndjson" else iter_compressed(iter_csv(rows, headers), format)
+        return StreamingResponse(
+            iterate_in_executor(metered(chunks, table_name, format)),
+            media_type=content_type,
+            headers={"Content-Disposition": f'attachment; filename="{csv_filename}"'},
+        )
+    if mode == "s3":
+        with registry.timed(table_name):
+            s3_url = await run_blocking(export_to_s3, query, engine, format, s3_folder, csv_filename, table=table_name)
+        if "http" not in s3_url:
+            return Response(content=s3_url, status_code=500)
+        if cache_key is not None:
+            export_cache.set(cache_key, s3_url)
+        return {"message": "Export streamed to S3 successfully", "url": s3_url}
+    if mode == "incremental":
+        with registry.timed(table_name):
+            result = await run_blocking(export_incremental, table_name, query, engine, format, branch_id, full)
+        if result["url"] is None:
+            return {"message": "No changes since the last export", **result}
+        if "http" not in result["url"]:
+            return Response(content=result["url"], status_code=500)
+        return {"message": f"{result['kind'].capitalize()} export uploaded successfully", **result}
+
+    # File mode: write once to a per-request path, upload that file and serve
+    # it (or a presigned link) without downloading the same bytes back
+    export_id, file_path = await run_blocking(new_export_path, csv_filename)
+    try:
+        with registry.timed(table_name):
+            await run_blocking(export_to_file, query, engine, format, file_path, table=table_name)
+    except Exception:
+        await run_blocking(remove_export, file_path)
+        raise
 
     # Upload the CSV to S3
-    s3_url = upload_to_s3(csv_filename, s3_folder)
+    s3_url = await run_blocking(upload_to_s3, file_path, s3_folder)
 
     if "http" not in s3_url:
+        await run_blocking(remove_export, file_path)
         return Response(content=s3_url, status_code=500)
+    if cache_key is not None:
+        export_cache.set(cache_key, s3_url)
+
+    s3_key = f"{s3_folder}/{csv_filename}"
+    if delivery == "file":
+        return FileResponse(file_path, media_type=content_type, filename=csv_filename)
+    presigned_url = await run_blocking(presigned_download_url, s3_key, csv_filename)
+    if delivery == "presigned":
+        return RedirectResponse(presigned_url)
+
+    return {
+        "message": "CSV uploaded successfully",
+        "url": s3_url,
+        "local_file": file_path,
+        "download_url": f"/exports/{export_id}/{csv_filename}",
+        "presigned_url": presigned_url,
+    }
+
+
+# Serve a file-mode export from local disk until the retention period ends
+@app.get("/exports/{export_id}/{filename}")
+async def download_export(export_id: str, filename: str):
+    file_path = export_path(export_id, filename)
+    if file_path is None:
+        return Response(content="Export not found or expired", status_code=404)
+    if filename.endswith(".zip"):
+        return FileResponse(file_path, media_type="application/zip", filename=filename)
+    media_type = next(
+        (spec["content_type"] for spec in EXPORT_FORMATS.values() if filename.endswith(spec["extension"])),
+        "application/octet-stream",
+    )
+    return FileResponse(file_path, media_type=media_type, filename=filename)
+
+
+# Export every table of a branch from one consistent snapshot, packaged as
+# a zip (plus manifest) or as individual files listed in a manifest on S3
+@app.post("/export-branch")
+async def export_branch_endpoint(branch_id: str, format: str = "csv", engine: str = "python",
+                                 package: str = "zip", wait: bool = False):
+    if format not in EXPORT_FORMATS:
+        return Response(content=f"Unknown format '{format}', expected one of {', '.join(EXPORT_FORMATS)}", status_code=400)
+    if missing_dependency(format):
+        return Response(content=f"Format '{format}' needs the {missing_dependency(format)} package, which is not installed", status_code=501)
+    if engine not in EXPORT_ENGINES:
+        return Response(content=f"Unknown export engine '{engine}', expected one of {', '.join(EXPORT_ENGINES)}", status_code=400)
+    if engine == "copy" and format not in CSV_FORMATS:
+        return Response(content="The copy engine only produces CSV formats", status_code=400)
+    if format == "ndjson":
+        return Response(content="Format 'ndjson' is only available per table through /download-csv", status_code=400)
+    if package not in BRANCH_EXPORT_PACKAGES:
+        return Response(content=f"Unknown package '{package}', expected one of {', '.join(BRANCH_EXPORT_PACKAGES)}", status_code=400)
+
+    try:
+        LOOKUP_QUERIES.validate('facility_id_by_branch', {"branch_id": branch_id})
+    except InvalidQueryParameter as e:
+        return Response(content=str(e), status_code=400)
+
+    job = new_branch_export(branch_id, engine, format, package)
+    await run_blocking(publish_branch_export, job)
+    if wait:
+        return await run_branch_export(job)
+    task = asyncio.create_task(run_branch_export(job))
+    branch_export_tasks.add(task)
+    task.add_done_callback(branch_export_tasks.discard)
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["job_id"], "status": job["status"], "status_url": f"/export-branch/{job['job_id']}"},
+    )
+
+
+@app.get("/export-branch/{job_id}")
+async def get_branch_export(job_id: str):
+    job = branch_exports.get(job_id)
+    if job is None:
+        job = await run_blocking(shared_state.get, "branch_export", job_id)
+    if job is None:
+        return Response(content=f"Branch export '{job_id}' not found", status_code=404)
+    return job
+
+
+# Incremental export state of every table exported for a branch
+@app.get("/export-watermarks")
+async def export_watermarks(branch_id: str):
+    return await run_blocking(watermark_store.list, branch_id)
+
+
+# Facility lookup and export result cache counters
+@app.get("/cache-stats")
+async def cache_stats():
+    return {
+        "facility_lookups": facility_cache.stats(),
+        "exports": {**export_cache.stats(), "invalidation": EXPORT_CACHE_INVALIDATION},
+        "listener": invalidation_listener.stats(),
+        "shared_state": shared_state.stats(),
+    }
+
+
+# Per-query call counts and latency
+@app.get("/query-stats")
+async def query_stats():
+    return {
+        "exports": TABLE_QUERIES.stats(),
+        "nested_exports": NESTED_QUERIES.stats(),
+        "lookups": LOOKUP_QUERIES.stats(),
+    }
 
-    download_path = f"downloads/{csv_filename}" 
-    download_from_s3(s3_url, download_path)
 
-    return {"message": "CSV uploaded and downloaded successfully", "url": s3_url, "local_file": download_path}
+@app.get("/db-pool-stats")
+async def db_pool_stats():
+    return get_pool().stats()
 
 
-@app.on_event("shutdown")
-def shutdown_event():
-    cur.close()
-    conn.close()
\ No newline at end of file
+# Background task that prunes expired local exports
+async def export_janitor():
+    while True:
+        try:
+            await run_blocking(cleanup_exports)
+            prune_branch_exports()
+        except Exception as e:
+            logging.error(f"Export cleanup failed: {str(e)}")
+        await asyncio.sleep(EXPORT_CLEANUP_INTERVAL)
@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# In-process metrics in the Prometheus text format, served on /metrics by
+# both apps. Values are per worker process; scrape every worker or run one.
+#
+# Set OTEL_TRACING=1 to also open an OpenTelemetry span around every timed
+# stage. Only opentelemetry-api is imported here; the SDK and exporter are
+# configured by the deployment (e.g. opentelemetry-instrument).
+OTEL_TRACING = os.environ.get("OTEL_TRACING", "0") == "1"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+_metrics = []
+_lock = threading.Lock()
+_tracer = trace.get_tracer("building-ocr") if trace is not None and OTEL_TRACING else None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+# Fixed-bucket histogram; time() also opens a span when tracing is on
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        span = _tracer.start_as_current_span(self.name, attributes=labels) if _tracer is not None else nullcontext()
+        start = time.perf_counter()
+        with span:
+            try:
+                yield
+            finally:
+                self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# Function to open a span for a stage that is not timed into a histogram
+def span(name, **attributes):
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+# Function to render every registered metric in the Prometheus text format
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Function to add request timing and a /metrics endpoint to a FastAPI app
+def instrument_app(app, app_name):
+    from fastapi import Request, Response
+
+    @app.middleware("http")
+    async def record_request(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Route templates keep the label set small (no raw ids in paths)
+            route = request.scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                app=app_name,
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Time to produce the response headers", ("app", "method", "route", "status"),
+)
+
+# CSV export pipeline
+EXPORT_SECONDS = Histogram("export_seconds", "Wall time of one table export", ("table", "format", "engine"))
+EXPORT_QUERY_SECONDS = Histogram(
+    "export_query_seconds", "Time blocked on Postgres (execute and fetch) during an export", ("table", "engine"),
+)
+EXPORT_SERIALIZE_SECONDS = Histogram(
+    "export_serialize_seconds", "Time spent serializing and writing rows during an export", ("table", "format"),
+)
+EXPORT_ROWS = Counter("export_rows_total", "Rows exported", ("table",))
+EXPORT_BYTES = Counter("export_bytes_total", "Bytes written by exports, after compression", ("table", "format"))
+
+# S3
+S3_REQUEST_SECONDS = Histogram("s3_request_seconds", "Latency of S3 calls", ("operation",))
+S3_BYTES = Counter("s3_bytes_total", "Bytes sent to or read from S3", ("direction",))
+
+# Textract and OCR post-processing
+TEXTRACT_QUEUE_SECONDS = Histogram(
+    "textract_queue_seconds", "Time from job start until Textract reports it finished", ("kind",),
+)
+TEXTRACT_PROCESSING_SECONDS = Histogram(
+    "textract_processing_seconds", "Time to read and process the result pages of a finished job", ("kind",),
+)
+TEXTRACT_JOBS = Counter("textract_jobs_total", "Textract jobs by final status", ("kind", "status"))
+TEXTRACT_PAGES = Counter("textract_pages_total", "Document pages processed", ("kind",))
+KV_EXTRACTION_SECONDS = Histogram("kv_extraction_seconds", "Key/value extraction time per document page")
+NER_SECONDS = Histogram("ner_seconds", "spaCy NER time per nlp.pipe batch")
+NER_TEXTS = Counter("ner_texts_total", "Texts run through NER")
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import NER_SECONDS, NER_TEXTS
+
+# NER model configuration
+NER_MODEL = os.environ.get("NER_MODEL", "en_core_web_sm")
+NER_BATCH_SIZE = int(os.environ.get("NER_BATCH_SIZE", "64"))
+# How long the batcher waits for more texts before running a batch
+NER_BATCH_WINDOW = float(os.environ.get("NER_BATCH_WINDOW", "0.01"))
+# nlp.pipe worker processes; only used for batches of at least
+# NER_MULTIPROCESS_MIN_BATCH texts since forking has a fixed cost
+NER_N_PROCESS = int(os.environ.get("NER_N_PROCESS", "1"))
+NER_MULTIPROCESS_MIN_BATCH = int(os.environ.get("NER_MULTIPROCESS_MIN_BATCH", "256"))
+
+# Pipeline components the ner component does not need. en_core_web_sm's ner
+# has its own embedded tok2vec, so the shared one is dropped as well.
+UNUSED_PIPES = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "senter"]
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+# Load the trimmed model on first use instead of at import time
+def get_nlp():
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+
+                start = time.perf_counter()
+                _nlp = spacy.load(NER_MODEL, exclude=UNUSED_PIPES)
+                logging.info(f"Loaded spaCy model {NER_MODEL} with pipes {_nlp.pipe_names} "
+                             f"in {time.perf_counter() - start:.2f}s")
+    return _nlp
+
+
+# Function to run NER over many texts at once; returns a list of
+# (entity_text, label) lists, one per input text
+def extract_entities_batch(texts, n_process=NER_N_PROCESS):
+    nlp = get_nlp()
+    if len(texts) < NER_MULTIPROCESS_MIN_BATCH:
+        n_process = 1
+    with NER_SECONDS.time():
+        entities = [
+            [(ent.text, ent.label_) for ent in doc.ents]
+            for doc in nlp.pipe(texts, batch_size=NER_BATCH_SIZE, n_process=n_process)
+        ]
+    NER_TEXTS.inc(len(texts))
+    return entities
+
+
+# Collects texts from concurrent requests for up to `window` seconds (or
+# until `max_batch` texts are waiting) and runs them through a single
+# nlp.pipe call on a dedicated thread.
+class NerBatcher:
+    def __init__(self, window=NER_BATCH_WINDOW, max_batch=NER_BATCH_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.texts = 0
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        # spaCy holds the GIL, so one thread is enough and keeps the shared
+        # I/O executor free while callers wait
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ner")
+
+    @property
+    def running(self):
+        return self._worker is not None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def submit(self, text):
+        future = self._loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    # For callers running on executor threads (e.g. Textract result processing)
+    def submit_threadsafe(self, text):
+        return asyncio.run_coroutine_threadsafe(self.submit(text), self._loop).result()
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                results = await self._loop.run_in_executor(self._executor, extract_entities_batch, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            for (_, future), entities in zip(batch, results):
+                if not future.done():
+                    future.set_result(entities)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "average_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+batcher = NerBatcher()
+
+
+# Function to get the entities of one text from a worker thread, batched
+# with concurrent callers when the batcher is running and processed directly
+# otherwise (CLI, or when called on the event loop thread itself)
+def extract_entities(text):
+    try:
+        asyncio.get_running_loop()
+        on_event_loop = True
+    except RuntimeError:
+        on_event_loop = False
+    if batcher.running and not on_event_loop:
+        return batcher.submit_threadsafe(text)
+    return extract_entities_batch([text])[0]
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from textract_results import result_settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Cache configuration
+OCR_CACHE_BACKEND = os.environ.get("OCR_CACHE_BACKEND", "sqlite")  # sqlite, redis or none
+OCR_CACHE_PATH = os.environ.get("OCR_CACHE_PATH", "ocr_cache.db")
+OCR_CACHE_REDIS_URL = os.environ.get("OCR_CACHE_REDIS_URL", "redis://localhost:6379/0")
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", "10000"))
+OCR_CACHE_TTL = float(os.environ.get("OCR_CACHE_TTL", str(30 * 24 * 3600)))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Function to compute the SHA-256 of an uploaded file without loading it
+# whole; the file position is restored to the start afterwards
+def content_digest(file_obj):
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+# Keys include the result settings (line order, confidence threshold), so
+# changing them never serves results assembled under the old ones
+def cache_key(digest, feature):
+    return f"{feature}:{result_settings()}:{digest}"
+
+
+# SQLite store with TTL expiry and least-recently-used eviction
+class SQLiteCacheBackend:
+    def __init__(self, path=OCR_CACHE_PATH, max_entries=OCR_CACHE_MAX_ENTRIES, ttl=OCR_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    # Connection of the current process, opened on first use so that a
+    # backend created before a fork is never shared with the workers
+    @property
+    def _conn(self):
+        if self._connection is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ocr_cache_accessed_at ON ocr_cache (accessed_at)")
+            conn.commit()
+            self._connection, self._pid = conn, os.getpid()
+        return self._connection
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE ocr_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._conn.execute("DELETE FROM ocr_cache WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM ocr_cache WHERE key IN ("
+                "SELECT key FROM ocr_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM ocr_cache").fetchone()[0]
+
+
+# Redis store; eviction is left to the server's maxmemory-policy (allkeys-lru)
+class RedisCacheBackend:
+    def __init__(self, url=OCR_CACHE_REDIS_URL, ttl=OCR_CACHE_TTL, prefix="ocr:"):
+        if redis is None:
+            raise RuntimeError("OCR_CACHE_BACKEND=redis requires the redis package")
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+    def size(self):
+        return sum(1 for _ in self._client.scan_iter(match=self.prefix + "*"))
+
+
+# Parsed OCR results keyed by content hash and feature type, with hit/miss
+# counters. Backend failures are logged and treated as misses so the cache
+# can never break an upload.
+class OCRCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.errors = 0
+
+    def get(self, key):
+        if self.backend is None:
+            self.misses += 1
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logging.error(f"OCR cache read failed: {str(e)}")
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value)
+            self.sets += 1
+        except Exception as e:
+            logging.error(f"OCR cache write failed: {str(e)}")
+            self.errors += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        try:
+            entries = self.backend.size() if self.backend is not None else 0
+        except Exception:
+            entries = None
+        return {
+            "backend": OCR_CACHE_BACKEND,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "sets": self.sets,
+            "errors": self.errors,
+            "entries": entries,
+        }
+
+
+def create_cache(backend=OCR_CACHE_BACKEND):
+    if backend == "redis":
+        return OCRCache(RedisCacheBackend())
+    if backend == "sqlite":
+        return OCRCache(SQLiteCacheBackend())
+    return OCRCache(None)
@@ -0,0 +1,86 @@
+import re
+
+# PII patterns, most specific first: when two alternatives match at the same
+# position the earlier one wins, so a 14-digit ABHA number is not reported
+# as a phone number. Every pattern has a bounded length so that streamed
+# chunks only need PII_CHUNK_OVERLAP characters of lookahead.
+PII_PATTERNS = [
+    ("email", r'\b[A-Za-z0-9._%+-]{1,64}@[A-Za-z0-9.-]{1,253}\.[A-Za-z]{2,24}\b'),
+    # ABHA address (PHR address), e.g. asha.sharma@abdm
+    ("abha_address", r'\b[A-Za-z0-9][A-Za-z0-9._]{2,31}@(?:abdm|sbx)\b'),
+    # 14-digit ABHA number, usually written 91-1234-5678-9012
+    ("abha_number", r'\b\d{2}-\d{4}-\d{4}-\d{4}\b|\b\d{14}\b'),
+    # Aadhaar with the first eight digits masked, e.g. XXXX XXXX 1234
+    ("aadhaar_masked", r'\b[Xx*]{4}[ -]?[Xx*]{4}[ -]?\d{4}\b'),
+    ("phone", r'\+?\d[\d -]{8,18}\d'),
+    # Indian PIN code, optionally written with a space (560 001)
+    ("pin_code", r'\b[1-9]\d{2} ?\d{3}\b'),
+]
+
+# The leading guard rejects positions in the middle of a word or number,
+# and the lookahead rejects word starts that cannot begin any pattern (every
+# match starts with a digit, "+", a mask character, or is an address whose
+# local part runs into "@") before the alternatives are tried one by one.
+# Without it every word start paid for all six alternatives.
+PII_PREFILTER = r"(?=[\d+Xx*]|[A-Za-z0-9._%+-]{1,64}@)"
+PII_REGEX = re.compile(
+    r"(?<![A-Za-z0-9])" + PII_PREFILTER + "(?:"
+    + "|".join(f"(?P<{name}>{pattern})" for name, pattern in PII_PATTERNS) + ")"
+)
+PII_TYPES = [name for name, _ in PII_PATTERNS]
+
+# Longest possible match (bounded by the email pattern) plus context
+PII_CHUNK_OVERLAP = 512
+PII_CHUNK_SIZE = 1024 * 1024
+
+
+def _match(m, offset):
+    value = m.group()
+    if m.lastgroup in ("email", "abha_address"):
+        value = value.lower()
+    return {"type": m.lastgroup, "value": value, "start": offset + m.start(), "end": offset + m.end()}
+
+
+# Generator of PII matches over a stream of text chunks in a single pass of
+# the combined pattern. Offsets are relative to the start of the stream.
+# Only the unscanned tail of the stream is buffered between chunks.
+def iter_pii(chunks, overlap=PII_CHUNK_OVERLAP):
+    buffer = ''
+    offset = 0  # stream offset of buffer[0]
+    pos = 0  # scan position inside buffer
+    for chunk in chunks:
+        buffer += chunk
+        # A match starting before `limit` has all the lookahead it needs
+        limit = len(buffer) - overlap
+        if limit <= pos:
+            continue
+        for m in PII_REGEX.finditer(buffer, pos):
+            if m.start() >= limit:
+                break
+            yield _match(m, offset)
+            pos = m.end()
+        pos = max(pos, limit)
+        # Keep one character before the scan position for \b and the guard
+        keep_from = max(pos - 1, 0)
+        buffer = buffer[keep_from:]
+        offset += keep_from
+        pos -= keep_from
+
+    for m in PII_REGEX.finditer(buffer, pos):
+        yield _match(m, offset)
+
+
+# Function to scan a whole text, in chunks when it is large
+def find_pii(text, chunk_size=PII_CHUNK_SIZE):
+    if len(text) <= chunk_size:
+        return [_match(m, 0) for m in PII_REGEX.finditer(text)]
+    chunks = (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+    return list(iter_pii(chunks))
+
+
+# Function to group PII values by type
+def extract_pii(text):
+    grouped = {pii_type: [] for pii_type in PII_TYPES}
+    for match in find_pii(text):
+        grouped[match["type"]].append(match["value"])
+    return grouped
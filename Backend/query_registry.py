@@ -0,0 +1,149 @@
+import logging
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from psycopg2.extensions import adapt
+
+# Accepted values for every query parameter; anything else is rejected
+# before it gets near the database
+PARAMETER_PATTERNS = {
+    "branch_id": re.compile(r"[A-Za-z0-9_-]{1,64}"),
+    "facility_id": re.compile(r"[A-Za-z0-9_.-]{1,64}"),
+}
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+# Tables a statement reads: names after FROM or JOIN that are not calls
+SOURCE_TABLE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)\b(?!\s*\()", re.IGNORECASE)
+
+
+class InvalidQueryParameter(ValueError):
+    pass
+
+
+# One declared statement: SQL with %(name)s placeholders, the parameter
+# names in order of first use, the $n form used for PREPARE and the tables
+# it reads (for cache invalidation)
+class RegisteredQuery:
+    def __init__(self, name, statement, prefix):
+        self.name = name
+        self.sql = statement
+        self.params = list(dict.fromkeys(PLACEHOLDER.findall(statement)))
+        self.statement_name = f"{prefix}_{name}"
+        positions = {param: index + 1 for index, param in enumerate(self.params)}
+        self.prepared_sql = PLACEHOLDER.sub(lambda m: f"${positions[m.group(1)]}", statement)
+        self.tables = sorted(set(SOURCE_TABLE.findall(statement)))
+
+
+# Registry of parameterized statements. Parameters are validated, then
+# quoted by the driver. execute() PREPAREs each statement once per pooled
+# connection and afterwards only sends EXECUTE, skipping parse and plan.
+#
+# Exports cannot use that path. Postgres accepts neither EXECUTE in
+# DECLARE ... CURSOR nor in COPY (...) TO STDOUT, and a plain psycopg2
+# cursor running EXECUTE buffers the whole result client-side. Exports
+# therefore go through render(), which inlines the quoted values. The text
+# differs per branch and is parsed and planned on every run; that costs
+# milliseconds next to exports that run for seconds. /query-stats marks
+# which statements ran prepared.
+class QueryRegistry:
+    def __init__(self, statements, prefix="export"):
+        self.prefix = prefix
+        self.queries = {name: RegisteredQuery(name, statement, prefix) for name, statement in statements.items()}
+        # Prepared statement names per connection; entries vanish with the connection
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __contains__(self, name):
+        return name in self.queries
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def params(self, name):
+        return self.queries[name].params
+
+    def tables(self, name):
+        return self.queries[name].tables
+
+    def validate(self, name, params):
+        query = self.queries[name]
+        values = []
+        for param in query.params:
+            value = params.get(param)
+            if value is None:
+                raise InvalidQueryParameter(f"Missing parameter '{param}' for {name}")
+            value = str(value)
+            pattern = PARAMETER_PATTERNS.get(param)
+            if pattern is not None and not pattern.fullmatch(value):
+                raise InvalidQueryParameter(f"Invalid value for parameter '{param}'")
+            values.append(value)
+        return query, values
+
+    # Function to bind parameters into the statement text, quoted by the
+    # driver, for consumers that need plain SQL: named cursors, COPY and
+    # the wrappers used by incremental exports. Not prepared, see above.
+    def render(self, name, **params):
+        query, values = self.validate(name, params)
+        literals = {param: adapt(value).getquoted().decode("utf-8") for param, value in zip(query.params, values)}
+        return PLACEHOLDER.sub(lambda m: literals[m.group(1)], query.sql)
+
+    def _ensure_prepared(self, cursor, query):
+        conn = cursor.connection
+        with self._lock:
+            prepared = self._prepared.setdefault(conn, set())
+            if query.statement_name in prepared:
+                return
+        cursor.execute(f"PREPARE {query.statement_name} AS {query.prepared_sql}")
+        with self._lock:
+            prepared.add(query.statement_name)
+        logging.info(f"Prepared {query.statement_name} on connection {id(conn):x}")
+
+    # Function to run a registered statement through its prepared plan
+    def execute(self, cursor, name, **params):
+        query, values = self.validate(name, params)
+        with self.timed(name, prepared=True):
+            self._ensure_prepared(cursor, query)
+            if values:
+                placeholders = ", ".join(["%s"] * len(values))
+                cursor.execute(f"EXECUTE {query.statement_name} ({placeholders})", values)
+            else:
+                cursor.execute(f"EXECUTE {query.statement_name}")
+        return cursor
+
+    @contextmanager
+    def timed(self, name, prepared=False):
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self._stats.setdefault(name, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                stats["prepared"] = prepared
+                stats["calls"] += 1
+                stats["errors"] += failed
+                stats["total_seconds"] += elapsed
+                stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+            logging.info(f"Query {self.prefix}.{name} {'failed' if failed else 'finished'} in {elapsed * 1000:.1f} ms")
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    **stats,
+                    "total_seconds": round(stats["total_seconds"], 4),
+                    "max_seconds": round(stats["max_seconds"], 4),
+                    "avg_seconds": round(stats["total_seconds"] / stats["calls"], 4) if stats["calls"] else 0.0,
+                }
+                for name, stats in self._stats.items()
+            }
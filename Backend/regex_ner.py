@@ -1,24 +1,72 @@
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException
-import boto3
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from botocore.exceptions import NoCredentialsError
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import functools
+import hashlib
+import json
+import math
+import mimetypes
+import os
+import shutil
+import tempfile
 import time
-import spacy
-import re
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+import uuid
+import zipfile
+from contextlib import asynccontextmanager
+from typing import List
+from pydantic import BaseModel
+from blocking_io import run_blocking, shutdown_executor
+from textract_jobs import JobManager, notification_channel, parse_sns_message, validate_callback_url
+from textract_results import process_text_pages, process_form_pages
+from ocr_cache import create_cache, content_digest, cache_key
+from shared_state import create_shared_state
+import ner_service
+from pii_extractor import extract_pii
+from s3_multipart import S3MultipartWriter, MIN_PART_SIZE
+from aws_clients import LazyClient
+from metrics import instrument_app, span, S3_REQUEST_SECONDS, S3_BYTES
+
+# Logging configuration. basicConfig only takes effect once per process, so
+# everything goes through this single call; set LOG_FILE to log to a file.
+LOG_FILE = os.environ.get("LOG_FILE", "app.log")
+logging.basicConfig(
+    filename=LOG_FILE or None,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Per-worker startup and shutdown. AWS clients and the OCR cache connection
+# are created on first use in each worker; the spaCy model is loaded by the
+# batcher on first use unless server.py preloaded it before forking.
+@asynccontextmanager
+async def lifespan(app):
+    job_manager.start()
+    ner_service.batcher.start()
+    janitor = asyncio.create_task(upload_janitor())
+    try:
+        yield
+    finally:
+        janitor.cancel()
+        await job_manager.stop()
+        await ner_service.batcher.stop()
+        shutdown_executor()
+
+
+app = FastAPI(lifespan=lifespan)
+instrument_app(app, "ocr")
 
 S3_BUCKET = "ocr-swingbell"
 S3_REGION = "ap-southeast-2"
+# Point at a local stand-in (moto server, MinIO) for development and load tests
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+TEXTRACT_ENDPOINT_URL = os.environ.get("TEXTRACT_ENDPOINT_URL")
 
-s3_client = boto3.client("s3", region_name=S3_REGION)
-textract_client = boto3.client('textract', region_name=S3_REGION)
-
-nlp = spacy.load('en_core_web_sm')
+s3_client = LazyClient("s3", S3_REGION, S3_ENDPOINT_URL)
+textract_client = LazyClient("textract", S3_REGION, TEXTRACT_ENDPOINT_URL)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,73 +76,184 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Set up logging
-logging.basicConfig(
-    filename="app.log",  
-    format="%(asctime)s - %(levelname)s - %(message)s", 
-    level=logging.INFO 
-)
-
 logging.info("Application startup")
 
+# Jobs and batches are driven by the worker that received them and published
+# to the shared state store, so status requests can land on any worker
+shared_state = create_shared_state()
+job_manager = JobManager(state=shared_state)
+ocr_cache = create_cache()
+
+
 @app.get("/")
 async def read_root():
     logging.info("Root endpoint accessed")
     return {"message": "Welcome to the file upload API"}
 
 
-@app.post("/upload-text")
-async def upload_text(file: UploadFile = File(...)):
-    try:
-        logging.info(f"File received for text extraction: {file.filename}, Content type: {file.content_type}")
-
-        s3_client.upload_fileobj(
-            file.file, 
+# Function to assemble the extracted text and average confidence from LINE
+# blocks, following every result page of the job
+def extract_text_result(result_pages, on_page=None):
+    result = process_text_pages(result_pages, on_page)
+    logging.info(f"Text extracted successfully with average confidence: {result['average_confidence']}")
+    return result
+
+
+# Function to extract key/value pairs from a form analysis and run NER on them
+def extract_form_result(result_pages, on_page=None):
+    extracted_key_values = process_form_pages(result_pages, on_page)
+    logging.info(f"Form extracted successfully with key-value pairs: {extracted_key_values}")
+    return {"form_data": process_with_ner(extracted_key_values)}
+
+
+# Textract API calls and result processing for each feature type
+TEXTRACT_FEATURES = {
+    "TEXT": {
+        "kind": "text",
+        "start": textract_client.method("start_document_text_detection"),
+        "get": textract_client.method("get_document_text_detection"),
+        "process": extract_text_result,
+        "message": "File uploaded and text extracted successfully",
+    },
+    "FORMS": {
+        "kind": "form",
+        "start": textract_client.method("start_document_analysis", FeatureTypes=["FORMS"]),
+        "get": textract_client.method("get_document_analysis"),
+        "process": extract_form_result,
+        "message": "File uploaded and form data extracted successfully",
+    },
+}
+
+# Batch ingestion limits
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "32"))
+BATCH_UPLOAD_CONCURRENCY = int(os.environ.get("BATCH_UPLOAD_CONCURRENCY", "16"))
+ZIP_SPOOL_SIZE = int(os.environ.get("ZIP_SPOOL_SIZE", str(1024 * 1024)))
+
+# Streaming and presigned uploads
+# S3 rejects multipart uploads with parts (except the last) below 5 MiB
+UPLOAD_PART_SIZE = max(int(os.environ.get("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))), MIN_PART_SIZE)
+UPLOAD_PART_CONCURRENCY = int(os.environ.get("UPLOAD_PART_CONCURRENCY", "4"))
+PRESIGNED_URL_EXPIRY = int(os.environ.get("PRESIGNED_URL_EXPIRY", "3600"))
+# Presigned multipart uploads still open this long after they were started
+# are aborted, so abandoned uploads do not keep their parts stored forever
+STALE_UPLOAD_AGE = int(os.environ.get("STALE_UPLOAD_AGE", str(24 * 3600)))
+STALE_UPLOAD_INTERVAL = int(os.environ.get("STALE_UPLOAD_INTERVAL", "3600"))
+# Prefix for objects uploaded without going through prepare_document
+INCOMING_PREFIX = "incoming/"
+MAX_MULTIPART_PARTS = 10000
+# Finished batches stay visible on GET /batches/{id} this long; batches that
+# never finish (the client went away mid-stream) are dropped after
+# STALE_UPLOAD_AGE. Both are swept by upload_janitor.
+BATCH_RETENTION = int(os.environ.get("BATCH_RETENTION", "3600"))
+
+batches = {}
+
+
+# Function to upload an incoming file to S3 for Textract. Objects are keyed
+# by content hash so two different files with the same name never collide.
+async def upload_to_s3(file_obj, s3_key, content_type):
+    with S3_REQUEST_SECONDS.time(operation="upload_fileobj"):
+        await run_blocking(
+            s3_client.upload_fileobj,
+            file_obj, 
             S3_BUCKET,  
-            file.filename,  
-            ExtraArgs={"ContentType": file.content_type},
+            s3_key,  
+            ExtraArgs={"ContentType": content_type},
         )
-        logging.info(f"File uploaded to S3 bucket: {S3_BUCKET}, Filename: {file.filename}")
-
-        textract_response = textract_client.start_document_text_detection(
+    logging.info(f"File uploaded to S3 bucket: {S3_BUCKET}, Key: {s3_key}")
+
+
+# Function to look up a previous result for the same bytes and feature type
+async def cached_result(file_obj, filename, feature):
+    digest = await run_blocking(content_digest, file_obj)
+    key = cache_key(digest, feature)
+    result = await run_blocking(ocr_cache.get, key)
+    if result is not None:
+        logging.info(f"OCR cache hit for {filename} ({feature}, sha256 {digest})")
+    return digest, key, result
+
+
+# Function to hash a document, check the cache and, on a miss, upload it to
+# S3. Returns a dict describing the document for start_textract_job.
+async def prepare_document(file_obj, filename, content_type, feature):
+    digest, key, result = await cached_result(file_obj, filename, feature)
+    size = await run_blocking(lambda: file_obj.seek(0, os.SEEK_END))
+    file_obj.seek(0)
+    document = {"filename": filename, "digest": digest, "cache_key": key, "bytes": size, "cached": result}
+    if result is None:
+        document["s3_key"] = f"{digest}/{filename}"
+        await upload_to_s3(file_obj, document["s3_key"], content_type)
+        S3_BYTES.inc(size, direction="upload")
+    return document
+
+
+# Function to start the Textract job for an uploaded document and track it
+async def start_textract_job(document, feature, callback_url=None):
+    spec = TEXTRACT_FEATURES[feature]
+    await job_manager.start_limiter.acquire()
+    with span("textract_start", kind=spec["kind"]):
+        textract_response = await run_blocking(
+            spec["start"],
             DocumentLocation={
                 'S3Object': {
                     'Bucket': S3_BUCKET,
-                    'Name': file.filename
+                    'Name': document["s3_key"]
                 }
-            }
+            },
+            **notification_channel()
         )
 
-        job_id = textract_response['JobId']
-        logging.info(f"Started Textract job for text detection. Job ID: {job_id}")
+    job_id = textract_response['JobId']
+    logging.info(f"Started Textract {spec['kind']} job for {document['filename']}. Job ID: {job_id}")
 
-        status = None
-        while status != 'SUCCEEDED':
-            response = textract_client.get_document_text_detection(JobId=job_id)
-            status = response['JobStatus']
-            logging.info(f"Textract job status: {status}")
-            time.sleep(5)
+    key = document["cache_key"]
+    return job_manager.submit(
+        spec["kind"], job_id, document["filename"],
+        spec["get"], spec["process"],
+        callback_url=callback_url,
+        on_success=lambda result: ocr_cache.set(key, result),
+    )
 
-        extracted_text = ''
-        total_confidence = 0
-        confidence_count = 0
 
-        for result_page in response['Blocks']:
-            if result_page['BlockType'] == 'LINE':
-                extracted_text += result_page['Text'] + '\n'
-                total_confidence += result_page['Confidence']
-                confidence_count += 1
+# Function to turn a tracked job into the endpoint response. With wait=False
+# the job id is returned right away and the result is fetched from /jobs/{id}.
+async def job_response(job, wait, message):
+    if not wait:
+        return JSONResponse(status_code=202, content={
+            "message": "Textract job submitted",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.id}",
+        })
 
-        average_confidence = total_confidence / confidence_count if confidence_count > 0 else 0
+    await job_manager.wait(job)
+    if job.status == "FAILED":
+        raise HTTPException(status_code=500, detail=f"Textract job failed: {job.error}")
+    return {"message": message, "job_id": job.id, "status": job.status, "warnings": job.warnings, "cached": False, **job.result}
 
-        logging.info(f"Text extracted successfully with average confidence: {average_confidence}")
 
-        return {
-            "message": "File uploaded and text extracted successfully", 
-            "extracted_text": extracted_text,
-            "average_confidence": average_confidence
-        }
-    
+# Function shared by /upload-text and /upload-form
+async def process_upload(file, feature, wait, callback_url):
+    check_callback_url(callback_url)
+    document = await prepare_document(file.file, file.filename, file.content_type, feature)
+    message = TEXTRACT_FEATURES[feature]["message"]
+    if document["cached"] is not None:
+        return {"message": message, "cached": True, **document["cached"]}
+
+    job = await start_textract_job(document, feature, callback_url)
+    return await job_response(job, wait, message)
+
+
+@app.post("/upload-text")
+async def upload_text(file: UploadFile = File(...), wait: bool = True, callback_url: str = None):
+    try:
+        logging.info(f"File received for text extraction: {file.filename}, Content type: {file.content_type}")
+        return await process_upload(file, "TEXT", wait, callback_url)
+
+    except HTTPException:
+        raise
+
     except NoCredentialsError:
         logging.error("AWS credentials not found")
         raise HTTPException(status_code=401, detail="AWS credentials not found")
@@ -105,72 +264,14 @@ async def upload_text(file: UploadFile = File(...)):
 
 
 @app.post("/upload-form")
-async def upload_form(file: UploadFile = File(...)):
+async def upload_form(file: UploadFile = File(...), wait: bool = True, callback_url: str = None):
     try:
         logging.info(f"File received for form extraction: {file.filename}, Content type: {file.content_type}")
+        return await process_upload(file, "FORMS", wait, callback_url)
 
-        # Upload the file to S3
-        s3_client.upload_fileobj(
-            file.file, 
-            S3_BUCKET,  
-            file.filename,  
-            ExtraArgs={"ContentType": file.content_type},
-        )
-        logging.info(f"File uploaded to S3 bucket: {S3_BUCKET}, Filename: {file.filename}")
+    except HTTPException:
+        raise
 
-        textract_response = textract_client.start_document_analysis(
-            DocumentLocation={
-                'S3Object': {
-                    'Bucket': S3_BUCKET,
-                    'Name': file.filename
-                }
-            },
-            FeatureTypes=["FORMS"]  
-        )
-
-        job_id = textract_response['JobId']
-        logging.info(f"Started Textract job for form extraction. Job ID: {job_id}")
-
-        status = None
-        while status != 'SUCCEEDED':
-            response = textract_client.get_document_analysis(JobId=job_id)
-            status = response['JobStatus']
-            logging.info(f"Textract job status: {status}")
-            time.sleep(5)
-
-        extracted_key_values = {}
-        for block in response['Blocks']:
-            if block['BlockType'] == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', []):
-                key_text = ''
-                for relationship in block.get('Relationships', []):
-                    if relationship['Type'] == 'CHILD':
-                        for child_id in relationship['Ids']:
-                            child_block = next((b for b in response['Blocks'] if b['Id'] == child_id), None)
-                            if child_block and 'Text' in child_block:
-                                key_text += child_block['Text']
-
-                value_text = ''
-                value_block = next((b for b in response['Blocks'] if b['Id'] in block.get('Relationships', [])[0].get('Ids', [])), None)
-                if value_block:
-                    for relationship in value_block.get('Relationships', []):
-                        if relationship['Type'] == 'CHILD':
-                            for child_id in relationship['Ids']:
-                                child_block = next((b for b in response['Blocks'] if b['Id'] == child_id), None)
-                                if child_block and 'Text' in child_block:
-                                    value_text += child_block['Text']
-
-                if key_text and value_text:
-                    extracted_key_values[key_text] = value_text
-
-        logging.info(f"Form extracted successfully with key-value pairs: {extracted_key_values}")
-
-        ner_results = process_with_ner(extracted_key_values)
-
-        return {
-            "message": "File uploaded and form data extracted successfully", 
-            "form_data": ner_results
-        }
-    
     except NoCredentialsError:
         logging.error("AWS credentials not found")
         raise HTTPException(status_code=401, detail="AWS credentials not found")
@@ -179,11 +280,489 @@ async def upload_form(file: UploadFile = File(...)):
         logging.error(f"Error during file upload or form extraction: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to upload file or extract form data: {str(e)}")
 
+
+# Function to expand uploaded zip archives into their member documents.
+# Returns (open_fn, filename, content_type) tuples plus the open archives,
+# which must be closed once the batch is prepared. open_fn returns a
+# seekable file object; zip members are only extracted when it is called.
+def expand_archives(uploads):
+    documents = []
+    archives = []
+    for file_obj, filename, content_type in uploads:
+        if not filename.lower().endswith(".zip"):
+            documents.append((lambda file_obj=file_obj: file_obj, filename, content_type))
+            continue
+        archive = zipfile.ZipFile(file_obj)
+        archives.append(archive)
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            member_name = os.path.basename(member.filename)
+            member_type = mimetypes.guess_type(member_name)[0] or "application/octet-stream"
+            documents.append((functools.partial(extract_member, archive, member), member_name, member_type))
+    return documents, archives
+
+
+# Function to copy one zip member into a temporary file that moves to disk
+# past ZIP_SPOOL_SIZE, so a batch holds at most a few small buffers in memory
+def extract_member(archive, member):
+    spooled = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE)
+    with archive.open(member) as source:
+        shutil.copyfileobj(source, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+def new_batch(total, feature, concurrency):
+    batch = {
+        "batch_id": uuid.uuid4().hex,
+        "feature": feature,
+        "concurrency": concurrency,
+        "total": total,
+        "uploaded": 0,
+        "completed": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "cached": 0,
+        "bytes": 0,
+        "started_at": time.time(),
+        "finished_at": None,
+        "elapsed_seconds": 0.0,
+        "documents_per_second": 0.0,
+        "megabytes_per_second": 0.0,
+    }
+    batches[batch["batch_id"]] = batch
+    return batch
+
+
+# Function to publish a batch's progress so any worker can report it
+async def publish_batch(batch):
+    ttl = BATCH_RETENTION if batch["finished_at"] is not None else STALE_UPLOAD_AGE
+    await run_blocking(shared_state.put, "batch", batch["batch_id"], batch, ttl)
+
+
+def update_throughput(batch):
+    elapsed = time.time() - batch["started_at"]
+    batch["elapsed_seconds"] = round(elapsed, 3)
+    if elapsed > 0:
+        batch["documents_per_second"] = round(batch["completed"] / elapsed, 3)
+        batch["megabytes_per_second"] = round(batch["bytes"] / elapsed / 1e6, 3)
+
+
+# Function to hash, cache-check and upload every document of a batch with
+# at most `concurrency` uploads in flight
+async def prepare_batch(documents, feature, batch, concurrency=BATCH_UPLOAD_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def prepare(index, open_fn, filename, content_type):
+        async with semaphore:
+            file_obj = None
+            try:
+                file_obj = await run_blocking(open_fn)
+                document = await prepare_document(file_obj, filename, content_type, feature)
+            except Exception as e:
+                logging.error(f"Failed to upload batch document {filename}: {str(e)}")
+                document = {"filename": filename, "bytes": 0, "cached": None, "error": str(e)}
+            finally:
+                if file_obj is not None:
+                    await run_blocking(file_obj.close)
+        document["index"] = index
+        batch["uploaded"] += 1
+        batch["bytes"] += document["bytes"]
+        return document
+
+    return await asyncio.gather(*(
+        prepare(index, open_fn, filename, content_type)
+        for index, (open_fn, filename, content_type) in enumerate(documents)
+    ))
+
+
+# Async generator of one result dict per document, in completion order.
+# At most `concurrency` Textract jobs of the batch run at the same time and
+# Start*/Get* calls go through the job manager's TPS limiters.
+async def iter_batch_results(prepared, feature, batch, concurrency=BATCH_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(document):
+        started = time.monotonic()
+        line = {"type": "document", "index": document["index"], "filename": document["filename"]}
+        if "error" in document:
+            line.update(status="FAILED", error=document["error"])
+        elif document["cached"] is not None:
+            line.update(status="SUCCEEDED", cached=True, result=document["cached"])
+        else:
+            async with semaphore:
+                try:
+                    job = await start_textract_job(document, feature)
+                    await job_manager.wait(job)
+                    line.update(job_id=job.id, status=job.status, cached=False, warnings=job.warnings)
+                    if job.status == "FAILED":
+                        line["error"] = job.error
+                    else:
+                        line["result"] = job.result
+                except Exception as e:
+                    logging.error(f"Batch document {document['filename']} failed: {str(e)}")
+                    line.update(status="FAILED", error=str(e))
+        line["seconds"] = round(time.monotonic() - started, 3)
+        return line
+
+    for next_done in asyncio.as_completed([run(document) for document in prepared]):
+        line = await next_done
+        batch["completed"] += 1
+        if line["status"] == "FAILED":
+            batch["failed"] += 1
+        else:
+            batch["succeeded"] += 1
+        if line.get("cached"):
+            batch["cached"] += 1
+        update_throughput(batch)
+        await publish_batch(batch)
+        line["progress"] = {"completed": batch["completed"], "total": batch["total"]}
+        yield line
+
+    batch["finished_at"] = time.time()
+    update_throughput(batch)
+    await publish_batch(batch)
+    logging.info(f"Batch {batch['batch_id']} finished: {batch['succeeded']}/{batch['total']} succeeded "
+                 f"in {batch['elapsed_seconds']}s")
+
+
+# Async generator of NDJSON lines for a prepared batch, ending with a summary
+async def iter_batch_ndjson(prepared, feature, batch, concurrency):
+    async for line in iter_batch_results(prepared, feature, batch, concurrency):
+        yield json.dumps(line) + "\n"
+    update_throughput(batch)
+    yield json.dumps({"type": "summary", **batch}) + "\n"
+
+
+# Accepts many files and/or zip archives. Uploads happen before the response
+# starts (the request's files are only valid until then); Textract results
+# are then streamed back as NDJSON, one line per document as it completes.
+@app.post("/upload-batch")
+async def upload_batch(files: List[UploadFile] = File(...), feature: str = "TEXT", concurrency: int = BATCH_CONCURRENCY):
+    check_feature(feature)
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+
+    try:
+        uploads = [(file.file, file.filename, file.content_type) for file in files]
+        documents, archives = await run_blocking(expand_archives, uploads)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {str(e)}")
+
+    batch = new_batch(len(documents), feature, concurrency)
+    logging.info(f"Batch {batch['batch_id']} received with {len(documents)} documents")
+    try:
+        prepared = await prepare_batch(documents, feature, batch)
+    finally:
+        for archive in archives:
+            archive.close()
+    await publish_batch(batch)
+
+    return StreamingResponse(
+        iter_batch_ndjson(prepared, feature, batch, concurrency),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch["batch_id"]},
+    )
+
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    batch = batches.get(batch_id)
+    if batch is None:
+        batch = await run_blocking(shared_state.get, "batch", batch_id)
+    elif batch["completed"] < batch["total"]:
+        update_throughput(batch)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found")
+    return batch
+
+
+# Function to stream a request body straight into an S3 multipart upload,
+# hashing it on the way. Parts are uploaded in parallel while the next one
+# is read from the socket, and nothing is spooled to local disk.
+async def stream_body_to_s3(request, s3_key, content_type):
+    digest = hashlib.sha256()
+    writer = S3MultipartWriter(
+        s3_client, S3_BUCKET, s3_key,
+        part_size=UPLOAD_PART_SIZE,
+        content_type=content_type,
+        max_concurrency=UPLOAD_PART_CONCURRENCY,
+    )
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            digest.update(chunk)
+            buffer += chunk
+            if len(buffer) >= writer.part_size:
+                await run_blocking(writer.write, bytes(buffer))
+                buffer.clear()
+        await run_blocking(writer.write, bytes(buffer))
+        await run_blocking(writer.close)
+    except BaseException:
+        await run_blocking(writer.abort)
+        raise
+    logging.info(f"Streamed {writer.bytes_written} bytes to S3 bucket: {S3_BUCKET}, Key: {s3_key}")
+    return digest.hexdigest(), writer.bytes_written
+
+
+def incoming_key(filename):
+    return f"{INCOMING_PREFIX}{uuid.uuid4().hex}/{os.path.basename(filename)}"
+
+
+def check_feature(feature):
+    if feature not in TEXTRACT_FEATURES:
+        raise HTTPException(status_code=400, detail=f"Unknown feature '{feature}', expected one of {', '.join(TEXTRACT_FEATURES)}")
+
+
+def check_callback_url(callback_url):
+    if callback_url:
+        try:
+            validate_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+# Raw-body upload for large scans: the request body is the file itself
+# (Content-Type set to the file's type), e.g.
+#   curl -T scan.pdf -H 'Content-Type: application/pdf' '.../upload-stream?filename=scan.pdf'
+@app.api_route("/upload-stream", methods=["POST", "PUT"])
+async def upload_stream(request: Request, filename: str, feature: str = "TEXT", wait: bool = True, callback_url: str = None):
+    check_feature(feature)
+    check_callback_url(callback_url)
+    try:
+        content_type = request.headers.get("content-type", "application/octet-stream")
+        logging.info(f"Streaming upload received: {filename}, Content type: {content_type}")
+        s3_key = incoming_key(filename)
+        digest, size = await stream_body_to_s3(request, s3_key, content_type)
+
+        key = cache_key(digest, feature)
+        message = TEXTRACT_FEATURES[feature]["message"]
+        result = await run_blocking(ocr_cache.get, key)
+        if result is not None:
+            logging.info(f"OCR cache hit for {filename} ({feature}, sha256 {digest})")
+            await run_blocking(s3_client.delete_object, Bucket=S3_BUCKET, Key=s3_key)
+            return {"message": message, "cached": True, **result}
+
+        document = {"filename": filename, "digest": digest, "cache_key": key, "bytes": size, "cached": None, "s3_key": s3_key}
+        job = await start_textract_job(document, feature, callback_url)
+        return await job_response(job, wait, message)
+
+    except HTTPException:
+        raise
+
+    except NoCredentialsError:
+        logging.error("AWS credentials not found")
+        raise HTTPException(status_code=401, detail="AWS credentials not found")
+
+    except Exception as e:
+        logging.error(f"Error during streaming upload or extraction: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to upload file or extract data: {str(e)}")
+
+
+# Presigned upload so the browser sends the file straight to S3. Small files
+# get a single PUT URL; larger ones a multipart upload with one URL per part,
+# finished with /presigned-upload/complete. The bucket's CORS rules must
+# allow PUT from the frontend origin and expose the ETag header.
+@app.post("/presigned-upload")
+async def presigned_upload(filename: str, size: int, content_type: str = "application/octet-stream"):
+    s3_key = incoming_key(filename)
+    try:
+        if size <= UPLOAD_PART_SIZE:
+            url = await run_blocking(
+                s3_client.generate_presigned_url,
+                "put_object",
+                Params={"Bucket": S3_BUCKET, "Key": s3_key, "ContentType": content_type},
+                ExpiresIn=PRESIGNED_URL_EXPIRY,
+            )
+            return {"key": s3_key, "method": "PUT", "url": url}
+
+        part_count = math.ceil(size / UPLOAD_PART_SIZE)
+        if part_count > MAX_MULTIPART_PARTS:
+            raise HTTPException(status_code=400, detail=f"File too large for {UPLOAD_PART_SIZE} byte parts")
+
+        upload = await run_blocking(
+            s3_client.create_multipart_upload, Bucket=S3_BUCKET, Key=s3_key, ContentType=content_type
+        )
+
+        def sign_parts():
+            return [
+                {
+                    "part_number": part_number,
+                    "url": s3_client.generate_presigned_url(
+                        "upload_part",
+                        Params={"Bucket": S3_BUCKET, "Key": s3_key, "UploadId": upload["UploadId"], "PartNumber": part_number},
+                        ExpiresIn=PRESIGNED_URL_EXPIRY,
+                    ),
+                }
+                for part_number in range(1, part_count + 1)
+            ]
+
+        parts = await run_blocking(sign_parts)
+        return {"key": s3_key, "method": "MULTIPART", "upload_id": upload["UploadId"], "part_size": UPLOAD_PART_SIZE, "parts": parts}
+
+    except HTTPException:
+        raise
+
+    except NoCredentialsError:
+        logging.error("AWS credentials not found")
+        raise HTTPException(status_code=401, detail="AWS credentials not found")
+
+
+class UploadedPart(BaseModel):
+    PartNumber: int
+    ETag: str
+
+
+class CompleteUpload(BaseModel):
+    key: str
+    upload_id: str
+    parts: List[UploadedPart]
+
+
+@app.post("/presigned-upload/complete")
+async def complete_presigned_upload(upload: CompleteUpload):
+    if not upload.key.startswith(INCOMING_PREFIX):
+        raise HTTPException(status_code=400, detail="Only presigned upload keys can be completed")
+    parts = sorted(({"PartNumber": part.PartNumber, "ETag": part.ETag} for part in upload.parts), key=lambda part: part["PartNumber"])
+    await run_blocking(
+        s3_client.complete_multipart_upload,
+        Bucket=S3_BUCKET,
+        Key=upload.key,
+        UploadId=upload.upload_id,
+        MultipartUpload={"Parts": parts},
+    )
+    return {"message": "Upload completed", "key": upload.key}
+
+
+class AbortUpload(BaseModel):
+    key: str
+    upload_id: str
+
+
+# Called by the frontend when a presigned multipart upload fails or is cancelled
+@app.post("/presigned-upload/abort")
+async def abort_presigned_upload(upload: AbortUpload):
+    if not upload.key.startswith(INCOMING_PREFIX):
+        raise HTTPException(status_code=400, detail="Only presigned upload keys can be aborted")
+    with S3_REQUEST_SECONDS.time(operation="abort_multipart_upload"):
+        await run_blocking(s3_client.abort_multipart_upload, Bucket=S3_BUCKET, Key=upload.key, UploadId=upload.upload_id)
+    return {"message": "Upload aborted", "key": upload.key}
+
+
+# Function to abort multipart uploads under INCOMING_PREFIX that were
+# started more than max_age seconds ago and never completed
+def abort_stale_uploads(max_age=STALE_UPLOAD_AGE):
+    cutoff = time.time() - max_age
+    aborted = 0
+    paginator = s3_client.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=INCOMING_PREFIX):
+        for upload in page.get("Uploads", []):
+            if upload["Initiated"].timestamp() < cutoff:
+                s3_client.abort_multipart_upload(Bucket=S3_BUCKET, Key=upload["Key"], UploadId=upload["UploadId"])
+                aborted += 1
+    if aborted:
+        logging.info(f"Aborted {aborted} stale multipart uploads")
+    return aborted
+
+
+# Function to drop batch summaries past their retention
+def prune_batches(retention=BATCH_RETENTION, max_age=STALE_UPLOAD_AGE):
+    now = time.time()
+    expired = [
+        batch_id for batch_id, batch in batches.items()
+        if (batch["finished_at"] is not None and now - batch["finished_at"] > retention)
+        or (batch["finished_at"] is None and now - batch["started_at"] > max_age)
+    ]
+    for batch_id in expired:
+        batches.pop(batch_id, None)
+    return len(expired)
+
+
+async def upload_janitor():
+    while True:
+        try:
+            await run_blocking(abort_stale_uploads)
+        except Exception as e:
+            logging.error(f"Stale upload cleanup failed: {str(e)}")
+        prune_batches()
+        await asyncio.sleep(STALE_UPLOAD_INTERVAL)
+
+
+# Run OCR on a file the browser uploaded through a presigned URL. The cache
+# is keyed by the object's ETag, which is stable for identical bytes
+# uploaded with the same part size.
+@app.post("/ocr-from-s3")
+async def ocr_from_s3(key: str, feature: str = "TEXT", wait: bool = True, callback_url: str = None):
+    check_feature(feature)
+    check_callback_url(callback_url)
+    if not key.startswith(INCOMING_PREFIX):
+        raise HTTPException(status_code=400, detail="Only presigned upload keys can be processed")
+    try:
+        with S3_REQUEST_SECONDS.time(operation="head_object"):
+            head = await run_blocking(s3_client.head_object, Bucket=S3_BUCKET, Key=key)
+        etag = head["ETag"].strip('"')
+        ocr_key = cache_key(f"etag-{etag}", feature)
+        message = TEXTRACT_FEATURES[feature]["message"]
+        result = await run_blocking(ocr_cache.get, ocr_key)
+        if result is not None:
+            return {"message": message, "cached": True, **result}
+
+        document = {"filename": os.path.basename(key), "digest": None, "cache_key": ocr_key,
+                    "bytes": head["ContentLength"], "cached": None, "s3_key": key}
+        job = await start_textract_job(document, feature, callback_url)
+        return await job_response(job, wait, message)
+
+    except HTTPException:
+        raise
+
+    except NoCredentialsError:
+        logging.error("AWS credentials not found")
+        raise HTTPException(status_code=401, detail="AWS credentials not found")
+
+    except Exception as e:
+        logging.error(f"Error during extraction of {key}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to extract data: {str(e)}")
+
+
+@app.get("/ner-stats")
+async def ner_stats():
+    return ner_service.batcher.stats()
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return await run_blocking(ocr_cache.stats)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+
+# SNS HTTP(S) subscription endpoint for Textract completion notifications.
+# Messages must come from TEXTRACT_SNS_TOPIC_ARN with a valid signature.
+# Without a topic configured, {"JobId": ..., "Status": ...} can be posted by
+# hand to wake a job immediately.
+@app.post("/textract-notifications")
+async def textract_notifications(request: Request):
+    try:
+        body = json.loads(await request.body())
+        notification = await run_blocking(parse_sns_message, body)
+    except ValueError as e:
+        logging.warning(f"Rejected Textract notification: {str(e)}")
+        raise HTTPException(status_code=403, detail="Notification rejected")
+    if notification is not None:
+        job_manager.notify(*notification)
+    return {"message": "Notification received"}
+
 def process_with_ner(data):
    
     combined_text = ' '.join(data.values())
    
-    doc = nlp(combined_text)
+    entities = ner_service.extract_entities(combined_text)
  
     ner_results = {
         "names": [],
@@ -192,20 +771,20 @@ def process_with_ner(data):
         "emails": []
     }
 
-    for ent in doc.ents:
-        if ent.label_ == "PERSON":
-            ner_results["names"].append(ent.text)
-        elif ent.label_ == "GPE": 
-            ner_results["addresses"].append(ent.text)
-
-    phone_regex = re.compile(r'\+?\d[\d -]{8,}\d')
-    email_regex = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
-
-    combined_text = combined_text.lower()
-    phone_numbers = phone_regex.findall(combined_text)
-    emails = email_regex.findall(combined_text)
-
-    ner_results["phone_numbers"].extend(phone_numbers)
-    ner_results["emails"].extend(emails)
+    for text, label in entities:
+        if label == "PERSON":
+            ner_results["names"].append(text)
+        elif label == "GPE": 
+            ner_results["addresses"].append(text)
+
+    # Single pass over the text for every PII pattern
+    pii = extract_pii(combined_text)
+
+    ner_results["phone_numbers"].extend(pii["phone"])
+    ner_results["emails"].extend(pii["email"])
+    ner_results["abha_numbers"] = pii["abha_number"]
+    ner_results["abha_addresses"] = pii["abha_address"]
+    ner_results["aadhaar_masked"] = pii["aadhaar_masked"]
+    ner_results["pin_codes"] = pii["pin_code"]
 
     return ner_results
@@ -0,0 +1,195 @@
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+from psycopg2 import extensions
+
+from database import get_connection, CONNECTION_ERRORS
+
+# Channel the database notifies when export data changes. Payloads are
+# "<table>:<branch_id>", "*:<branch_id>" or "*". Example trigger body:
+#   PERFORM pg_notify('export_invalidate', TG_TABLE_NAME || ':' || NEW.branch_id);
+INVALIDATION_CHANNEL = os.environ.get("EXPORT_INVALIDATION_CHANNEL", "export_invalidate")
+INVALIDATION_RECONNECT_DELAY = 5.0
+
+
+# Thread-safe in-process cache with a per-entry TTL and LRU eviction
+class TTLCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Function to drop every entry whose key matches the predicate
+    def invalidate(self, predicate=None):
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# LISTENs on INVALIDATION_CHANNEL from a dedicated connection (a pooled
+# one would be handed to other requests) and keeps generation counters
+# that the export cache folds into its data version. Registered callbacks
+# receive (table, branch_id) for every notification; "*" means any.
+class InvalidationListener:
+    def __init__(self, channel=INVALIDATION_CHANNEL, connect=get_connection):
+        self.channel = channel
+        self.connect = connect
+        self.notifications = 0
+        self.reconnects = 0
+        self._generations = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="export-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=INVALIDATION_RECONNECT_DELAY)
+            self._thread = None
+
+    # Data version of an export reading `tables` for a branch, as seen
+    # through notifications. Child tables without a branch_id notify with
+    # branch "*", which counts for every branch.
+    def version(self, tables, branch_id):
+        branch_id = str(branch_id)
+        with self._lock:
+            counters = [self._generations.get(("*", "*"), 0), self._generations.get(("*", branch_id), 0)]
+            for table_name in tables:
+                counters.append(self._generations.get((table_name, branch_id), 0))
+                counters.append(self._generations.get((table_name, "*"), 0))
+            return ".".join(str(counter) for counter in counters)
+
+    def handle(self, payload):
+        table_name, _, branch_id = payload.partition(":")
+        table_name = table_name or "*"
+        branch_id = branch_id or "*"
+        with self._lock:
+            key = (table_name, branch_id)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self.notifications += 1
+        for callback in self._callbacks:
+            try:
+                callback(table_name, branch_id)
+            except Exception as e:
+                logging.error(f"Invalidation callback failed: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                logging.info(f"Listening for export invalidations on {self.channel}")
+                # Anything may have changed while we were not listening
+                self.handle("*")
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.handle(conn.notifies.pop(0).payload)
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"Invalidation listener lost its connection: {str(e)}")
+                self.reconnects += 1
+                self._stop.wait(INVALIDATION_RECONNECT_DELAY)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def stats(self):
+        return {
+            "channel": self.channel,
+            "running": self.running,
+            "notifications": self.notifications,
+            "reconnects": self.reconnects,
+        }
+
+
+# Function to fingerprint the tables behind an export from Postgres'
+# cumulative statistics: rows inserted, updated and deleted per table, and
+# the relfilenode, which changes on TRUNCATE. This is one catalog read, not
+# a scan, and it sees every change, including to child tables and to
+# columns that have no timestamp. Counters are per table, so a change in
+# one branch also invalidates the others. Returns None when the counters
+# cannot be trusted (track_counts off, or a table without statistics).
+# The counters are not transactional and are published late: up to
+# PostgreSQL 14 the stats collector is sent them at most every 500 ms and
+# readers see a snapshot up to 500 ms old; from PostgreSQL 15 a backend
+# flushes them when a transaction ends, at most once a second, and a busy
+# backend may put that off for up to 60 seconds. Until then the version does
+# not change, so a cache hit can miss writes committed that recently.
+def table_stats_version(cursor, tables):
+    cursor.execute(
+        "SELECT current_setting('track_counts')::bool, count(*), "
+        "string_agg(concat_ws('.', s.relid, s.n_tup_ins, s.n_tup_upd, s.n_tup_del, pg_relation_filenode(s.relid)), "
+        "',' ORDER BY s.relid) "
+        "FROM pg_stat_user_tables s WHERE s.relid IN (SELECT to_regclass(t) FROM unnest(%s::text[]) AS t)",
+        (list(tables),),
+    )
+    track_counts, found, version = cursor.fetchone()
+    if not track_counts or found != len(tables):
+        return None
+    return version
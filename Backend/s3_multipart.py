@@ -0,0 +1,146 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import S3_REQUEST_SECONDS, S3_BYTES
+
+# S3 requires every part except the last one to be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+# File-like writer that turns a stream of bytes into an S3 multipart upload.
+# At most max_concurrency parts are uploading at once and one more is being
+# buffered, so memory stays flat no matter how large the object gets.
+class S3MultipartWriter:
+    def __init__(self, s3_client, bucket, key, part_size=DEFAULT_PART_SIZE, content_type=None, max_concurrency=1):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.content_type = content_type
+        self.max_concurrency = max(1, max_concurrency)
+        self.upload_id = None
+        self.parts = []
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._closed = False
+        self._next_part_number = 1
+        self._pending = []
+        self._executor = None
+        if self.max_concurrency > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="s3-part")
+
+    def _start(self):
+        extra = {"ContentType": self.content_type} if self.content_type else {}
+        with S3_REQUEST_SECONDS.time(operation="create_multipart_upload"):
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **extra)
+        self.upload_id = response["UploadId"]
+        logging.info(f"Started multipart upload {self.upload_id} for s3://{self.bucket}/{self.key}")
+
+    def _send_part(self, part_number, body):
+        with S3_REQUEST_SECONDS.time(operation="upload_part"):
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+        S3_BYTES.inc(len(body), direction="upload")
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            self._start()
+        part_number = self._next_part_number
+        self._next_part_number += 1
+        if self._executor is None:
+            self.parts.append(self._send_part(part_number, body))
+            return
+        # Wait for the oldest part when the pipeline is full
+        while len(self._pending) >= self.max_concurrency:
+            self.parts.append(self._pending.pop(0).result())
+        self._pending.append(self._executor.submit(self._send_part, part_number, body))
+
+    def _drain(self):
+        while self._pending:
+            self.parts.append(self._pending.pop(0).result())
+        self.parts.sort(key=lambda part: part["PartNumber"])
+
+    def _shutdown_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError("write to closed S3MultipartWriter")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    # tell/flush/closed let compressors and pyarrow use the writer as a sink
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Small objects never reach a full part, a plain put is cheaper
+        if self.upload_id is None:
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            with S3_REQUEST_SECONDS.time(operation="put_object"):
+                self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **extra)
+            S3_BYTES.inc(len(self._buffer), direction="upload")
+        else:
+            # A failed tail part or complete call must not leave the upload
+            # open with its parts stored (and billed)
+            try:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                self._drain()
+                self._shutdown_executor()
+                with S3_REQUEST_SECONDS.time(operation="complete_multipart_upload"):
+                    self.s3_client.complete_multipart_upload(
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        UploadId=self.upload_id,
+                        MultipartUpload={"Parts": self.parts},
+                    )
+            except BaseException:
+                self.abort()
+                raise
+        self._buffer = bytearray()
+        logging.info(f"Finished upload of {self.bytes_written} bytes to s3://{self.bucket}/{self.key}")
+
+    def abort(self):
+        self._closed = True
+        self._buffer = bytearray()
+        self._pending = []
+        self._shutdown_executor()
+        if self.upload_id is not None:
+            logging.warning(f"Aborting multipart upload {self.upload_id} for s3://{self.bucket}/{self.key}")
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
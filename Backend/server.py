@@ -0,0 +1,45 @@
+# Single entry point serving both apps: the export API at / and the OCR
+# API under OCR_PREFIX (default /ocr).
+#
+#   gunicorn -c gunicorn.conf.py      # preloaded, see gunicorn.conf.py before adding workers
+#   uvicorn server:app                # one worker, for development
+#
+# main:app and regex_ner:app still run on their own as before.
+import gc
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+_import_started = time.perf_counter()
+import main as export_api  # noqa: E402
+import regex_ner as ocr_api  # noqa: E402
+import ner_service  # noqa: E402
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+OCR_PREFIX = os.environ.get("OCR_PREFIX", "/ocr")
+# Load the spaCy model at import. With gunicorn's preload_app this happens
+# once in the master and the workers share the model's pages copy-on-write.
+PRELOAD_NER_MODEL = os.environ.get("PRELOAD_NER_MODEL", "1") == "1"
+
+if PRELOAD_NER_MODEL:
+    ner_service.get_nlp()
+# Everything loaded so far is long-lived; keeping it out of the collector's
+# generations stops worker GCs from writing to (and so copying) those pages
+gc.freeze()
+
+
+# Mounted apps do not get lifespan events, so run both of theirs here
+@asynccontextmanager
+async def lifespan(app):
+    async with export_api.lifespan(export_api.app), ocr_api.lifespan(ocr_api.app):
+        logging.info(f"Worker {os.getpid()} ready, apps imported in {IMPORT_SECONDS:.2f}s")
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.mount(OCR_PREFIX, ocr_api.app)
+app.mount("/", export_api.app)
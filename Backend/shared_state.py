@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# State that every worker process has to see: job, batch and branch export
+# records (so GET /jobs/{id} and friends work on any worker), Textract
+# completions that reached a worker other than the job's owner, and the
+# Textract TPS token buckets. "sqlite" shares it between the workers of one
+# host through SHARED_STATE_PATH, "redis" between hosts; "memory" keeps it
+# in the process and only suits a single worker.
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "sqlite")  # sqlite, redis or memory
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH", "shared_state.db")
+SHARED_STATE_REDIS_URL = os.environ.get("SHARED_STATE_REDIS_URL", "redis://localhost:6379/1")
+
+
+# In-process store, used with SHARED_STATE_BACKEND=memory and in tests
+class MemoryStateBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+        self._buckets = {}
+
+    def put(self, kind, key, value, ttl):
+        with self._lock:
+            self._records[(kind, key)] = (json.dumps(value), time.time() + ttl)
+
+    def get(self, kind, key):
+        with self._lock:
+            value, expires_at = self._records.get((kind, key), (None, 0))
+        return json.loads(value) if value is not None and expires_at > time.time() else None
+
+    def pop_many(self, kind, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                value, expires_at = self._records.pop((kind, key), (None, 0))
+                if value is not None and expires_at > now:
+                    found[key] = json.loads(value)
+        return found
+
+    def take_token(self, name, rate, capacity):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(name, (capacity, now))
+            tokens, wait = refill(tokens, updated, now, rate, capacity)
+            self._buckets[name] = (tokens, now)
+        return wait
+
+
+# Function to refill a token bucket and take one token from it. Returns the
+# new token count and how long to wait first (0 when a token was taken).
+def refill(tokens, updated, now, rate, capacity):
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+# SQLite store shared by the worker processes of one host. Every write is
+# its own transaction; token buckets use BEGIN IMMEDIATE so that two workers
+# never take the same token.
+class SQLiteStateBackend:
+    def __init__(self, path=SHARED_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+
+    # Connection of the current process, opened on first use so that a
+    # store created before a fork is never shared with the workers
+    @property
+    def _conn(self):
+        if self._connection is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_records ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (kind, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._connection, self._pid = conn, os.getpid()
+        return self._connection
+
+    def put(self, kind, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_records (kind, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (kind, key, json.dumps(value), now + ttl),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._conn.execute("DELETE FROM shared_records WHERE expires_at < ?", (now,))
+
+    def get(self, kind, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM shared_records WHERE kind = ? AND key = ? AND expires_at > ?",
+                (kind, key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def pop_many(self, kind, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        placeholders = ", ".join("?" for _ in keys)
+        with self._lock:
+            conn = self._conn
+            # Usually nothing is waiting; only take the write lock when something is
+            exists = conn.execute(
+                f"SELECT 1 FROM shared_records WHERE kind = ? AND key IN ({placeholders}) LIMIT 1", [kind, *keys]
+            ).fetchone()
+            if exists is None:
+                return {}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT key, value, expires_at FROM shared_records WHERE kind = ? AND key IN ({placeholders})",
+                    [kind, *keys],
+                ).fetchall()
+                if rows:
+                    conn.execute(
+                        f"DELETE FROM shared_records WHERE kind = ? AND key IN ({placeholders})", [kind, *keys]
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        now = time.time()
+        return {key: json.loads(value) for key, value, expires_at in rows if expires_at > now}
+
+    def take_token(self, name, rate, capacity):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE name = ?", (name,)).fetchone()
+                tokens, updated = row if row is not None else (capacity, now)
+                tokens, wait = refill(tokens, updated, now, rate, capacity)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens, now)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+
+# Token bucket update run atomically on the Redis server
+REDIS_TAKE_TOKEN = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local rate, capacity, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+"""
+
+
+# Redis store shared by the workers of every host
+class RedisStateBackend:
+    def __init__(self, url=SHARED_STATE_REDIS_URL, prefix="state:"):
+        if redis is None:
+            raise RuntimeError("SHARED_STATE_BACKEND=redis requires the redis package")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take_token = self._client.register_script(REDIS_TAKE_TOKEN)
+
+    def put(self, kind, key, value, ttl):
+        self._client.set(f"{self.prefix}{kind}:{key}", json.dumps(value), ex=max(1, int(ttl)))
+
+    def get(self, kind, key):
+        value = self._client.get(f"{self.prefix}{kind}:{key}")
+        return json.loads(value) if value is not None else None
+
+    def pop_many(self, kind, keys):
+        found = {}
+        for key in keys:
+            pipeline = self._client.pipeline()
+            pipeline.get(f"{self.prefix}{kind}:{key}")
+            pipeline.delete(f"{self.prefix}{kind}:{key}")
+            value, _ = pipeline.execute()
+            if value is not None:
+                found[key] = json.loads(value)
+        return found
+
+    def take_token(self, name, rate, capacity):
+        return float(self._take_token(keys=[f"{self.prefix}bucket:{name}"], args=[rate, capacity, time.time()]))
+
+
+# Shared records and token buckets with error counters. A failing backend
+# is logged and never fails the request or job that touched it: records
+# fall back to "not found" and callers of take_token to a local bucket.
+class SharedState:
+    def __init__(self, backend, name=SHARED_STATE_BACKEND):
+        self.backend = backend
+        self.name = name
+        self.errors = 0
+
+    def _call(self, operation, *args, default=None):
+        try:
+            return getattr(self.backend, operation)(*args)
+        except Exception as e:
+            logging.error(f"Shared state {operation} failed: {str(e)}")
+            self.errors += 1
+            return default
+
+    def put(self, kind, key, value, ttl):
+        self._call("put", kind, key, value, ttl)
+
+    def get(self, kind, key):
+        return self._call("get", kind, key)
+
+    def pop_many(self, kind, keys):
+        return self._call("pop_many", kind, keys, default={})
+
+    # Raises on backend errors, see RateLimiter
+    def take_token(self, name, rate, capacity):
+        return self.backend.take_token(name, rate, capacity)
+
+    def stats(self):
+        return {"backend": self.name, "errors": self.errors}
+
+
+def create_shared_state(backend=SHARED_STATE_BACKEND):
+    if backend == "redis":
+        return SharedState(RedisStateBackend(), backend)
+    if backend == "sqlite":
+        return SharedState(SQLiteStateBackend(), backend)
+    return SharedState(MemoryStateBackend(), "memory")
+
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+# The benchmarks start their stand-ins the same way
+from local_services import make_bucket, start_moto  # noqa: E402,F401
+
+
+# Scratch Postgres database given by TEST_DATABASE_URL (never the app's
+# DB_* settings); tests using it are skipped without one
+@pytest.fixture
+def pg_url():
+    pytest.importorskip("psycopg2")
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return url
+
+
+@pytest.fixture
+def pg_conn(pg_url):
+    import psycopg2
+
+    conn = psycopg2.connect(pg_url)
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+# In-process moto S3 server; yields its endpoint URL
+@pytest.fixture(scope="session")
+def moto_endpoint():
+    pytest.importorskip("moto.server")
+    pytest.importorskip("boto3")
+    server, endpoint = start_moto()
+    yield endpoint
+    server.stop()
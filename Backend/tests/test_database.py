@@ -0,0 +1,34 @@
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from database import ConnectionPool  # noqa: E402
+
+
+@pytest.fixture
+def pool(pg_url):
+    pool = ConnectionPool(connect=lambda: psycopg2.connect(pg_url), min_size=0, max_size=1)
+    yield pool
+    pool.closeall()
+
+
+@pytest.mark.parametrize("name", [None, "export_rows"])
+def test_query_error_propagates_from_cursor(pool, name):
+    with pytest.raises(psycopg2.errors.DivisionByZero):
+        with pool.cursor(name=name) as cursor:
+            cursor.execute("SELECT 1 / 0")
+            cursor.fetchall()
+    assert pool.stats()["in_use"] == 0
+
+
+def test_caller_error_propagates_from_named_cursor(pool):
+    with pytest.raises(ValueError, match="bad row"):
+        with pool.cursor(name="export_rows") as cursor:
+            cursor.execute("SELECT generate_series(1, 10)")
+            cursor.fetchmany(2)
+            raise ValueError("bad row")
+
+    # The connection went back to the pool in a usable state
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT 1")
+        assert cursor.fetchone() == (1,)
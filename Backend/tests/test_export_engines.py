@@ -0,0 +1,39 @@
+import io
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from export_engines import CopyText, copy_export, python_export, truncate_field  # noqa: E402
+
+PARITY_ROWS = """
+    CREATE TEMP TABLE engine_parity (id int, flag bool, doc json, docb jsonb, note text) ON COMMIT DROP;
+    INSERT INTO engine_parity VALUES
+        (1, true, '{"b": 1,  "a": [1, 2]}', '{"b": 1, "a": {"nested": true}}', 'plain'),
+        (2, false, '[1, "two", null]', '[]', repeat('x', 150)),
+        (3, NULL, NULL, NULL, NULL),
+        (4, true, '"a string, with a comma"', '{"quote": "say \\"hi\\""}', 'line
+break');
+"""
+
+
+def test_truncation_skips_values_formatted_by_postgres():
+    long_json = CopyText('{"k": "' + "v" * 200 + '"}')
+    assert truncate_field(long_json) == long_json
+    assert truncate_field("v" * 200) == "v" * 100 + "..."
+
+
+def test_python_and_copy_engines_write_the_same_csv(pg_conn):
+    with pg_conn.cursor() as cursor:
+        cursor.execute(PARITY_ROWS)
+    query = "SELECT * FROM engine_parity ORDER BY id"
+
+    copy_output = io.BytesIO()
+    with pg_conn.cursor() as cursor:
+        copy_export(cursor, query, copy_output)
+    python_output = io.BytesIO()
+    with pg_conn.cursor() as cursor:
+        python_export(cursor, query, python_output)
+
+    assert python_output.getvalue() == copy_output.getvalue()
+    assert b"1,t," in copy_output.getvalue()
@@ -0,0 +1,24 @@
+import os
+import time
+
+import export_storage
+
+
+def test_cleanup_only_removes_expired_export_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_storage, "EXPORT_DIR", str(tmp_path))
+    _, expired = export_storage.new_export_path("report.csv")
+    _, fresh = export_storage.new_export_path("report.csv")
+    # Checked-in reports and anything else that is not an export id
+    for name in ("branch_id_6", "ABCDEF0123456789ABCDEF0123456789", "exports"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "report.csv").write_text("id\n1\n")
+    old = time.time() - 7200
+    for path in [os.path.dirname(expired)] + [str(tmp_path / name) for name in ("branch_id_6", "ABCDEF0123456789ABCDEF0123456789", "exports")]:
+        os.utime(path, (old, old))
+
+    assert export_storage.cleanup_exports(retention=3600) == 1
+    assert not os.path.exists(os.path.dirname(expired))
+    assert os.path.isdir(os.path.dirname(fresh))
+    assert sorted(entry.name for entry in tmp_path.iterdir() if entry.name != os.path.basename(os.path.dirname(fresh))) == [
+        "ABCDEF0123456789ABCDEF0123456789", "branch_id_6", "exports",
+    ]
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from conftest import make_bucket
+from s3_multipart import MIN_PART_SIZE, S3MultipartWriter
+
+BUCKET = "ocr-swingbell"
+
+
+# Records calls; parts with lower numbers take longer, so with concurrency
+# they finish out of order
+class RecordingClient:
+    def __init__(self, fail_part=None, fail_complete=False):
+        self.fail_part = fail_part
+        self.fail_complete = fail_complete
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def create_multipart_upload(self, **kwargs):
+        self.calls.append(("create", kwargs))
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.05 / PartNumber)
+            if PartNumber == self.fail_part:
+                raise RuntimeError(f"part {PartNumber} failed")
+            return {"ETag": f'"etag-{PartNumber}-{len(Body)}"'}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def complete_multipart_upload(self, **kwargs):
+        self.calls.append(("complete", kwargs))
+        if self.fail_complete:
+            raise RuntimeError("complete failed")
+
+    def abort_multipart_upload(self, **kwargs):
+        self.calls.append(("abort", kwargs))
+
+    def put_object(self, **kwargs):
+        self.calls.append(("put", kwargs))
+
+
+def test_parts_are_completed_in_order_with_bounded_concurrency():
+    client = RecordingClient()
+    writer = S3MultipartWriter(client, BUCKET, "key", part_size=MIN_PART_SIZE, max_concurrency=3)
+    with writer:
+        for _ in range(7):
+            writer.write(b"x" * (MIN_PART_SIZE - 1024))
+        writer.write(b"tail")
+
+    operations = [name for name, _ in client.calls]
+    assert operations == ["create", "complete"]
+    parts = client.calls[-1][1]["MultipartUpload"]["Parts"]
+    assert [part["PartNumber"] for part in parts] == list(range(1, len(parts) + 1))
+    assert parts[0]["ETag"] == f'"etag-1-{MIN_PART_SIZE}"'
+    assert sum(int(part["ETag"].strip('"').split("-")[2]) for part in parts) == writer.bytes_written
+    assert 1 < client.max_in_flight <= 3
+
+
+def test_part_size_is_raised_to_the_s3_minimum():
+    writer = S3MultipartWriter(RecordingClient(), BUCKET, "key", part_size=1024)
+    assert writer.part_size == MIN_PART_SIZE
+
+
+def test_small_objects_use_a_single_put():
+    client = RecordingClient()
+    with S3MultipartWriter(client, BUCKET, "key", content_type="text/csv") as writer:
+        writer.write("a,b\n")
+    assert client.calls == [("put", {"Bucket": BUCKET, "Key": "key", "Body": b"a,b\n", "ContentType": "text/csv"})]
+
+
+def test_failed_part_aborts_the_upload():
+    client = RecordingClient(fail_part=2)
+    with pytest.raises(RuntimeError, match="part 2 failed"):
+        with S3MultipartWriter(client, BUCKET, "key", part_size=MIN_PART_SIZE, max_concurrency=2) as writer:
+            for _ in range(4):
+                writer.write(b"x" * MIN_PART_SIZE)
+
+    operations = [name for name, _ in client.calls]
+    assert operations == ["create", "abort"]
+    assert client.calls[-1][1]["UploadId"] == "upload-1"
+
+
+def test_failed_tail_part_aborts_the_upload():
+    client = RecordingClient(fail_part=3)
+    writer = S3MultipartWriter(client, BUCKET, "key", part_size=MIN_PART_SIZE, max_concurrency=2)
+    writer.write(b"x" * (2 * MIN_PART_SIZE + 10))
+    with pytest.raises(RuntimeError, match="part 3 failed"):
+        writer.close()
+    assert [name for name, _ in client.calls] == ["create", "abort"]
+    assert writer.closed
+
+
+def test_failed_complete_aborts_the_upload():
+    client = RecordingClient(fail_complete=True)
+    with pytest.raises(RuntimeError, match="complete failed"):
+        with S3MultipartWriter(client, BUCKET, "key", part_size=MIN_PART_SIZE) as writer:
+            writer.write(b"x" * (MIN_PART_SIZE + 10))
+    assert [name for name, _ in client.calls] == ["create", "complete", "abort"]
+
+
+def test_error_in_caller_aborts_the_upload():
+    client = RecordingClient()
+    with pytest.raises(ValueError):
+        with S3MultipartWriter(client, BUCKET, "key", part_size=MIN_PART_SIZE) as writer:
+            writer.write(b"x" * MIN_PART_SIZE)
+            raise ValueError("export failed")
+    assert [name for name, _ in client.calls] == ["create", "abort"]
+
+
+def test_multipart_round_trip_against_moto(moto_endpoint):
+    s3_client = make_bucket(moto_endpoint, BUCKET)
+    body = os.urandom(2 * MIN_PART_SIZE + 12345)
+    with S3MultipartWriter(s3_client, BUCKET, "round-trip", max_concurrency=3) as writer:
+        for start in range(0, len(body), 1000003):
+            writer.write(body[start:start + 1000003])
+
+    assert s3_client.get_object(Bucket=BUCKET, Key="round-trip")["Body"].read() == body
+    assert s3_client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+
+
+def test_multipart_abort_against_moto(moto_endpoint):
+    s3_client = make_bucket(moto_endpoint, BUCKET)
+    with pytest.raises(ValueError):
+        with S3MultipartWriter(s3_client, BUCKET, "aborted") as writer:
+            writer.write(os.urandom(MIN_PART_SIZE + 1))
+            raise ValueError("stop")
+
+    uploads = s3_client.list_multipart_uploads(Bucket=BUCKET, Prefix="aborted").get("Uploads", [])
+    assert uploads == []
+
+
+# /presigned-upload, browser-style part PUTs and /presigned-upload/complete
+@pytest.fixture(scope="module")
+def ocr_app(moto_endpoint):
+    pytest.importorskip("fastapi")
+    os.environ.update({
+        "S3_ENDPOINT_URL": moto_endpoint,
+        "LOG_FILE": "",
+        "OCR_CACHE_BACKEND": "none",
+        "UPLOAD_PART_SIZE": "1024",
+    })
+    import regex_ner
+    from fastapi.testclient import TestClient
+
+    make_bucket(moto_endpoint, regex_ner.S3_BUCKET)
+    return regex_ner, TestClient(regex_ner.app)
+
+
+def put(url, data):
+    request = urllib.request.Request(url, data=data, method="PUT")
+    with urllib.request.urlopen(request) as response:
+        return response.headers["ETag"]
+
+
+def test_presigned_multipart_upload_flow(ocr_app):
+    regex_ner, client = ocr_app
+    assert regex_ner.UPLOAD_PART_SIZE == MIN_PART_SIZE
+    body = os.urandom(2 * MIN_PART_SIZE + 100)
+
+    upload = client.post("/presigned-upload", params={"filename": "scan.pdf", "size": len(body)}).json()
+    assert upload["method"] == "MULTIPART"
+    assert upload["part_size"] == MIN_PART_SIZE
+    assert [part["part_number"] for part in upload["parts"]] == [1, 2, 3]
+
+    # Parts may finish in any order; complete sorts them
+    parts = []
+    for part in reversed(upload["parts"]):
+        start = (part["part_number"] - 1) * upload["part_size"]
+        etag = put(part["url"], body[start:start + upload["part_size"]])
+        parts.append({"PartNumber": part["part_number"], "ETag": etag})
+
+    response = client.post("/presigned-upload/complete", json={"key": upload["key"], "upload_id": upload["upload_id"], "parts": parts})
+    assert response.status_code == 200
+    stored = regex_ner.s3_client.get_object(Bucket=regex_ner.S3_BUCKET, Key=upload["key"])["Body"].read()
+    assert stored == body
+
+
+def test_presigned_single_put(ocr_app):
+    regex_ner, client = ocr_app
+    upload = client.post("/presigned-upload", params={"filename": "small.png", "size": 10, "content_type": "image/png"}).json()
+    assert upload["method"] == "PUT"
+    request = urllib.request.Request(upload["url"], data=b"0123456789", method="PUT", headers={"Content-Type": "image/png"})
+    urllib.request.urlopen(request).close()
+    head = regex_ner.s3_client.head_object(Bucket=regex_ner.S3_BUCKET, Key=upload["key"])
+    assert head["ContentLength"] == 10
+
+
+def test_presigned_upload_abort(ocr_app):
+    regex_ner, client = ocr_app
+    upload = client.post("/presigned-upload", params={"filename": "big.pdf", "size": 3 * MIN_PART_SIZE}).json()
+    response = client.post("/presigned-upload/abort", json={"key": upload["key"], "upload_id": upload["upload_id"]})
+    assert response.status_code == 200
+    uploads = regex_ner.s3_client.list_multipart_uploads(Bucket=regex_ner.S3_BUCKET, Prefix=upload["key"]).get("Uploads", [])
+    assert uploads == []
+
+    assert client.post("/presigned-upload/abort", json={"key": "other/key", "upload_id": "x"}).status_code == 400
+
+
+def test_stale_uploads_are_aborted(ocr_app):
+    regex_ner, client = ocr_app
+    upload = client.post("/presigned-upload", params={"filename": "stale.pdf", "size": 3 * MIN_PART_SIZE}).json()
+    assert regex_ner.abort_stale_uploads(max_age=3600) == 0
+    assert regex_ner.abort_stale_uploads(max_age=-60) >= 1
+    uploads = regex_ner.s3_client.list_multipart_uploads(Bucket=regex_ner.S3_BUCKET, Prefix=upload["key"]).get("Uploads", [])
+    assert uploads == []
+
+
+def test_old_batches_are_pruned(ocr_app):
+    regex_ner, client = ocr_app
+    finished = regex_ner.new_batch(1, "TEXT", 1)
+    finished["finished_at"] = time.time() - 7200
+    running = regex_ner.new_batch(1, "TEXT", 1)
+    abandoned = regex_ner.new_batch(1, "TEXT", 1)
+    abandoned["started_at"] = time.time() - 2 * 24 * 3600
+
+    assert regex_ner.prune_batches(retention=3600, max_age=24 * 3600) == 2
+    assert client.get(f"/batches/{finished['batch_id']}").status_code == 404
+    assert client.get(f"/batches/{abandoned['batch_id']}").status_code == 404
+    assert client.get(f"/batches/{running['batch_id']}").status_code == 200
@@ -0,0 +1,93 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+import textract_jobs
+from shared_state import MemoryStateBackend, SQLiteStateBackend, SharedState
+
+
+# Two stores on one file stand in for two worker processes
+def test_sqlite_records_are_seen_by_every_worker(tmp_path):
+    first, second = SQLiteStateBackend(str(tmp_path / "state.db")), SQLiteStateBackend(str(tmp_path / "state.db"))
+    first.put("batch", "b1", {"completed": 1}, 60)
+    first.put("batch", "expired", {"completed": 0}, -1)
+
+    assert second.get("batch", "b1") == {"completed": 1}
+    assert second.get("batch", "expired") is None
+    assert second.get("textract_job", "b1") is None
+
+    first.put("textract_notification", "t1", "SUCCEEDED", 60)
+    assert second.pop_many("textract_notification", ["t1", "t2"]) == {"t1": "SUCCEEDED"}
+    assert first.pop_many("textract_notification", ["t1"]) == {}
+
+
+def test_sqlite_token_bucket_is_shared(tmp_path):
+    first, second = SQLiteStateBackend(str(tmp_path / "state.db")), SQLiteStateBackend(str(tmp_path / "state.db"))
+    assert first.take_token("textract_get", 1, 2) == 0
+    assert second.take_token("textract_get", 1, 2) == 0
+    # The burst of 2 is used up by both workers together
+    assert 0 < second.take_token("textract_get", 1, 2) <= 1
+    assert first.take_token("textract_start", 1, 2) == 0
+
+
+def test_failing_store_reports_not_found():
+    class Broken:
+        def get(self, kind, key):
+            raise OSError("disk full")
+
+    state = SharedState(Broken(), "sqlite")
+    assert state.get("batch", "b1") is None
+    assert state.stats() == {"backend": "sqlite", "errors": 1}
+
+
+def test_notification_reaching_another_worker_completes_the_job(monkeypatch):
+    monkeypatch.setattr(textract_jobs, "SHARED_NOTIFICATION_INTERVAL", 0.01)
+    state = SharedState(MemoryStateBackend(), "memory")
+
+    async def run():
+        owner = textract_jobs.JobManager(initial_delay=30, state=state)
+        other = textract_jobs.JobManager(initial_delay=30, state=state)
+        owner.start()
+        other.start()
+        try:
+            job = owner.submit(
+                "text", "t1", "scan.pdf",
+                get_fn=lambda **kwargs: {"JobStatus": "SUCCEEDED"},
+                process_fn=lambda pages, on_page: "text",
+            )
+            await asyncio.sleep(0.05)
+            assert (await other.lookup(job.id))["status"] == job.status
+            other.notify("t1", "SUCCEEDED")
+            await asyncio.wait_for(owner.wait(job), timeout=5)
+            await asyncio.sleep(0.05)
+            return job, await other.lookup(job.id)
+        finally:
+            await owner.stop()
+            await other.stop()
+
+    job, seen = asyncio.run(run())
+    assert job.status == "SUCCEEDED"
+    assert job.notifications == 1
+    assert seen["status"] == "SUCCEEDED"
+
+
+# Another process cannot take the lock file of a (branch, table) being exported
+def test_export_lock_is_held_across_processes(tmp_path):
+    incremental_export = pytest.importorskip("incremental_export")
+    if incremental_export.fcntl is None:
+        pytest.skip("needs fcntl")
+    lock_dir = str(tmp_path / "locks")
+    probe = (
+        "import fcntl, os, sys\n"
+        "for name in os.listdir(sys.argv[1]):\n"
+        "    with open(os.path.join(sys.argv[1], name), 'a') as f:\n"
+        "        try:\n"
+        "            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+        "        except BlockingIOError:\n"
+        "            sys.exit(1)\n"
+    )
+    with incremental_export.export_lock("6", "diagnostic_report", lock_dir):
+        assert subprocess.run([sys.executable, "-c", probe, lock_dir]).returncode == 1
+    assert subprocess.run([sys.executable, "-c", probe, lock_dir]).returncode == 0
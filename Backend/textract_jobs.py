@@ -0,0 +1,522 @@
+import asyncio
+import base64
+import functools
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+try:
+    from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError
+except ImportError:
+    ClientError = BotocoreConnectionError = None
+
+from blocking_io import run_blocking
+from metrics import TEXTRACT_QUEUE_SECONDS, TEXTRACT_PROCESSING_SECONDS, TEXTRACT_JOBS, TEXTRACT_PAGES
+from textract_results import iter_result_pages
+
+# Polling backoff for Textract Get* calls
+JOB_POLL_INITIAL_DELAY = float(os.environ.get("JOB_POLL_INITIAL_DELAY", "1"))
+JOB_POLL_MAX_DELAY = float(os.environ.get("JOB_POLL_MAX_DELAY", "30"))
+JOB_POLL_BACKOFF = float(os.environ.get("JOB_POLL_BACKOFF", "2"))
+# When SNS notifications are wired up, polling is only a safety net
+JOB_POLL_MAX_DELAY_WITH_NOTIFICATIONS = float(os.environ.get("JOB_POLL_MAX_DELAY_WITH_NOTIFICATIONS", "120"))
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", "3600"))
+# Finished jobs are kept this long for GET /jobs/{id}
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", "86400"))
+# How often a worker picks up completions that reached another worker
+SHARED_NOTIFICATION_INTERVAL = float(os.environ.get("SHARED_NOTIFICATION_INTERVAL", "1"))
+
+# Get* failures that say nothing about the job itself: the poll is retried
+# with the usual backoff until JOB_TIMEOUT instead of failing the job
+TRANSIENT_ERROR_CODES = {
+    "ThrottlingException", "ProvisionedThroughputExceededException", "LimitExceededException",
+    "InternalServerError", "ServiceUnavailable", "RequestTimeout", "RequestTimeoutException",
+}
+# Retries for each NextToken page of a finished job
+JOB_PAGE_RETRIES = int(os.environ.get("JOB_PAGE_RETRIES", "5"))
+
+# Textract transaction quotas (per account and region). Start* calls and
+# Get* polls are throttled to stay under them when many jobs are in flight;
+# with a shared state store the budget is shared by every worker.
+TEXTRACT_START_TPS = float(os.environ.get("TEXTRACT_START_TPS", "2"))
+TEXTRACT_GET_TPS = float(os.environ.get("TEXTRACT_GET_TPS", "5"))
+
+# Textract SNS notification channel, see StartDocumentTextDetection NotificationChannel
+TEXTRACT_SNS_TOPIC_ARN = os.environ.get("TEXTRACT_SNS_TOPIC_ARN")
+TEXTRACT_SNS_ROLE_ARN = os.environ.get("TEXTRACT_SNS_ROLE_ARN")
+# Verify the signature of SNS deliveries (needs the cryptography package).
+# Only turn this off behind a trusted proxy that already verifies them.
+SNS_VERIFY_SIGNATURE = os.environ.get("SNS_VERIFY_SIGNATURE", "1") == "1"
+SNS_HOST = re.compile(r"^sns\.([a-z0-9-]+)\.amazonaws\.com(\.cn)?$")
+
+# Hosts that job completion webhooks may be posted to (comma separated).
+# callback_url is rejected when it is empty or the host is not listed.
+CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.environ.get("CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+# PROCESSING: Textract is done and result pages are being read
+PENDING_STATES = ("SUBMITTED", "IN_PROGRESS", "PROCESSING")
+FINISHED_STATES = ("SUCCEEDED", "PARTIAL_SUCCESS", "FAILED")
+
+
+# Function to tell throttling and connection errors, which are worth
+# retrying, from errors about the job or the request
+def is_transient(error):
+    if BotocoreConnectionError is not None and isinstance(error, BotocoreConnectionError):
+        return True
+    if ClientError is not None and isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+# Function to wrap a blocking call so transient errors are retried with
+# exponential backoff, at most `retries` times
+def retry_transient(fn, retries=JOB_PAGE_RETRIES, initial_delay=JOB_POLL_INITIAL_DELAY):
+    def call(*args, **kwargs):
+        delay = initial_delay
+        for attempt in range(retries + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == retries or not is_transient(e):
+                    raise
+                logging.warning(f"Transient Textract error, retrying in {delay:.1f}s: {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * JOB_POLL_BACKOFF, JOB_POLL_MAX_DELAY)
+
+    return call
+
+
+# Extra arguments for Start* calls so Textract publishes completion to SNS
+def notification_channel():
+    if TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_SNS_ROLE_ARN:
+        return {"NotificationChannel": {"SNSTopicArn": TEXTRACT_SNS_TOPIC_ARN, "RoleArn": TEXTRACT_SNS_ROLE_ARN}}
+    return {}
+
+
+# Async token bucket allowing `rate` calls per second with bursts of `burst`.
+# With `state` (a shared_state.SharedState) the bucket `name` lives in the
+# shared store and is drawn from by every worker; when the store fails, the
+# limiter falls back to a bucket of its own.
+class RateLimiter:
+    def __init__(self, rate, burst=None, state=None, name=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+        self.state = state
+        self.name = name
+        self._lock = None
+
+    # Function to take a token from the shared bucket. Returns the seconds to
+    # wait (0 once a token was taken), or None when the store failed.
+    def _take_shared(self):
+        try:
+            return self.state.take_token(self.name, self.rate, self.capacity)
+        except Exception as e:
+            logging.error(f"Shared rate limit {self.name} failed, using the local bucket: {str(e)}")
+            return None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self.state is not None:
+                wait = await run_blocking(self._take_shared)
+                if wait is None:
+                    break
+                if wait == 0:
+                    return
+                self.waits += 1
+                await asyncio.sleep(wait)
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self.waits += 1
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # Function to take a token from a worker thread. The shared bucket is
+    # used from the calling thread; the local one waits on `loop`.
+    def acquire_blocking(self, loop):
+        while self.state is not None:
+            wait = self._take_shared()
+            if wait is None:
+                break
+            if wait == 0:
+                return
+            self.waits += 1
+            time.sleep(wait)
+        asyncio.run_coroutine_threadsafe(self.acquire(), loop).result()
+
+    # Function to wrap a blocking API call so every call takes a token first
+    def wrap(self, fn, loop):
+        def call(*args, **kwargs):
+            self.acquire_blocking(loop)
+            return fn(*args, **kwargs)
+
+        return call
+
+
+class TextractJob:
+    def __init__(self, kind, textract_job_id, filename, callback_url=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.textract_job_id = textract_job_id
+        self.filename = filename
+        self.callback_url = callback_url
+        self.status = "SUBMITTED"
+        self.result = None
+        self.error = None
+        self.warnings = []
+        # Per-page results, filled in while the result pages are processed
+        self.pages = []
+        self.polls = 0
+        self.transient_errors = 0
+        self.notifications = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self._started = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._done = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "textract_job_id": self.textract_job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "warnings": self.warnings,
+            "pages_processed": len(self.pages),
+            "pages": self.pages,
+            "polls": self.polls,
+            "transient_errors": self.transient_errors,
+            "notifications": self.notifications,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# Tracks submitted Textract jobs and drives each one to completion in the
+# background. A job is re-checked either when its backoff delay expires or
+# as soon as a completion notification arrives on the notification queue
+# (SNS in production, the same queue fed by hand or by tests locally).
+# A job is driven by the worker that submitted it. With `state` (a
+# shared_state.SharedState) its record is published there on every status
+# change so that any worker can answer lookup(), and a completion that
+# reaches another worker is handed over through the store.
+class JobManager:
+    def __init__(self, initial_delay=JOB_POLL_INITIAL_DELAY, max_delay=JOB_POLL_MAX_DELAY,
+                 backoff=JOB_POLL_BACKOFF, timeout=JOB_TIMEOUT, state=None):
+        self.initial_delay = initial_delay
+        self.max_delay = JOB_POLL_MAX_DELAY_WITH_NOTIFICATIONS if notification_channel() else max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self.state = state
+        self.start_limiter = RateLimiter(TEXTRACT_START_TPS, state=state, name="textract_start")
+        self.get_limiter = RateLimiter(TEXTRACT_GET_TPS, state=state, name="textract_get")
+        self.jobs = {}
+        self._by_textract_id = {}
+        self._tasks = set()
+        self._notifications = None
+        self._consumers = []
+
+    def start(self):
+        self._notifications = asyncio.Queue()
+        self._consumers = [asyncio.create_task(self._consume_notifications())]
+        if self.state is not None:
+            self._consumers.append(asyncio.create_task(self._collect_shared_notifications()))
+
+    async def stop(self):
+        for task in list(self._tasks) + self._consumers:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._consumers, return_exceptions=True)
+        self._tasks.clear()
+        self._consumers = []
+
+    # Register a started Textract job. get_fn is the blocking Get* call and
+    # process_fn(result_pages, on_page) turns the paginated results into the
+    # job result, reporting each document page through on_page. on_success
+    # is called with the result of jobs that fully SUCCEEDED.
+    def submit(self, kind, textract_job_id, filename, get_fn, process_fn, callback_url=None, on_success=None):
+        self._prune()
+        job = TextractJob(kind, textract_job_id, filename, callback_url)
+        self.jobs[job.id] = job
+        self._by_textract_id[textract_job_id] = job
+        task = asyncio.create_task(self._watch(job, get_fn, process_fn, on_success))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logging.info(f"Tracking Textract job {textract_job_id} as job {job.id}")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    # Function to find a job submitted by any worker; returns its dict or None
+    async def lookup(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.state is None:
+            return None
+        return await run_blocking(self.state.get, "textract_job", job_id)
+
+    async def _publish(self, job):
+        if self.state is not None:
+            ttl = JOB_RETENTION if job.finished else self.timeout + JOB_RETENTION
+            await run_blocking(self.state.put, "textract_job", job.id, job.to_dict(), ttl)
+
+    async def wait(self, job):
+        await job._done.wait()
+        return job
+
+    # Feed a completion notification into the local queue
+    def notify(self, textract_job_id, status=None):
+        if self._notifications is None:
+            return
+        self._notifications.put_nowait((textract_job_id, status))
+
+    async def _consume_notifications(self):
+        while True:
+            textract_job_id, status = await self._notifications.get()
+            job = self._by_textract_id.get(textract_job_id)
+            if job is None and self.state is not None:
+                # Submitted by another worker, which collects it from the store
+                await run_blocking(self.state.put, "textract_notification", textract_job_id, status, self.timeout)
+                continue
+            if job is None or job.finished:
+                continue
+            logging.info(f"Notification for Textract job {textract_job_id}: {status}")
+            job.notifications += 1
+            job._wakeup.set()
+
+    # Function to move completions that other workers received for this
+    # worker's jobs onto the local notification queue
+    async def _collect_shared_notifications(self):
+        while True:
+            await asyncio.sleep(SHARED_NOTIFICATION_INTERVAL)
+            pending = [job.textract_job_id for job in self.jobs.values() if not job.finished]
+            if not pending:
+                continue
+            found = await run_blocking(self.state.pop_many, "textract_notification", pending)
+            for textract_job_id, status in found.items():
+                self._notifications.put_nowait((textract_job_id, status))
+
+    async def _watch(self, job, get_fn, process_fn, on_success=None):
+        delay = self.initial_delay
+        deadline = time.monotonic() + self.timeout
+        try:
+            await self._publish(job)
+            while True:
+                try:
+                    await asyncio.wait_for(job._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                job._wakeup.clear()
+
+                await self.get_limiter.acquire()
+                try:
+                    response = await run_blocking(get_fn, JobId=job.textract_job_id)
+                except Exception as e:
+                    if not is_transient(e):
+                        raise
+                    # The job is still running on Textract's side; poll again later
+                    job.transient_errors += 1
+                    logging.warning(f"Transient error polling Textract job {job.textract_job_id}: {str(e)}")
+                    if time.monotonic() > deadline:
+                        job.status = "FAILED"
+                        job.error = f"Timed out after {self.timeout}s, last error: {str(e)}"
+                        break
+                    delay = min(delay * self.backoff, self.max_delay)
+                    continue
+                job.polls += 1
+                status = response["JobStatus"]
+                logging.info(f"Textract job {job.textract_job_id} status: {status}")
+
+                if status == "IN_PROGRESS":
+                    if job.status != status:
+                        job.status = status
+                        await self._publish(job)
+                    if time.monotonic() > deadline:
+                        job.status = "FAILED"
+                        job.error = f"Timed out after {self.timeout}s"
+                        break
+                    delay = min(delay * self.backoff, self.max_delay)
+                    continue
+
+                TEXTRACT_QUEUE_SECONDS.observe(time.monotonic() - job._started, kind=job.kind)
+                if status == "FAILED":
+                    job.status = status
+                    job.error = response.get("StatusMessage", "Textract job failed")
+                    break
+
+                # SUCCEEDED or PARTIAL_SUCCESS: PARTIAL_SUCCESS carries per-page warnings
+                job.status = "PROCESSING"
+                await self._publish(job)
+                # NextToken pages are fetched from the executor thread and
+                # are throttled by the same Get* limiter as the polls
+                limited_get = retry_transient(self.get_limiter.wrap(get_fn, asyncio.get_running_loop()))
+                result_pages = iter_result_pages(limited_get, job.textract_job_id, response)
+                with TEXTRACT_PROCESSING_SECONDS.time(kind=job.kind):
+                    result = await run_blocking(process_fn, result_pages, job.pages.append)
+                TEXTRACT_PAGES.inc(len(job.pages), kind=job.kind)
+                job.warnings = response.get("Warnings", [])
+                job.result = result
+                job.status = status
+                if status == "SUCCEEDED" and on_success:
+                    await run_blocking(on_success, result)
+                break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error while processing Textract job {job.textract_job_id}: {str(e)}")
+            job.status = "FAILED"
+            job.error = str(e)
+
+        job.finished_at = time.time()
+        TEXTRACT_JOBS.inc(kind=job.kind, status=job.status)
+        await self._publish(job)
+        job._done.set()
+        logging.info(f"Job {job.id} finished with status {job.status} after {job.polls} polls")
+        if job.callback_url:
+            await run_blocking(post_callback, job.callback_url, job.to_dict())
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self.jobs[job_id]
+                self._by_textract_id.pop(job.textract_job_id, None)
+
+
+# Function to check a caller-supplied webhook URL: http(s) only, and only to
+# hosts in CALLBACK_ALLOWED_HOSTS. Raises ValueError otherwise.
+def validate_callback_url(url):
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    if parsed.hostname.lower() not in CALLBACK_ALLOWED_HOSTS:
+        raise ValueError(f"callback_url host '{parsed.hostname}' is not allowed")
+    return url
+
+
+# Redirects are not followed, so an allowed host cannot bounce the request
+# to an internal one
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+# Deliver a finished job to the caller-supplied webhook
+def post_callback(url, payload):
+    try:
+        validate_callback_url(url)
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with _callback_opener.open(request, timeout=10) as response:
+            logging.info(f"Delivered job {payload['job_id']} to {url}: HTTP {response.status}")
+    except Exception as e:
+        logging.error(f"Failed to deliver job {payload['job_id']} to {url}: {str(e)}")
+
+
+# Fields signed by SNS, in signing order, per message type
+SNS_SIGNED_FIELDS = {
+    "Notification": ("Message", "MessageId", "Subject", "Timestamp", "TopicArn", "Type"),
+    "SubscriptionConfirmation": ("Message", "MessageId", "SubscribeURL", "Timestamp", "Token", "TopicArn", "Type"),
+    "UnsubscribeConfirmation": ("Message", "MessageId", "SubscribeURL", "Timestamp", "Token", "TopicArn", "Type"),
+}
+
+
+# Function to check that a URL in an SNS message points at the SNS endpoint
+# of the topic's own region over https
+def check_sns_url(url, region):
+    parsed = urllib.parse.urlsplit(url or "")
+    match = SNS_HOST.match(parsed.hostname or "")
+    if parsed.scheme != "https" or match is None or match.group(1) != region:
+        raise ValueError(f"Refusing SNS URL '{url}'")
+    return url
+
+
+@functools.lru_cache(maxsize=8)
+def sns_certificate(url):
+    from cryptography import x509
+
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return x509.load_pem_x509_certificate(response.read())
+
+
+# Function to verify an SNS message signature (SignatureVersion 1 is
+# SHA1withRSA, 2 is SHA256withRSA)
+def verify_sns_signature(body, region):
+    try:
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+    except ImportError:
+        raise ValueError("SNS signature verification needs the cryptography package")
+
+    fields = SNS_SIGNED_FIELDS.get(body.get("Type"))
+    if fields is None:
+        raise ValueError(f"Unknown SNS message type '{body.get('Type')}'")
+    algorithm = {"1": hashes.SHA1, "2": hashes.SHA256}.get(str(body.get("SignatureVersion")))
+    if algorithm is None:
+        raise ValueError(f"Unsupported SNS SignatureVersion '{body.get('SignatureVersion')}'")
+    signed = "".join(f"{field}\n{body[field]}\n" for field in fields if body.get(field) is not None)
+    certificate = sns_certificate(check_sns_url(body.get("SigningCertURL"), region))
+    try:
+        certificate.public_key().verify(
+            base64.b64decode(body.get("Signature", "")), signed.encode("utf-8"), padding.PKCS1v15(), algorithm(),
+        )
+    except Exception:
+        raise ValueError("Invalid SNS message signature")
+
+
+# Parse an SNS HTTP delivery carrying a Textract completion message.
+# Returns (textract_job_id, status), or None for non-notification messages.
+# Raises ValueError for messages that are not from the configured topic or
+# whose signature does not verify. Without TEXTRACT_SNS_TOPIC_ARN, Textract
+# sends no notifications and only bare {"JobId": ..., "Status": ...} bodies
+# posted by hand are accepted; they only make the job poll early.
+def parse_sns_message(body):
+    if "Type" in body:
+        if not TEXTRACT_SNS_TOPIC_ARN or body.get("TopicArn") != TEXTRACT_SNS_TOPIC_ARN:
+            raise ValueError(f"Unexpected SNS topic '{body.get('TopicArn')}'")
+        region = TEXTRACT_SNS_TOPIC_ARN.split(":")[3]
+        if SNS_VERIFY_SIGNATURE:
+            verify_sns_signature(body, region)
+        if body["Type"] == "SubscriptionConfirmation":
+            with urllib.request.urlopen(check_sns_url(body.get("SubscribeURL"), region), timeout=10):
+                logging.info("Confirmed SNS subscription for Textract notifications")
+            return None
+        if body["Type"] != "Notification":
+            return None
+        message = json.loads(body.get("Message", "{}"))
+    elif TEXTRACT_SNS_TOPIC_ARN:
+        raise ValueError("Expected an SNS message")
+    else:
+        message = body
+    job_id = message.get("JobId")
+    if not job_id:
+        return None
+    return job_id, message.get("Status")
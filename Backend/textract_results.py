@@ -0,0 +1,208 @@
+import itertools
+import logging
+import os
+
+from block_graph import BlockGraph
+from metrics import KV_EXTRACTION_SECONDS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Lines and key/value pairs below this confidence (0-100) are left out of
+# the assembled text and the form data, so NER never sees them; low
+# confidence lines are listed per page instead. 0 keeps everything.
+OCR_MIN_CONFIDENCE = float(os.environ.get("OCR_MIN_CONFIDENCE", "0"))
+# "textract" keeps the order Textract returned the lines in, which follows
+# columns. "layout" (opt-in) reorders the lines of a page top to bottom,
+# left to right using their bounding boxes; this suits forms and tables but
+# interleaves the columns of multi-column pages.
+OCR_LINE_ORDER = os.environ.get("OCR_LINE_ORDER", "textract")
+# Lines whose vertical centres are closer than this fraction of the median
+# line height belong to the same row
+ROW_TOLERANCE = 0.5
+
+
+# Generator over every response page of a finished Textract job, following
+# NextToken until the last page. first_response is the Get* response that
+# reported the job as finished, so it is not fetched twice.
+def iter_result_pages(get_fn, job_id, first_response=None):
+    response = first_response if first_response is not None else get_fn(JobId=job_id)
+    result_pages = 1
+    while True:
+        yield response
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        response = get_fn(JobId=job_id, NextToken=next_token)
+        result_pages += 1
+    logging.info(f"Read {result_pages} result pages for Textract job {job_id}")
+
+
+# Generator that regroups streamed blocks by document page. Textract returns
+# blocks in page order, so a page is complete as soon as a block of the next
+# page shows up; only one document page is held in memory at a time.
+def iter_document_pages(result_pages):
+    current_page = None
+    blocks = []
+    for response in result_pages:
+        for block in response['Blocks']:
+            page = block.get('Page', 1)
+            if current_page is not None and page != current_page:
+                yield current_page, blocks
+                blocks = []
+            current_page = page
+            blocks.append(block)
+    if blocks:
+        yield current_page, blocks
+
+
+# Function to sort the lines of a page into reading order: lines are
+# grouped into rows by the vertical centre of their bounding boxes, rows go
+# top to bottom and lines within a row left to right. Returns line indices.
+# The pure-Python path gives the same order when numpy is not installed.
+def reading_order(boxes):
+    count = len(boxes)
+    if np is None:
+        centres = [box['Top'] + box['Height'] / 2 for box in boxes]
+        heights = sorted(box['Height'] for box in boxes)
+        middle = count // 2
+        median = heights[middle] if count % 2 else (heights[middle - 1] + heights[middle]) / 2
+        rows = [0] * count
+        row = 0
+        previous = None
+        for index in sorted(range(count), key=centres.__getitem__):
+            if previous is not None and centres[index] - previous > median * ROW_TOLERANCE:
+                row += 1
+            rows[index] = row
+            previous = centres[index]
+        return sorted(range(count), key=lambda index: (rows[index], boxes[index]['Left']))
+    top = np.fromiter((box['Top'] for box in boxes), dtype=np.float64, count=count)
+    left = np.fromiter((box['Left'] for box in boxes), dtype=np.float64, count=count)
+    height = np.fromiter((box['Height'] for box in boxes), dtype=np.float64, count=count)
+    centres = top + height / 2
+    by_centre = np.argsort(centres, kind="stable")
+    new_row = np.diff(centres[by_centre]) > np.median(height) * ROW_TOLERANCE
+    rows = np.empty(count, dtype=np.int64)
+    rows[by_centre] = np.concatenate(([0], np.cumsum(new_row)))
+    return np.lexsort((left, rows))
+
+
+# Function to tag results with the settings that shape them, so that the
+# OCR cache never serves a result produced under other settings
+def result_settings():
+    return f"order={OCR_LINE_ORDER},min={OCR_MIN_CONFIDENCE:g}"
+
+
+# Function to summarize line confidences: mean, min, max and percentiles
+# (linear interpolation, like numpy.percentile)
+def confidence_stats(confidences):
+    count = len(confidences)
+    if count == 0:
+        return {"lines": 0, "mean": 0, "min": 0, "p10": 0, "median": 0, "max": 0}
+    if np is not None:
+        values = np.asarray(confidences, dtype=np.float64)
+        p10, median = np.percentile(values, [10, 50])
+        return {"lines": count, "mean": float(values.mean()), "min": float(values.min()),
+                "p10": float(p10), "median": float(median), "max": float(values.max())}
+    values = sorted(confidences)
+
+    def percentile(q):
+        position = (count - 1) * q / 100
+        lower = int(position)
+        upper = min(lower + 1, count - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    return {"lines": count, "mean": sum(values) / count, "min": values[0],
+            "p10": percentile(10), "median": percentile(50), "max": values[-1]}
+
+
+# Function to assemble the text of a single document page from its LINE
+# blocks. Confidences and bounding boxes are pulled into arrays once, then
+# the threshold and the reading order are applied to the whole page at
+# once. Returns (text, confidences, low confidence lines). numpy only
+# speeds this up; the result is the same without it.
+def page_lines(blocks, min_confidence=OCR_MIN_CONFIDENCE, line_order=OCR_LINE_ORDER):
+    lines = [block for block in blocks if block['BlockType'] == 'LINE']
+    texts = [line['Text'] for line in lines]
+    if np is None or not lines:
+        confidences = [line['Confidence'] for line in lines]
+        keep = [confidence >= min_confidence for confidence in confidences]
+    else:
+        confidences = np.fromiter((line['Confidence'] for line in lines), dtype=np.float64, count=len(lines))
+        keep = confidences >= min_confidence
+    order = range(len(lines))
+    if line_order == "layout" and lines:
+        boxes = [line.get('Geometry', {}).get('BoundingBox') for line in lines]
+        if all(boxes):
+            order = reading_order(boxes)
+    text = ''.join(texts[index] + '\n' for index in order if keep[index])
+    low_confidence = [
+        {"text": texts[index], "confidence": float(confidences[index])} for index in order if not keep[index]
+    ]
+    return text, confidences, low_confidence
+
+
+# Function to extract key/value pairs from the blocks of a single document
+# page, dropping pairs whose KEY block is below the confidence threshold
+def page_key_values(blocks, min_confidence=OCR_MIN_CONFIDENCE):
+    with KV_EXTRACTION_SECONDS.time():
+        graph = BlockGraph(blocks)
+        if min_confidence <= 0:
+            return graph.key_values()
+        return {
+            key_text: value_text
+            for key_text, value_text, key_block in graph.iter_key_values()
+            if key_text and value_text and key_block.get('Confidence', 100.0) >= min_confidence
+        }
+
+
+# Function to assemble text for a whole document page by page. on_page is
+# called with each page summary as soon as that page is processed.
+def process_text_pages(result_pages, on_page=None):
+    texts = []
+    page_confidences = []
+    pages = []
+
+    for page, blocks in iter_document_pages(result_pages):
+        text, confidences, low_confidence = page_lines(blocks)
+        texts.append(text)
+        page_confidences.append(confidences)
+        stats = confidence_stats(confidences)
+        summary = {
+            "page": page,
+            "text": text,
+            "line_count": stats["lines"],
+            "average_confidence": stats["mean"],
+            "confidence": stats,
+            "low_confidence_lines": low_confidence,
+        }
+        pages.append({k: v for k, v in summary.items() if k != "text"})
+        if on_page:
+            on_page(summary)
+
+    if np is not None and page_confidences:
+        confidences = np.concatenate(page_confidences)
+    else:
+        confidences = list(itertools.chain.from_iterable(page_confidences))
+    stats = confidence_stats(confidences)
+    return {
+        "extracted_text": ''.join(texts),
+        "average_confidence": stats["mean"],
+        "confidence": stats,
+        "min_confidence": OCR_MIN_CONFIDENCE,
+        "low_confidence_line_count": sum(len(page["low_confidence_lines"]) for page in pages),
+        "pages": pages,
+    }
+
+
+# Function to extract key/value pairs for a whole document page by page
+def process_form_pages(result_pages, on_page=None):
+    extracted_key_values = {}
+    for page, blocks in iter_document_pages(result_pages):
+        key_values = page_key_values(blocks)
+        extracted_key_values.update(key_values)
+        if on_page:
+            on_page({"page": page, "key_values": key_values})
+    return extracted_key_values
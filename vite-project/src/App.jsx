@@ -1,10 +1,11 @@
-import FileUpload from './FileUpload'
+import FileUpload, { DirectUpload } from './FileUpload'
 
 function App() {
 
   return (
     <div className='app'>
       <FileUpload/>
+      <DirectUpload/>
     </div>
   )
 }
@@ -1,6 +1,106 @@
 import React, { useState } from 'react';
 import axios from 'axios';
 
+// server.py mounts the OCR API under /ocr; set VITE_OCR_API_URL when
+// running regex_ner:app on its own
+const OCR_API_URL = import.meta.env.VITE_OCR_API_URL || "http://localhost:8000/ocr";
+const PART_UPLOAD_CONCURRENCY = 4;
+
+// Upload a file straight to S3 through presigned URLs, so large scans never
+// pass through the API server. Returns the S3 key to hand to /ocr-from-s3.
+export const uploadToS3Direct = async (file, onProgress = () => {}) => {
+    const contentType = file.type || "application/octet-stream";
+    const { data: upload } = await axios.post(`${OCR_API_URL}/presigned-upload`, null, {
+        params: { filename: file.name, size: file.size, content_type: contentType },
+    });
+
+    if (upload.method === "PUT") {
+        await axios.put(upload.url, file, {
+            headers: { "Content-Type": contentType },
+            onUploadProgress: (e) => onProgress(e.loaded / file.size),
+        });
+        return upload.key;
+    }
+
+    // Multipart: send parts in parallel, S3 returns each part's ETag
+    const completed = [];
+    const loaded = {};
+    let next = 0;
+    const worker = async () => {
+        while (next < upload.parts.length) {
+            const part = upload.parts[next++];
+            const start = (part.part_number - 1) * upload.part_size;
+            const response = await axios.put(part.url, file.slice(start, start + upload.part_size), {
+                onUploadProgress: (e) => {
+                    loaded[part.part_number] = e.loaded;
+                    onProgress(Object.values(loaded).reduce((a, b) => a + b, 0) / file.size);
+                },
+            });
+            completed.push({ PartNumber: part.part_number, ETag: response.headers.etag });
+        }
+    };
+    try {
+        await Promise.all(Array.from({ length: PART_UPLOAD_CONCURRENCY }, worker));
+        await axios.post(`${OCR_API_URL}/presigned-upload/complete`, {
+            key: upload.key,
+            upload_id: upload.upload_id,
+            parts: completed,
+        });
+    } catch (err) {
+        // Release the parts already stored in S3
+        await axios.post(`${OCR_API_URL}/presigned-upload/abort`, {
+            key: upload.key,
+            upload_id: upload.upload_id,
+        }).catch(() => {});
+        throw err;
+    }
+    return upload.key;
+};
+
+export const DirectUpload = () => {
+    const [feature, setFeature] = useState("TEXT");
+    const [progress, setProgress] = useState(null);
+    const [result, setResult] = useState(null);
+    const [error, setError] = useState(null);
+
+    const handleUpload = async (e) => {
+        const file = e.target.files[0];
+        if (!file) {
+            return;
+        }
+        try {
+            setError(null);
+            setResult(null);
+            const key = await uploadToS3Direct(file, setProgress);
+            const response = await axios.post(`${OCR_API_URL}/ocr-from-s3`, null, {
+                params: { key, feature },
+            });
+            setResult(response.data);
+        } catch (error) {
+            console.error("Error uploading the file", error);
+            setError("Upload failed.");
+        } finally {
+            setProgress(null);
+        }
+    };
+
+    return (
+        <div>
+            <h2>Upload Scan</h2>
+
+            <select value={feature} onChange={(e) => setFeature(e.target.value)}>
+                <option value="TEXT">Text</option>
+                <option value="FORMS">Form</option>
+            </select>
+            <input type="file" onChange={handleUpload} />
+
+            {progress !== null && <p>Uploading… {Math.round(progress * 100)}%</p>}
+            {error && <p style={{ color: 'red' }}>{error}</p>}
+            {result && <pre>{JSON.stringify(result, null, 2)}</pre>}
+        </div>
+    );
+};
+
 const FileDownload = () => {
     const [branchId, setBranchId] = useState(6); // Default branch_id
     const [error, setError] = useState(null);
@@ -59,7 +159,7 @@ const FileDownload = () => {
             setError(null); // Clear any previous errors
 
             for (const tableName of tableNames) {
-                const url = `http://localhost:8000/download-csv?table_name=${tableName}&branch_id=${branchId}`;
+                const url = `http://localhost:8000/download-csv?table_name=${tableName}&branch_id=${branchId}&delivery=file`;
 
                 const response = await axios.get(url, {
                     responseType: 'blob', // Handle binary data (CSV)
@@ -79,6 +179,40 @@ const FileDownload = () => {
         }
     };
 
+    // One request for the whole branch: the server exports every table in
+    // parallel from a single snapshot and returns a zip
+    const handleDownloadZip = async () => {
+        try {
+            if (!branchId) {
+                setError("Branch ID is required.");
+                return;
+            }
+
+            setError(null);
+
+            const { data: job } = await axios.post(`http://localhost:8000/export-branch`, null, {
+                params: { branch_id: branchId, wait: true },
+            });
+            if (!job.download_url) {
+                setError("Branch export failed.");
+                return;
+            }
+
+            const response = await axios.get(`http://localhost:8000${job.download_url}`, {
+                responseType: 'blob',
+            });
+            const downloadUrl = window.URL.createObjectURL(new Blob([response.data]));
+            const link = document.createElement('a');
+            link.href = downloadUrl;
+            link.setAttribute('download', `branch_${branchId}_export.zip`);
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+        } catch (error) {
+            console.error("Error downloading the branch export", error);
+        }
+    };
+
     return (
         <div>
             <h2>Download All Reports CSV</h2>
@@ -92,6 +226,7 @@ const FileDownload = () => {
             {error && <p style={{ color: 'red' }}>{error}</p>}
 
             <button onClick={handleDownloadAll}>Download All CSVs</button>
+            <button onClick={handleDownloadZip}>Download Branch as Zip</button>
         </div>
     );
 };